@@ -1,12 +1,179 @@
-﻿from flask import Flask, request, jsonify
-import os, time
+﻿from flask import Flask, Response, g, request, stream_with_context
+import os, time, json, gzip, hashlib, random, threading, datetime
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 app = Flask(__name__)
 AGENT = os.environ.get('AGENT_NAME','MOCK')
+COMPRESS_MIN_BYTES = int(os.environ.get('WIRE_COMPRESS_MIN_BYTES', '16384'))
+WIRE_FORMATS = 'msgpack,json' if msgpack else 'json'
+WIRE_ENCODINGS = 'zstd,gzip' if zstandard else 'gzip'
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', '')
+ARTIFACT_MIN_BYTES = int(os.environ.get('ARTIFACT_MIN_BYTES', str(1024 * 1024)))
+PORT = int(os.environ.get('MOCK_PORT', '80'))
+# server span per /run: reported back in Server-Timing and, with MOCK_TRACE_FILE, appended as a JSON line
+# under the caller's W3C traceparent (same line format as the orchestrator's TRACE_FILE)
+TRACE_FILE = os.environ.get('MOCK_TRACE_FILE', '')
+
+# Injected faults. Each setting comes from MOCK_<KEY> (e.g. MOCK_LATENCY_MS), then
+# from this agent's block in MOCK_FAULTS, a JSON object keyed by AGENT_NAME
+# ({"MBO": {"latency_dist": "lognormal", "latency_ms": 80}}), and can be changed
+# at runtime through /control/faults.
+#   latency_dist     fixed | uniform | normal | lognormal | exponential
+#   latency_ms       fixed delay, uniform minimum, normal/exponential mean, lognormal median
+#   jitter_ms        uniform spread, normal standard deviation
+#   latency_sigma    lognormal shape
+#   tail_rate/tail_ms  share of calls that get tail_ms extra (latency spikes)
+#   error_rate / partial_rate / invalid_json_rate / http_error_rate  share of replies
+#   rows             > 0 replaces the canned data with that many mdc-style rows
+#   drip_bytes/drip_ms  send the body in drip_bytes chunks, drip_ms apart
+FAULT_DEFAULTS = {
+    'latency_dist': 'uniform', 'latency_ms': 0.0, 'jitter_ms': 0.0, 'latency_sigma': 0.5,
+    'tail_rate': 0.0, 'tail_ms': 0.0,
+    'error_rate': 0.0, 'partial_rate': 0.0, 'invalid_json_rate': 0.0, 'http_error_rate': 0.0,
+    'rows': 0, 'drip_bytes': 0, 'drip_ms': 0.0,
+}
+LATENCY_DISTS = ('fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+def coerce_faults(updates):
+    # validate against FAULT_DEFAULTS; raises ValueError on unknown keys or bad values
+    out = {}
+    for key, value in updates.items():
+        if key not in FAULT_DEFAULTS:
+            raise ValueError('unknown fault setting %r' % key)
+        default = FAULT_DEFAULTS[key]
+        out[key] = value if isinstance(default, str) else type(default)(value)
+        if key == 'latency_dist' and value not in LATENCY_DISTS:
+            raise ValueError('latency_dist must be one of %s' % ', '.join(LATENCY_DISTS))
+    return out
+
+def env_faults():
+    faults = dict(FAULT_DEFAULTS)
+    faults.update(coerce_faults({k: os.environ['MOCK_' + k.upper()] for k in FAULT_DEFAULTS if 'MOCK_' + k.upper() in os.environ}))
+    per_agent = json.loads(os.environ.get('MOCK_FAULTS', '') or '{}')
+    faults.update(coerce_faults(per_agent.get(AGENT) or per_agent.get(AGENT.lower()) or {}))
+    return faults
+
+faults = env_faults()
+faults_lock = threading.Lock()
+
+def injected_latency(f):
+    dist, ms = f['latency_dist'], f['latency_ms']
+    if dist == 'uniform':
+        ms += random.uniform(0, f['jitter_ms'])
+    elif dist == 'normal':
+        ms = random.gauss(ms, f['jitter_ms'])
+    elif dist == 'lognormal':
+        ms = random.lognormvariate(0, f['latency_sigma']) * ms
+    elif dist == 'exponential':
+        ms = random.expovariate(1.0 / ms) if ms > 0 else 0.0
+    if random.random() < f['tail_rate']:
+        ms += f['tail_ms']
+    return max(ms, 0.0) / 1000.0
+
+def mdc_rows(payload, n):
+    # n rows of mdc-style daily metrics spread over the date range, deterministic for a given payload
+    rng = random.Random(json.dumps(payload, sort_keys=True, default=str))
+    campaigns = payload.get('campaign_ids') or [101]
+    channels = payload.get('channels') or ['email', 'search', 'social']
+    dates = [payload.get('date_from')]
+    try:
+        first = datetime.date.fromisoformat(payload.get('date_from'))
+        span = (datetime.date.fromisoformat(payload.get('date_to') or payload.get('date_from')) - first).days + 1
+        dates = [(first + datetime.timedelta(days=d)).isoformat() for d in range(max(span, 1))]
+    except (TypeError, ValueError):
+        pass
+    rows = []
+    for i in range(n):
+        impressions = rng.randint(500, 5000)
+        clicks = int(impressions * rng.uniform(0.01, 0.08))
+        rows.append({'campaign_id': campaigns[i % len(campaigns)], 'date': dates[(i // len(campaigns)) % len(dates)],
+                     'channel': channels[(i // (len(campaigns) * len(dates))) % len(channels)],
+                     'metrics': {'impressions': impressions, 'clicks': clicks, 'conversions': int(clicks * rng.uniform(0.02, 0.2))},
+                     'confidence': round(rng.uniform(0.8, 1.0), 3)})
+    return rows
+
+def offload(base):
+    # move large data into the shared artifact store, keeping a one-record preview inline;
+    # the file layout and handle are the contract in orchestrator/app.py's artifact store section
+    if not ARTIFACT_DIR:
+        return
+    body = json.dumps(base['data']).encode('utf-8')
+    if len(body) < ARTIFACT_MIN_BYTES:
+        return
+    artifact_id = hashlib.sha256(body).hexdigest()
+    path = os.path.join(ARTIFACT_DIR, artifact_id + '.json')
+    try:
+        # already stored: refresh its age so the orchestrator's artifact pruning keeps it
+        os.utime(path)
+    except FileNotFoundError:
+        tmp = path + '.' + AGENT + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, path)
+    base['artifact'] = {'uri': 'artifact://' + artifact_id, 'size': len(body),
+                        'content_type': 'application/json', 'records': len(base['data'])}
+    base['data'] = base['data'][:1]
+
+def read_request():
+    # body may be msgpack or json, optionally gzip/zstd compressed
+    raw = request.get_data()
+    encoding = request.headers.get('Content-Encoding', '')
+    if encoding == 'gzip':
+        raw = gzip.decompress(raw)
+    elif encoding == 'zstd' and zstandard:
+        raw = zstandard.ZstdDecompressor().decompress(raw)
+    try:
+        if request.mimetype == 'application/msgpack' and msgpack:
+            return msgpack.unpackb(raw, raw=False)
+        return json.loads(raw) if raw else {}
+    except Exception:
+        return {}
+
+def drip(resp, chunk, delay_ms):
+    # slow-drip the (already encoded) body: chunk bytes at a time, delay_ms apart
+    body = resp.get_data()
+    def chunks():
+        for i in range(0, len(body), chunk):
+            if i:
+                time.sleep(delay_ms / 1000.0)
+            yield body[i:i + chunk]
+    dripped = Response(stream_with_context(chunks()), status=resp.status_code, mimetype=resp.mimetype)
+    for key, value in resp.headers.items():
+        if key.lower() not in ('content-type', 'content-length'):
+            dripped.headers[key] = value
+    return dripped
+
+def respond(obj):
+    # answer as envelope+data frame or msgpack when the caller accepts it; gzip large bodies
+    accept = request.headers.get('Accept', '')
+    if 'application/x-eva-frame' in accept:
+        envelope = {k: v for k, v in obj.items() if k != 'data'}
+        envelope['data_sample'] = obj['data'][:1]
+        body = json.dumps(envelope).encode('utf-8') + b'\n' + json.dumps(obj['data']).encode('utf-8')
+        mimetype = 'application/x-eva-frame'
+    elif msgpack and 'application/msgpack' in accept:
+        body, mimetype = msgpack.packb(obj, use_bin_type=True), 'application/msgpack'
+    else:
+        body, mimetype = json.dumps(obj).encode('utf-8'), 'application/json'
+    resp = Response(body, mimetype=mimetype)
+    if len(body) >= COMPRESS_MIN_BYTES and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        resp.set_data(gzip.compress(body, compresslevel=5))
+        resp.headers['Content-Encoding'] = 'gzip'
+    resp.headers['X-Wire-Formats'] = WIRE_FORMATS
+    resp.headers['X-Wire-Encodings'] = WIRE_ENCODINGS
+    return resp
 
 @app.route('/run', methods=['POST'])
 def run():
-    req = request.json or {}
+    req = read_request() or {}
     job = req.get('job')
     # simple canned responses depending on agent
     base = {
@@ -17,7 +184,11 @@ def run():
         'artifact': None,
         'text_report': ''
     }
-    if AGENT == 'MDC':
+    with faults_lock:
+        f = dict(faults)
+    if f['rows'] > 0:
+        base['data'] = mdc_rows(req.get('payload') or {}, f['rows'])
+    elif AGENT == 'MDC':
         base['data'] = [
             {'campaign_id':101,'date':req.get('payload',{}).get('date_from'),'channel':'email','metrics':{'impressions':1000,'clicks':50,'conversions':5},'confidence':0.95}
         ]
@@ -35,7 +206,68 @@ def run():
         base['data'] = [{'forecast':[{'date':'2025-12-01','impressions':1100}]}]
     else:
         base['data'] = [{'note':'generic mock response'}]
-    return jsonify(base)
+    delay = injected_latency(f)
+    if delay:
+        time.sleep(delay)
+    # one roll picks at most one injected outcome, in this order
+    roll = random.random()
+    if roll < f['http_error_rate']:
+        return Response(json.dumps({'status':'error','meta':base['meta'],'issues':[{'type':'injected_http_error','severity':'high'}]}),
+                        status=503, mimetype='application/json')
+    roll -= f['http_error_rate']
+    if roll < f['invalid_json_rate']:
+        return Response(b'{"status": "ok", "data": [', mimetype='application/json')
+    roll -= f['invalid_json_rate']
+    if roll < f['error_rate']:
+        base['status'] = 'error'
+        base['issues'] = [{'type':'injected_error','note':'injected error reply','severity':'high'}]
+        base['data'] = []
+    elif roll < f['error_rate'] + f['partial_rate']:
+        base['status'] = 'partial'
+        base['issues'] = [{'type':'injected_partial','note':'injected partial reply','severity':'medium'}]
+    offload(base)
+    resp = respond(base)
+    if f['drip_bytes'] > 0:
+        return drip(resp, f['drip_bytes'], f['drip_ms'])
+    return resp
+
+@app.before_request
+def start_server_span():
+    g.span_start = time.time()
+
+@app.after_request
+def end_server_span(resp):
+    if request.path != '/run':
+        return resp
+    duration = time.time() - g.span_start
+    # slow-drip bodies are still streaming at this point; the span covers the handler only
+    resp.headers['Server-Timing'] = 'app;dur=%.3f' % (duration * 1000)
+    parts = request.headers.get('traceparent', '').split('-')
+    if TRACE_FILE and len(parts) == 4:
+        span = {'trace_id': parts[1], 'span_id': os.urandom(8).hex(), 'parent_id': parts[2], 'name': 'server',
+                'start': g.span_start, 'duration_s': round(duration, 6), 'status': 'ok' if resp.status_code < 500 else 'error',
+                'attrs': {'agent': AGENT, 'http_status': resp.status_code}}
+        with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'trace_id': parts[1], 'spans': [span]}) + '\n')
+    return resp
+
+@app.route('/control/faults', methods=['GET', 'POST', 'DELETE'])
+def control_faults():
+    # GET shows the active settings, POST merges a JSON object into them, DELETE restores the env settings
+    global faults
+    with faults_lock:
+        if request.method == 'POST':
+            try:
+                faults.update(coerce_faults(request.get_json(force=True) or {}))
+            except (TypeError, ValueError, AttributeError) as e:
+                return {'status':'error','note':str(e)}, 400
+        elif request.method == 'DELETE':
+            faults = env_faults()
+        return {'agent':AGENT,'faults':faults}
+
+@app.route('/health', methods=['GET'])
+def health():
+    return {'status':'ok','agent':AGENT}
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80)
+    app.run(host='0.0.0.0', port=PORT, threaded=True)
@@ -1,12 +1,32 @@
 ﻿# orchestrator/app.py
 # EVA-ECO local orchestrator (enhanced logging + optional Sentry)
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import requests
+import abc
+import asyncio
+import atexit
+import contextlib
+import contextvars
+import datetime
+import functools
+import gzip
+import hashlib
+import json
+import mmap
 import os
+import queue
+import sqlite3
 import time
 import uuid
+import urllib.parse
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+import yaml
+import numpy as np
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 # Optional Sentry integration
@@ -34,10 +54,52 @@ if not os.path.exists(LOG_DIR):
 
 log_file = os.path.join(LOG_DIR, 'orchestrator.log')
 
-formatter = logging.Formatter(
-    '%(asctime)s [%(levelname)s] %(name)s %(message)s',
-    datefmt='%Y-%m-%dT%H:%M:%S'
-)
+# LOG_FORMAT=json emits one compact JSON object per record. request_id and
+# agent come from context variables set by the pipeline, so every line inside
+# a run is tagged without callers passing them; per-event values (attempt,
+# duration_s, http_status, ...) are passed as `extra=` and picked up by name.
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').strip().lower()
+log_request_id = contextvars.ContextVar('log_request_id', default=None)
+log_agent = contextvars.ContextVar('log_agent', default=None)
+LOG_FIELDS = ('job', 'attempt', 'duration_s', 'http_status', 'status', 'age_s')
+
+class LogContextFilter(logging.Filter):
+    """Copy the run context onto the record on the calling thread (before any queue hop)."""
+
+    def filter(self, record):
+        record.request_id = log_request_id.get()
+        record.agent = log_agent.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id is not None:
+            event['request_id'] = request_id
+        agent = getattr(record, 'agent', None)
+        if agent is not None:
+            event['agent'] = agent
+        for field in LOG_FIELDS:
+            value = record.__dict__.get(field)
+            if value is not None:
+                event[field] = value
+        if record.exc_info:
+            event['exc'] = self.formatException(record.exc_info)
+        return json.dumps(event, separators=(',', ':'), default=str)
+
+if LOG_FORMAT == 'json':
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter(
+        '%(asctime)s [%(levelname)s] %(name)s %(message)s',
+        datefmt='%Y-%m-%dT%H:%M:%S'
+    )
 
 # Console handler
 ch = logging.StreamHandler()
@@ -49,13 +111,64 @@ fh = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=3, encoding
 fh.setLevel(logging.INFO)
 fh.setFormatter(formatter)
 
+# LOG_MODE=queue: request threads only enqueue the raw record; a background
+# listener formats it and writes to console/file, so rollover and disk I/O
+# never block a request. The queue is bounded (LOG_QUEUE_SIZE); when it is
+# full LOG_OVERFLOW=drop (default) discards the record and counts it, while
+# LOG_OVERFLOW=block waits for room.
+LOG_MODE = os.environ.get('LOG_MODE', 'sync').strip().lower()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_OVERFLOW = os.environ.get('LOG_OVERFLOW', 'drop').strip().lower()
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that defers formatting to the listener and applies an overflow policy."""
+
+    def __init__(self, log_queue, overflow):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = {}
+        self.drop_lock = threading.Lock()
+
+    def prepare(self, record):
+        # keep msg/args unmerged: the listener thread does the formatting
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.drop_lock:
+                self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+
+    def stats(self):
+        return {'mode': 'queue', 'overflow': self.overflow, 'queue_size': self.queue.qsize(),
+                'queue_max': self.queue.maxsize, 'dropped': dict(self.dropped)}
+
 # Configure app logger
 app.logger.setLevel(logging.INFO)
 # Remove default handlers and set ours
 if app.logger.handlers:
     app.logger.handlers = []
-app.logger.addHandler(ch)
-app.logger.addHandler(fh)
+log_queue_handler = None
+if LOG_MODE == 'queue':
+    log_queue_handler = BoundedQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE), LOG_OVERFLOW)
+    log_listener = QueueListener(log_queue_handler.queue, ch, fh, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    app.logger.addHandler(log_queue_handler)
+else:
+    app.logger.addHandler(ch)
+    app.logger.addHandler(fh)
+if LOG_FORMAT == 'json':
+    app.logger.addFilter(LogContextFilter())
+
+def logging_stats():
+    if log_queue_handler is None:
+        return {'mode': 'sync'}
+    return log_queue_handler.stats()
 
 # Also configure 'requests' logger to WARNING to avoid noisy logs
 requests_log = logging.getLogger("requests")
@@ -70,80 +183,2379 @@ AGENTS = [
     ('mbo', 'http://mbo:80/run'),
     ('ftm', 'http://ftm:80/run'),
 ]
+# AGENT_URLS overrides endpoints for running outside compose, e.g. "mdc=http://127.0.0.1:8101/run,mar=..."
+_agent_urls = dict(item.split('=', 1) for item in os.environ.get('AGENT_URLS', '').split(',') if '=' in item)
+AGENTS = [(name, _agent_urls.get(name, url).strip()) for name, url in AGENTS]
+
+# --- agent policy ----------------------------------------------------------
+POLICY_FILE = os.environ.get('AGENT_POLICY_FILE', '/app/agent_policy.yml')
+agent_policy = {}
+try:
+    if os.path.exists(POLICY_FILE):
+        with open(POLICY_FILE, 'r', encoding='utf-8-sig') as f:
+            agent_policy = yaml.safe_load(f) or {}
+        app.logger.info("Loaded agent policy from %s", POLICY_FILE)
+    else:
+        app.logger.info("No agent policy found at %s, using defaults", POLICY_FILE)
+except Exception:
+    app.logger.exception("Failed loading agent policy, using defaults")
+
+def policy_for(name):
+    """Return the policy block for one agent (empty dict if missing)."""
+    p = agent_policy.get(name) if isinstance(agent_policy, dict) else None
+    return p if isinstance(p, dict) else {}
 
-# Utility: safe json from response
-def safe_json(resp):
+# --- connection pools ------------------------------------------------------
+# One keep-alive session per agent so consecutive hops reuse TCP connections
+# instead of opening a new one per call. Pool size comes from `pool_size` in
+# agent_policy.yml, falling back to AGENT_POOL_SIZE.
+DEFAULT_POOL_SIZE = int(os.environ.get('AGENT_POOL_SIZE', '10'))
+_sessions = {}
+_pool_sizes = {}
+_pool_active = {}
+_sessions_lock = threading.Lock()
+
+def get_session(name):
+    """Return the shared pooled session for agent `name`, creating it on first use."""
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            pool_size = int(policy_for(name).get('pool_size', DEFAULT_POOL_SIZE))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            session = requests.Session()
+            session.headers['Connection'] = 'keep-alive'
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _pool_sizes[name] = pool_size
+            _pool_active[name] = 0
+            _sessions[name] = session
+    return session
+
+def pooled_post(name, url, **kwargs):
+    """POST through the agent's pooled session, tracking in-flight requests."""
+    session = get_session(name)
+    with _sessions_lock:
+        _pool_active[name] += 1
     try:
-        return resp.json()
-    except Exception:
+        return session.post(url, **kwargs)
+    finally:
+        with _sessions_lock:
+            _pool_active[name] -= 1
+
+def pool_stats():
+    """
+    Snapshot of connection pool usage per agent.
+    active = requests currently in flight, idle = open connections parked in
+    the pool, reused = requests served without opening a new connection.
+    """
+    stats = {}
+    for name, session in list(_sessions.items()):
+        adapter = session.get_adapter('http://')
+        entry = {'pool_size': _pool_sizes[name], 'active': _pool_active[name], 'idle': 0, 'opened': 0, 'requests': 0, 'reused': 0}
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            try:
+                entry['idle'] += sum(1 for c in list(pool.pool.queue) if c is not None)
+            except Exception:
+                pass
+            entry['opened'] += pool.num_connections
+            entry['requests'] += pool.num_requests
+        entry['reused'] = max(entry['requests'] - entry['opened'], 0)
+        stats[name] = entry
+    return stats
+
+# --- tracing -------------------------------------------------------------------
+# Every run records a tree of spans: a root `run` span, an `agent` span per
+# agent call with `queue` (concurrency slot), `executor_wait` (sync engine
+# thread pool), `serialize`, one `attempt` per HTTP try with its `decode`, and
+# `backoff` sleeps, plus `shard`, `aggregate` and `quality_gates`. Attempts
+# carry the agent's own time from its Server-Timing header and, on the async
+# engine, pool wait and connect time. Each attempt sends a W3C `traceparent`
+# header so agents can record their server span under the same trace.
+# TRACE_FILE appends every finished trace as one JSON line, encoded and
+# written by a background thread (never the engine loop); a run payload with
+# `"trace": true` gets a summary in final_report. TRACING=0 turns it all off.
+TRACING = os.environ.get('TRACING', '1') != '0'
+TRACE_FILE = os.environ.get('TRACE_FILE', '').strip()
+TRACE_HEADER = 'traceparent'
+current_span = contextvars.ContextVar('current_span', default=None)
+_trace_exports = queue.Queue()
+_trace_writer = None
+_trace_writer_lock = threading.Lock()
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.request_id = None
+        self.spans = []
+
+def _new_span(trace, parent, name, start, attrs):
+    return {'trace_id': trace.trace_id, 'span_id': os.urandom(8).hex(),
+            'parent_id': parent['span_id'] if parent else None,
+            'name': name, 'start': start, 'attrs': attrs, 'status': 'ok'}
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Record a child span of the current one; yields the span dict, or None outside a traced run."""
+    ctx = current_span.get()
+    if ctx is None:
+        yield None
+        return
+    trace, parent = ctx
+    record = _new_span(trace, parent, name, time.time(), attrs)
+    token = current_span.set((trace, record))
+    try:
+        yield record
+    except BaseException as e:
+        record['status'] = 'cancelled' if isinstance(e, asyncio.CancelledError) else 'error'
+        record['attrs']['error'] = repr(e)
+        raise
+    finally:
+        record['duration_s'] = round(time.time() - record['start'], 6)
+        current_span.reset(token)
+        trace.spans.append(record)
+
+def record_span(name, start, **attrs):
+    """Record an already finished span that began at `start` and ends now."""
+    ctx = current_span.get()
+    if ctx is not None:
+        record = _new_span(ctx[0], ctx[1], name, start, attrs)
+        record['duration_s'] = round(time.time() - start, 6)
+        ctx[0].spans.append(record)
+
+def annotate(record, **attrs):
+    if isinstance(record, dict):
+        record['attrs'].update(attrs)
+
+def trace_headers(headers):
+    """Copy of `headers` with the current span as W3C trace context."""
+    ctx = current_span.get()
+    if ctx is None or ctx[1] is None:
+        return headers
+    return {**headers, TRACE_HEADER: f'00-{ctx[0].trace_id}-{ctx[1]["span_id"]}-01'}
+
+def server_time(headers):
+    """Seconds the agent reported in `Server-Timing: app;dur=<ms>`, or None."""
+    for metric in (headers.get('Server-Timing') or '').split(','):
+        name, _, params = metric.strip().partition(';')
+        if name == 'app':
+            for param in params.split(';'):
+                key, _, value = param.strip().partition('=')
+                if key == 'dur':
+                    try:
+                        return round(float(value) / 1000.0, 6)
+                    except ValueError:
+                        return None
+    return None
+
+@contextlib.contextmanager
+def trace_run():
+    """Open a new trace with its root `run` span; yields the Trace, or None when tracing is off."""
+    if not TRACING:
+        yield None
+        return
+    trace = Trace()
+    token = current_span.set((trace, None))
+    try:
+        with span('run'):
+            yield trace
+    finally:
+        current_span.reset(token)
+
+def export_trace(trace):
+    """Queue `trace` for the TRACE_FILE writer thread (started on first use)."""
+    global _trace_writer
+    if not TRACE_FILE:
+        return
+    if _trace_writer is None:
+        with _trace_writer_lock:
+            if _trace_writer is None:
+                _trace_writer = threading.Thread(target=_write_traces, name='trace-writer', daemon=True)
+                _trace_writer.start()
+                atexit.register(flush_traces)
+    _trace_exports.put(trace)
+
+def _write_traces():
+    while True:
+        traces = [_trace_exports.get()]
+        while True:
+            try:
+                traces.append(_trace_exports.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            lines = [json.dumps({'trace_id': t.trace_id, 'request_id': t.request_id,
+                                 'spans': sorted(t.spans, key=lambda sp: sp['start'])}, default=str) + '\n'
+                     for t in traces]
+            with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        except Exception:
+            app.logger.exception("Cannot write trace to %s", TRACE_FILE)
+        finally:
+            for _ in traces:
+                _trace_exports.task_done()
+
+def flush_traces():
+    """Block until every queued trace has been written."""
+    _trace_exports.join()
+
+def trace_summary(trace):
+    """Per-span-name totals and a per-agent split of where the time went."""
+    root = next((sp for sp in trace.spans if sp['parent_id'] is None), None)
+    by_name = {}
+    agents = {}
+    for sp in trace.spans:
+        totals = by_name.setdefault(sp['name'], {'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+        totals['count'] += 1
+        totals['total_s'] = round(totals['total_s'] + sp['duration_s'], 6)
+        totals['max_s'] = max(totals['max_s'], sp['duration_s'])
+        agent = sp['attrs'].get('agent')
+        if agent is None:
+            continue
+        a = agents.setdefault(agent, {'calls': 0, 'attempts': 0, 'total_s': 0.0, 'queue_s': 0.0, 'executor_wait_s': 0.0,
+                                      'serialize_s': 0.0, 'server_s': 0.0, 'network_s': 0.0, 'decode_s': 0.0, 'backoff_s': 0.0})
+        if sp['name'] == 'agent':
+            a['calls'] += 1
+            a['total_s'] += sp['duration_s']
+        elif sp['name'] == 'attempt':
+            a['attempts'] += 1
+            a['server_s'] += sp['attrs'].get('server_s') or 0.0
+            a['network_s'] += sp['duration_s'] - (sp['attrs'].get('server_s') or 0.0) - (sp['attrs'].get('decode_s') or 0.0)
+        elif sp['name'] in ('queue', 'executor_wait', 'serialize', 'decode', 'backoff'):
+            a[sp['name'] + '_s'] += sp['duration_s']
+    return {
+        'trace_id': trace.trace_id,
+        'duration_s': root['duration_s'] if root else None,
+        'spans': len(trace.spans),
+        'by_name': by_name,
+        'agents': {name: {k: round(v, 6) if isinstance(v, float) else v for k, v in a.items()} for name, a in agents.items()},
+        'file': TRACE_FILE or None,
+    }
+
+# --- deadlines -----------------------------------------------------------------
+# A run may carry a time budget: `deadline` (epoch seconds) or `budget_s`
+# (seconds from the start of the run) in the /run body, or the equivalent
+# X-Request-Deadline / X-Request-Budget headers. PIPELINE_DEADLINE_S is the
+# default budget for runs without one (0 = unbounded). Before each agent call
+# the time left is split evenly over that agent and the longest chain of
+# agents still waiting on it, so one slow retry cannot starve the rest. Every
+# attempt's timeout and backoff is capped at the agent's share, the deadline is
+# forwarded to the agent, and an agent whose share is used up fails with a
+# `deadline_exceeded` issue instead of being called.
+PIPELINE_DEADLINE_S = float(os.environ.get('PIPELINE_DEADLINE_S', '0'))
+DEADLINE_HEADER = 'X-Request-Deadline'
+BUDGET_HEADER = 'X-Request-Budget'
+run_deadline = contextvars.ContextVar('run_deadline', default=None)
+call_deadline = contextvars.ContextVar('call_deadline', default=None)
+
+def deadline_fields(payload, header=None):
+    """`deadline`/`budget_s` from a run payload, falling back to request headers via `header(name)`."""
+    fields = {}
+    for key, name in (('deadline', DEADLINE_HEADER), ('budget_s', BUDGET_HEADER)):
+        value = payload.get(key)
+        if value is None and header is not None:
+            value = header(name)
+        if value in (None, ''):
+            continue
+        try:
+            fields[key] = float(value)
+        except (TypeError, ValueError):
+            app.logger.warning("Ignoring invalid %s=%r", key, value)
+    return fields
+
+def resolve_deadline(payload, start):
+    """Absolute deadline for a run starting at `start`, or None when it has no budget."""
+    fields = deadline_fields(payload)
+    candidates = []
+    if 'deadline' in fields:
+        candidates.append(fields['deadline'])
+    if 'budget_s' in fields:
+        candidates.append(start + fields['budget_s'])
+    if not candidates and PIPELINE_DEADLINE_S > 0:
+        candidates.append(start + PIPELINE_DEADLINE_S)
+    return min(candidates) if candidates else None
+
+def time_left(deadline):
+    return None if deadline is None else deadline - time.time()
+
+def attempt_timeout(base_timeout, attempt):
+    """Timeout for one attempt, capped at the call's budget; None once the budget is spent."""
+    timeout = base_timeout * (2 ** (attempt - 1))  # exponential backoff
+    remaining = time_left(call_deadline.get())
+    if remaining is None:
+        return timeout
+    return min(timeout, remaining) if remaining > 0 else None
+
+def backoff_delay(attempt):
+    """Sleep before the next attempt, or None when no time would be left for it."""
+    delay = 1 * attempt
+    remaining = time_left(call_deadline.get())
+    if remaining is not None and remaining <= delay:
         return None
+    return delay
 
-def call_agent(name, url, job, payload, max_retries=3, base_timeout=20):
+def deadline_headers(headers, timeout):
+    """Copy of `headers` telling the agent when the orchestrator stops waiting."""
+    deadline = call_deadline.get()
+    if deadline is None:
+        return headers
+    return {**headers, DEADLINE_HEADER: f'{min(deadline, time.time() + timeout):.3f}',
+            BUDGET_HEADER: f'{timeout:.3f}'}
+
+def deadline_failure(name, job, attempt, last_exc=None):
+    """Error envelope for a call whose budget ran out."""
+    note = f'deadline exceeded after {attempt} attempt(s)'
+    if last_exc is not None:
+        note += f'; last error: {last_exc}'
+    app.logger.error("Deadline exceeded for agent %s after %s attempt(s)", name, attempt, extra={'attempt': attempt})
+    return 0, {
+        'status': 'error',
+        'meta': {'agent': name, 'job': job},
+        'issues': [{'type': 'deadline_exceeded', 'note': note, 'severity': 'high'}],
+        '_call_meta': {'http_status': 0, 'duration_s': 0.0, 'attempt': attempt, 'deadline_exceeded': True}
+    }
+
+# --- wire format -------------------------------------------------------------
+# Agents advertise what they can read with X-Wire-Formats / X-Wire-Encodings
+# response headers. Until an agent has advertised msgpack, requests go out as
+# JSON; afterwards they are msgpack-encoded, and bodies of at least
+# WIRE_COMPRESS_MIN_BYTES are compressed (zstd if both sides have it, else
+# gzip). Responses are negotiated with Accept / Accept-Encoding. Set
+# `wire_format: json` in agent_policy.yml to pin an agent to plain JSON.
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+WIRE_COMPRESS_MIN_BYTES = int(os.environ.get('WIRE_COMPRESS_MIN_BYTES', '16384'))
+WIRE_MIMETYPES = {'msgpack': 'application/msgpack', 'json': 'application/json'}
+_wire_caps = {}
+
+# Pass-through mode (DATA_PASSTHROUGH=1, or `passthrough: true|false` per agent
+# in agent_policy.yml): the orchestrator asks for an application/x-eva-frame
+# reply, i.e. one line of envelope JSON (status, meta, issues, data_sample)
+# followed by the raw JSON array of `data`. Only the envelope line is parsed;
+# the data bytes are kept as RawJSON and spliced verbatim into the next
+# agent's request body. Pass-through requests, and any request carrying
+# RawJSON, are always JSON.
+DATA_PASSTHROUGH = os.environ.get('DATA_PASSTHROUGH', '0') == '1'
+FRAME_MIMETYPE = 'application/x-eva-frame'
+
+class RawJSON(bytes):
+    """An already-encoded JSON array carried through the pipeline without decoding."""
+
+    def records(self):
+        return json.loads(self) if self.strip() else []
+
+def agent_data(resp):
     """
-    Call agent with retries, exponential backoff and structured error handling.
-    Returns (http_status_or_0, response_json_or_error_dict)
+    The `data` records of an agent response, decoding pass-through bytes or
+    loading the artifact the agent stored its output in.
     """
-    req = {
+    if is_artifact(resp.get('artifact')):
+        if artifact_store is None:
+            raise RuntimeError('agent returned an artifact but ARTIFACT_DIR is not configured')
+        view = artifact_store.read(resp['artifact'])
+        try:
+            # decode straight from the mapping: bytes(view) would copy the whole file first
+            data = json.loads(str(view, 'utf-8')) if len(view) else []
+        finally:
+            if isinstance(view, mmap.mmap):
+                view.close()
+        resp['artifact'] = None
+        resp['data'] = data
+        return data
+    data = resp.get('data')
+    if isinstance(data, RawJSON):
+        data = resp['data'] = data.records()
+    return data or []
+
+def merge_data(parts):
+    """Concatenate several agents' `data`, splicing RawJSON arrays without decoding them."""
+    if len(parts) == 1 and isinstance(parts[0], RawJSON):
+        return parts[0]
+    if parts and all(isinstance(p, RawJSON) for p in parts):
+        items = [p.strip()[1:-1].strip() for p in parts]
+        return RawJSON(b'[' + b','.join(i for i in items if i) + b']')
+    merged = []
+    for part in parts:
+        merged.extend(part.records() if isinstance(part, RawJSON) else (part or []))
+    return merged
+
+def dumps_with_raw(obj):
+    """json.dumps to bytes, writing any RawJSON values out verbatim."""
+    raws = []
+
+    def hold(value):
+        if isinstance(value, RawJSON):
+            raws.append(value)
+            return f'\x00raw{len(raws) - 1}\x00'
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+    body = json.dumps(obj, separators=(',', ':'), default=hold).encode('utf-8')
+    for i, raw in enumerate(raws):
+        body = body.replace(json.dumps(f'\x00raw{i}\x00').encode('utf-8'), bytes(raw), 1)
+    return body
+
+def passthrough_for(name):
+    return bool(policy_for(name).get('passthrough', DATA_PASSTHROUGH))
+
+def wire_format_for(name):
+    if msgpack is None or policy_for(name).get('wire_format', 'auto') == 'json':
+        return 'json'
+    return 'msgpack' if 'msgpack' in _wire_caps.get(name, {}).get('formats', ()) else 'json'
+
+def holds_raw(payload):
+    """True when `payload` carries pass-through bytes (merge_data puts them at the top level)."""
+    return isinstance(payload, dict) and any(isinstance(v, RawJSON) for v in payload.values())
+
+def encode_agent_request(name, req):
+    """Serialize an agent envelope. Returns (body_bytes, headers)."""
+    # RawJSON can only be spliced into JSON; msgpack would ship it as an opaque binary blob
+    fmt = 'json' if passthrough_for(name) or holds_raw(req.get('payload')) else wire_format_for(name)
+    if fmt == 'msgpack':
+        body = msgpack.packb(req, use_bin_type=True)
+    else:
+        body = dumps_with_raw(req)
+    headers = {'Content-Type': WIRE_MIMETYPES[fmt]}
+    if passthrough_for(name):
+        headers['Accept'] = FRAME_MIMETYPE + ', application/json;q=0.9'
+    elif msgpack is not None and policy_for(name).get('wire_format', 'auto') != 'json':
+        headers['Accept'] = 'application/msgpack, application/json;q=0.9'
+    else:
+        headers['Accept'] = 'application/json'
+    if len(body) >= WIRE_COMPRESS_MIN_BYTES:
+        encodings = _wire_caps.get(name, {}).get('encodings', ())
+        if zstandard is not None and 'zstd' in encodings:
+            body = zstandard.ZstdCompressor().compress(body)
+            headers['Content-Encoding'] = 'zstd'
+        elif 'gzip' in encodings:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+def decode_agent_response(name, headers, raw):
+    """Decode an agent body (already transfer-decoded) and remember what the agent supports."""
+    formats = headers.get('X-Wire-Formats')
+    if formats is not None:
+        _wire_caps[name] = {
+            'formats': {f.strip() for f in formats.split(',')},
+            'encodings': {e.strip() for e in headers.get('X-Wire-Encodings', '').split(',') if e.strip()}
+        }
+    content_type = headers.get('Content-Type', '')
+    try:
+        if FRAME_MIMETYPE in content_type:
+            head, _, data = raw.partition(b'\n')
+            j = json.loads(head)
+            if isinstance(j, dict):
+                j['_data_sample'] = j.pop('data_sample', [])
+                j['data'] = RawJSON(data)
+        elif 'application/msgpack' in content_type and msgpack is not None:
+            j = msgpack.unpackb(raw, raw=False)
+        else:
+            j = json.loads(raw)
+    except Exception:
+        return None
+    return j if isinstance(j, dict) else None
+
+def agent_request(job, payload):
+    """Envelope sent to every agent."""
+    return {
         'job': job,
         'input_timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
         'payload': payload,
         'request_id': str(uuid.uuid4())
     }
 
-    app.logger.info(f"Calling agent {name} at {url} job={job} payload_keys={list(payload.keys()) if isinstance(payload, dict) else 'raw'}")
+def agent_response(name, job, http_status, j, duration, attempt):
+    """Turn a decoded agent reply into the (status, json) pair returned by call_agent."""
+    if j is None:
+        # malformed response from agent
+        app.logger.error("Agent %s returned non-JSON (http_status=%s).", name, http_status, extra={'http_status': http_status})
+        return 0, {
+            'status': 'error',
+            'meta': {'agent': name, 'job': job},
+            'issues': [{'type': 'parse_error', 'note': 'invalid json from agent', 'severity': 'high'}],
+            'raw_status': http_status
+        }
+    # attach call metadata for provenance
+    j['_call_meta'] = {
+        'http_status': http_status,
+        'duration_s': round(duration, 3),
+        'attempt': attempt
+    }
+    app.logger.info("Agent %s responded http_status=%s duration_s=%.3f attempt=%s", name, http_status, duration, attempt,
+                    extra={'http_status': http_status, 'duration_s': round(duration, 3), 'attempt': attempt})
+    return http_status, j
+
+def agent_failure(name, job, last_exc):
+    """Error envelope returned once all retries are exhausted."""
+    app.logger.error("All retries failed for agent %s: last_exception=%r", name, last_exc)
+    return 0, {
+        'status': 'error',
+        'meta': {'agent': name, 'job': job},
+        'issues': [{'type': 'connection_error', 'note': str(last_exc), 'severity': 'high'}]
+    }
+
+def call_agent(name, url, job, payload, max_retries=3, base_timeout=20):
+    """
+    Call agent with retries, exponential backoff and structured error handling.
+    Returns (http_status_or_0, response_json_or_error_dict)
+    """
+    req = agent_request(job, payload)
+    with span('serialize', agent=name) as sp:
+        body, headers = encode_agent_request(name, req)
+        annotate(sp, bytes=len(body))
+
+    app.logger.info("Calling agent %s at %s job=%s payload_keys=%s", name, url, job,
+                    list(payload.keys()) if isinstance(payload, dict) else 'raw', extra={'job': job})
     attempt = 0
     last_exc = None
     while attempt < max_retries:
         attempt += 1
-        timeout = base_timeout * (2 ** (attempt - 1))  # exponential backoff
+        timeout = attempt_timeout(base_timeout, attempt)
+        if timeout is None:
+            return deadline_failure(name, job, attempt - 1, last_exc)
+        with span('attempt', agent=name, attempt=attempt, timeout_s=round(timeout, 3)) as sp:
+            try:
+                start = time.time()
+                r = pooled_post(name, url, data=body, headers=trace_headers(deadline_headers(headers, timeout)), timeout=timeout)
+                duration = time.time() - start
+                annotate(sp, http_status=r.status_code, bytes=len(r.content), server_s=server_time(r.headers),
+                         headers_s=round(r.elapsed.total_seconds(), 6))
+                decode_start = time.time()
+                with span('decode', agent=name):
+                    j = decode_agent_response(name, r.headers, r.content)
+                annotate(sp, decode_s=round(time.time() - decode_start, 6))
+                return agent_response(name, job, r.status_code, j, duration, attempt)
+            except RequestException as e:
+                last_exc = e
+                annotate(sp, error=repr(e))
+                if sp is not None:
+                    sp['status'] = 'error'
+                app.logger.warning("Call to %s failed on attempt %s: %r", name, attempt, e, extra={'attempt': attempt})
+        if attempt >= max_retries:
+            break
+        # small backoff, skipped when the budget leaves no room for another attempt
+        delay = backoff_delay(attempt)
+        if delay is None:
+            return deadline_failure(name, job, attempt, last_exc)
+        with span('backoff', agent=name, delay_s=delay):
+            time.sleep(delay)
+
+    # all retries failed
+    return agent_failure(name, job, last_exc)
+
+# --- artifact store ------------------------------------------------------------
+# Large agent outputs can travel out of band. An agent writes its data to the
+# shared store (ARTIFACT_DIR, a volume mounted by the orchestrator and every
+# agent) and returns an `artifact` handle instead of the records; its inline
+# `data` is then at most a preview. The orchestrator hands the handle on to
+# dependent agents as `input_artifacts` and lists every handle under
+# `artifacts` in final_report, only reading the bytes when it needs the
+# records itself. Nothing else deletes from the volume, so a background thread
+# removes files last written more than ARTIFACT_TTL_S ago (and abandoned .tmp
+# files) every ARTIFACT_PRUNE_INTERVAL_S; 0 disables it. The default outlives
+# the 7-day checkpoint retention so a resumable run keeps its inputs, and
+# storing content that already exists refreshes its age.
+# The volume layout is the contract with the agents, which write to it
+# themselves (mocks/app.py offload() follows it, tests/test_artifacts.py holds
+# both sides to it): an artifact is the file <sha256 hex of its bytes>.json,
+# written under a name ending in .tmp in the same directory and renamed into
+# place; storing bytes whose file exists only refreshes its mtime. Its handle
+# is {'uri': 'artifact://<id>', 'size', 'content_type', 'records'}.
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', '').strip()
+ARTIFACT_TTL_S = float(os.environ.get('ARTIFACT_TTL_S', str(8 * 24 * 3600)))
+ARTIFACT_PRUNE_INTERVAL_S = float(os.environ.get('ARTIFACT_PRUNE_INTERVAL_S', '3600'))
+
+class ArtifactStore(abc.ABC):
+    """Interface every artifact backend implements."""
+
+    @abc.abstractmethod
+    def put(self, body, content_type='application/json', records=None):
+        """Store bytes and return a handle dict."""
+
+    @abc.abstractmethod
+    def read(self, handle):
+        """Return a bytes-like view of the artifact behind `handle`."""
+
+class FileArtifactStore(ArtifactStore):
+    """Content-addressed files under one directory; reads are memory-mapped."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        if ARTIFACT_TTL_S > 0:
+            threading.Thread(target=self._pruner, name='artifact-pruner', daemon=True).start()
+
+    def _pruner(self):
+        while True:
+            try:
+                self.prune()
+            except Exception:
+                app.logger.exception("Artifact prune failed in %s", self.directory)
+            time.sleep(ARTIFACT_PRUNE_INTERVAL_S)
+
+    def prune(self, ttl_s=None):
+        """Delete artifacts and temp files last written more than `ttl_s` (default ARTIFACT_TTL_S) ago; returns the count."""
+        ttl_s = ARTIFACT_TTL_S if ttl_s is None else ttl_s
+        cutoff = time.time() - ttl_s
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(('.json', '.tmp')):
+                    continue
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            app.logger.info("Pruned %s artifact files older than %ss from %s", removed, ttl_s, self.directory)
+        return removed
+
+    def path(self, handle):
+        artifact_id = handle['uri'].rsplit('/', 1)[-1]
+        if not artifact_id.isalnum():
+            raise ValueError(f'invalid artifact id {artifact_id!r}')
+        return os.path.join(self.directory, artifact_id + '.json')
+
+    def put(self, body, content_type='application/json', records=None):
+        artifact_id = hashlib.sha256(body).hexdigest()
+        handle = {'uri': f'artifact://{artifact_id}', 'size': len(body), 'content_type': content_type}
+        if records is not None:
+            handle['records'] = records
+        path = self.path(handle)
         try:
-            start = time.time()
-            r = requests.post(url, json=req, timeout=timeout)
-            duration = time.time() - start
-            j = safe_json(r)
-            if j is None:
-                # malformed response from agent
-                app.logger.error(f"Agent {name} returned non-JSON (http_status={r.status_code}).")
-                return 0, {
-                    'status': 'error',
-                    'meta': {'agent': name, 'job': job},
-                    'issues': [{'type': 'parse_error', 'note': 'invalid json from agent', 'severity': 'high'}],
-                    'raw_status': r.status_code
-                }
-            # attach call metadata for provenance
-            j['_call_meta'] = {
-                'http_status': r.status_code,
-                'duration_s': round(duration, 3),
-                'attempt': attempt
-            }
-            app.logger.info(f"Agent {name} responded http_status={r.status_code} duration_s={round(duration,3)} attempt={attempt}")
-            return r.status_code, j
-        except RequestException as e:
-            last_exc = e
-            app.logger.warning(f"Call to {name} failed on attempt {attempt}: {repr(e)}")
-            # small backoff
-            time.sleep(1 * attempt)
-            continue
+            # same content already stored: only refresh its age for prune()
+            os.utime(path)
+        except FileNotFoundError:
+            tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        return handle
+
+    def read(self, handle):
+        with open(self.path(handle), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+artifact_store = None
+if ARTIFACT_DIR:
+    try:
+        artifact_store = FileArtifactStore(ARTIFACT_DIR)
+    except Exception:
+        app.logger.exception("Cannot open artifact store at %s; artifacts disabled", ARTIFACT_DIR)
+
+def is_artifact(handle):
+    return isinstance(handle, dict) and str(handle.get('uri', '')).startswith('artifact://')
+
+# --- result cache ------------------------------------------------------------
+# Agent responses keyed by agent + canonical hash of (job, payload). Only
+# agents with `cache_ttl_s` in agent_policy.yml are cached, and only `ok`
+# responses are stored. Entries live in an LRU bounded by CACHE_MAX_BYTES of
+# serialized JSON; with CACHE_DIR set they are also written to disk so they
+# survive restarts. Keys, lookups and stores run in worker threads, never on
+# the engine loop.
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+CACHE_DIR = os.environ.get('CACHE_DIR', '').strip()
+
+def cache_key(name, job, payload):
+    canonical = json.dumps({'job': job, 'payload': payload}, sort_keys=True, separators=(',', ':'), default=str)
+    return name + '-' + hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """Thread-safe TTL + LRU cache of agent responses with an optional on-disk tier."""
+
+    def __init__(self, max_bytes, directory=''):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = OrderedDict()  # key -> (expires_at, stored_at, status_code, body_bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except Exception:
+                app.logger.exception("Cannot create cache dir %s; disk cache disabled", directory)
+                self.directory = ''
+
+    def get(self, key):
+        """Return (status_code, response_copy, age_s) or None."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None and self.directory:
+            entry = self._read_disk(key, now)
+            if entry is not None:
+                self._remember(key, entry)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        expires_at, stored_at, status_code, body = entry
+        return status_code, json.loads(body), now - stored_at
+
+    def put(self, key, status_code, resp, ttl):
+        body = dumps_with_raw({k: v for k, v in resp.items() if not k.startswith('_')})
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        entry = (now + ttl, now, status_code, body)
+        self._remember(key, entry)
+        if self.directory:
+            self._write_disk(key, entry)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'disk_dir': self.directory or None}
+
+    def _remember(self, key, entry):
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = entry
+            self.size += len(entry[3])
+            while self.size > self.max_bytes and self.entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[3])
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _read_disk(self, key, now):
+        try:
+            with open(self._path(key), 'rb') as f:
+                stored = json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception:
+            app.logger.warning("Unreadable cache file for %s; ignoring", key)
+            return None
+        if stored['expires_at'] <= now:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+        return stored['expires_at'], stored['stored_at'], stored['status_code'], stored['body'].encode('utf-8')
+
+    def _write_disk(self, key, entry):
+        expires_at, stored_at, status_code, body = entry
+        # per-thread temp name: puts of the same key can now run concurrently
+        tmp = '%s.%d.tmp' % (self._path(key), threading.get_ident())
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'stored_at': stored_at,
+                           'status_code': status_code, 'body': body.decode('utf-8')}, f)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            app.logger.warning("Failed writing cache file for %s", key)
+
+result_cache = ResultCache(CACHE_MAX_BYTES, CACHE_DIR)
+
+# --- metrics -------------------------------------------------------------------
+# Prometheus text exposition on GET /metrics. All updates happen on the engine
+# loop thread (invoke_agent / execute_pipeline), so counters are plain ints
+# with no locking on the request path; a scrape reads them as-is.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+PIPELINE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self.agent_latency = {}   # agent -> Histogram
+        self.agent_calls = {}     # (agent, status, source) -> count
+        self.agent_retries = {}   # agent -> count
+        self.hedges = {}          # agent -> count
+        self.pipeline_latency = Histogram(PIPELINE_BUCKETS)
+        self.runs = {}            # status -> count
+        self.runs_in_flight = 0
+
+    def observe_call(self, name, resp):
+        call_meta = resp.get('_call_meta') or {}
+        if call_meta.get('cache') == 'hit':
+            source = 'cache'
+        elif call_meta.get('circuit') == 'open':
+            source = 'circuit_open'
+        elif call_meta.get('shed'):
+            source = 'shed'
+        elif call_meta.get('deadline_exceeded'):
+            source = 'deadline'
+        else:
+            source = 'agent'
+            hist = self.agent_latency.get(name)
+            if hist is None:
+                hist = self.agent_latency[name] = Histogram(LATENCY_BUCKETS)
+            hist.observe(call_meta.get('duration_s', 0.0))
+            if call_meta.get('attempt', 1) > 1:
+                self.agent_retries[name] = self.agent_retries.get(name, 0) + call_meta['attempt'] - 1
+            if call_meta.get('hedged'):
+                self.hedges[name] = self.hedges.get(name, 0) + 1
+        key = (name, resp.get('status', 'error'), source)
+        self.agent_calls[key] = self.agent_calls.get(key, 0) + 1
+
+    def observe_run(self, duration, status):
+        self.pipeline_latency.observe(duration)
+        self.runs[status] = self.runs.get(status, 0) + 1
+
+    def render(self):
+        lines = []
+
+        def family(metric, kind, help_text):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+
+        def labels(**kv):
+            return '{' + ','.join(f'{k}="{v}"' for k, v in kv.items()) + '}'
+
+        def histogram(metric, hist, **kv):
+            cumulative = 0
+            for bound, count in zip(hist.buckets + ('+Inf',), hist.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{labels(**kv, le=bound)} {cumulative}")
+            lines.append(f"{metric}_sum{labels(**kv) if kv else ''} {round(hist.sum, 6)}")
+            lines.append(f"{metric}_count{labels(**kv) if kv else ''} {hist.count}")
+
+        family('eva_agent_call_duration_seconds', 'histogram', 'Agent call latency (last attempt).')
+        for name, hist in sorted(self.agent_latency.items()):
+            histogram('eva_agent_call_duration_seconds', hist, agent=name)
+        family('eva_agent_calls_total', 'counter', 'Agent calls by resulting status and source.')
+        for (name, status, source), count in sorted(self.agent_calls.items()):
+            lines.append(f"eva_agent_calls_total{labels(agent=name, status=status, source=source)} {count}")
+        family('eva_agent_retries_total', 'counter', 'Retry attempts after a failed agent call.')
+        for name, count in sorted(self.agent_retries.items()):
+            lines.append(f"eva_agent_retries_total{labels(agent=name)} {count}")
+        family('eva_agent_hedged_total', 'counter', 'Calls that sent a hedged second request.')
+        for name, count in sorted(self.hedges.items()):
+            lines.append(f"eva_agent_hedged_total{labels(agent=name)} {count}")
+        family('eva_pipeline_duration_seconds', 'histogram', 'End-to-end pipeline duration.')
+        histogram('eva_pipeline_duration_seconds', self.pipeline_latency)
+        family('eva_runs_total', 'counter', 'Completed pipeline runs by final status.')
+        for status, count in sorted(self.runs.items()):
+            lines.append(f"eva_runs_total{labels(status=status)} {count}")
+        family('eva_runs_in_flight', 'gauge', 'Pipeline runs currently executing.')
+        lines.append(f"eva_runs_in_flight {self.runs_in_flight}")
+        family('eva_jobs_queued', 'gauge', 'Async jobs waiting for a worker.')
+        lines.append(f"eva_jobs_queued {job_queue_stats()['queued']}")
+
+        log_stats = logging_stats()
+        if log_stats['mode'] == 'queue':
+            family('eva_log_dropped_total', 'counter', 'Log records dropped because the log queue was full.')
+            for level, count in sorted(log_stats['dropped'].items()):
+                lines.append(f"eva_log_dropped_total{labels(level=level)} {count}")
+            family('eva_log_queue_size', 'gauge', 'Log records waiting for the background writer.')
+            lines.append(f"eva_log_queue_size {log_stats['queue_size']}")
+
+        family('eva_agent_concurrency_limit', 'gauge', 'Current adaptive concurrency limit per agent.')
+        for name, limiter in sorted(_limiters.items()):
+            lines.append(f"eva_agent_concurrency_limit{labels(agent=name)} {round(limiter.limit, 2)}")
+        family('eva_agent_in_flight', 'gauge', 'Agent calls holding a concurrency slot.')
+        for name, limiter in sorted(_limiters.items()):
+            lines.append(f"eva_agent_in_flight{labels(agent=name)} {limiter.in_flight}")
+        family('eva_agent_queued', 'gauge', 'Agent calls waiting for a concurrency slot.')
+        for name, limiter in sorted(_limiters.items()):
+            lines.append(f"eva_agent_queued{labels(agent=name)} {len(limiter.waiters)}")
+
+        family('eva_circuit_open', 'gauge', 'Circuit breaker state per agent (0 closed, 1 half_open, 2 open).')
+        for name, breaker in sorted(_breakers.items()):
+            lines.append(f"eva_circuit_open{labels(agent=name)} {('closed', 'half_open', 'open').index(breaker.state)}")
+
+        cache = result_cache.stats()
+        for key, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                          ('entries', 'gauge'), ('bytes', 'gauge')):
+            metric = f"eva_cache_{key}_total" if kind == 'counter' else f"eva_cache_{key}"
+            family(metric, kind, f"Agent result cache {key}.")
+            lines.append(f"{metric} {cache[key]}")
+
+        pools = {**pool_stats(), **async_pool_stats()}
+        family('eva_pool_connections', 'gauge', 'Agent connection pool usage.')
+        for name, entry in sorted(pools.items()):
+            for state in ('active', 'idle'):
+                if entry[state] is not None:
+                    lines.append(f"eva_pool_connections{labels(agent=name, state=state)} {entry[state]}")
+        family('eva_pool_reused_total', 'counter', 'Agent requests served on a reused connection.')
+        for name, entry in sorted(pools.items()):
+            lines.append(f"eva_pool_reused_total{labels(agent=name)} {entry['reused']}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# --- async engine ------------------------------------------------------------
+# ORCH_ENGINE=async runs agent calls on aiohttp so waiting on an agent does not
+# hold a thread. ORCH_ENGINE=sync (default) keeps using requests, dispatched to
+# a bounded thread pool. Either way the pipeline itself runs as a coroutine on
+# a single engine loop, so both modes share one execution path.
+ENGINE = os.environ.get('ORCH_ENGINE', 'sync').strip().lower()
+AGENT_WORKERS = int(os.environ.get('AGENT_WORKERS', '32'))
+
+try:
+    import aiohttp
+except Exception:
+    aiohttp = None
+
+USE_ASYNC_HTTP = ENGINE == 'async' and aiohttp is not None
+if ENGINE == 'async' and aiohttp is None:
+    app.logger.warning("ORCH_ENGINE=async but aiohttp is not installed; agent calls use the thread pool")
+
+_agent_executor = ThreadPoolExecutor(max_workers=AGENT_WORKERS, thread_name_prefix='agent')
+_engine_loop = None
+_engine_lock = threading.Lock()
+_async_sessions = {}
+
+def bind_engine_loop(loop):
+    """Use an externally managed loop (e.g. the ASGI server's) as the engine loop."""
+    global _engine_loop
+    with _engine_lock:
+        if _engine_loop is None:
+            _engine_loop = loop
+    return _engine_loop
+
+def engine_loop():
+    """Return the engine loop, starting a background one on first use."""
+    global _engine_loop
+    with _engine_lock:
+        if _engine_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='orchestrator-engine', daemon=True).start()
+            _engine_loop = loop
+    return _engine_loop
+
+def run_in_engine(coro):
+    """Run a coroutine on the engine loop from a worker thread and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, engine_loop()).result()
+
+def get_async_session(name):
+    """Return the aiohttp session for agent `name`; must be called on the engine loop."""
+    session = _async_sessions.get(name)
+    if session is None:
+        pool_size = int(policy_for(name).get('pool_size', DEFAULT_POOL_SIZE))
+        stats = {'opened': 0, 'reused': 0}
+
+        # the attempt span rides along as trace_request_ctx and collects pool wait and connect time
+        async def on_queued(session, ctx, params):
+            ctx.queued_at = time.time()
+
+        async def on_dequeued(session, ctx, params):
+            annotate(ctx.trace_request_ctx, pool_wait_s=round(time.time() - ctx.queued_at, 6))
+
+        async def on_connect(session, ctx, params):
+            ctx.connect_at = time.time()
+
+        async def on_create(session, ctx, params):
+            stats['opened'] += 1
+            if hasattr(ctx, 'connect_at'):
+                annotate(ctx.trace_request_ctx, connect_s=round(time.time() - ctx.connect_at, 6))
+
+        async def on_reuse(session, ctx, params):
+            stats['reused'] += 1
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(on_queued)
+        trace.on_connection_queued_end.append(on_dequeued)
+        trace.on_connection_create_start.append(on_connect)
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        connector = aiohttp.TCPConnector(limit_per_host=pool_size, keepalive_timeout=30)
+        session = aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+        session.pool_stats = stats
+        _async_sessions[name] = session
+        _pool_sizes[name] = pool_size
+        _pool_active.setdefault(name, 0)
+    return session
+
+def async_pool_stats():
+    """Pool usage for the aiohttp sessions, in the same shape as pool_stats()."""
+    stats = {}
+    for name, session in list(_async_sessions.items()):
+        opened = session.pool_stats['opened']
+        reused = session.pool_stats['reused']
+        stats[name] = {
+            'pool_size': _pool_sizes[name],
+            'active': _pool_active.get(name, 0),
+            'idle': None,
+            'opened': opened,
+            'requests': opened + reused,
+            'reused': reused
+        }
+    return stats
+
+async def close_async_sessions():
+    for name in list(_async_sessions):
+        await _async_sessions.pop(name).close()
+
+async def call_agent_async(name, url, job, payload, max_retries=3, base_timeout=20):
+    """
+    aiohttp counterpart of call_agent: same retries, backoff and return contract,
+    but timeouts and backoff sleeps yield the loop instead of blocking a thread.
+    """
+    req = agent_request(job, payload)
+    with span('serialize', agent=name) as sp:
+        body, headers = encode_agent_request(name, req)
+        annotate(sp, bytes=len(body))
+
+    app.logger.info("Calling agent %s at %s job=%s payload_keys=%s", name, url, job,
+                    list(payload.keys()) if isinstance(payload, dict) else 'raw', extra={'job': job})
+    session = get_async_session(name)
+    attempt = 0
+    last_exc = None
+    while attempt < max_retries:
+        attempt += 1
+        timeout = attempt_timeout(base_timeout, attempt)
+        if timeout is None:
+            return deadline_failure(name, job, attempt - 1, last_exc)
+        _pool_active[name] += 1
+        with span('attempt', agent=name, attempt=attempt, timeout_s=round(timeout, 3)) as sp:
+            try:
+                start = time.time()
+                async with session.post(url, data=body, headers=trace_headers(deadline_headers(headers, timeout)),
+                                        timeout=aiohttp.ClientTimeout(total=timeout), trace_request_ctx=sp) as r:
+                    http_status = r.status
+                    raw = await r.read()
+                    annotate(sp, http_status=http_status, bytes=len(raw), server_s=server_time(r.headers))
+                    decode_start = time.time()
+                    with span('decode', agent=name):
+                        j = decode_agent_response(name, r.headers, raw)
+                    annotate(sp, decode_s=round(time.time() - decode_start, 6))
+                duration = time.time() - start
+                return agent_response(name, job, http_status, j, duration, attempt)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_exc = e
+                annotate(sp, error=repr(e))
+                if sp is not None:
+                    sp['status'] = 'error'
+                app.logger.warning("Call to %s failed on attempt %s: %r", name, attempt, e, extra={'attempt': attempt})
+            finally:
+                _pool_active[name] -= 1
+        if attempt >= max_retries:
+            break
+        # small backoff, skipped when the budget leaves no room for another attempt
+        delay = backoff_delay(attempt)
+        if delay is None:
+            return deadline_failure(name, job, attempt, last_exc)
+        with span('backoff', agent=name, delay_s=delay):
+            await asyncio.sleep(delay)
 
     # all retries failed
-    app.logger.error(f"All retries failed for agent {name}: last_exception={repr(last_exc)}")
+    return agent_failure(name, job, last_exc)
+
+# --- circuit breakers and hedging ----------------------------------------------
+# Each agent has a breaker (closed -> open -> half_open) fed by the outcome of
+# every invoke_agent() call: transport failures, invalid JSON and HTTP 5xx
+# count as failures. After `breaker_threshold` consecutive failures the
+# breaker opens and calls fail immediately for `breaker_reset_s`; then a
+# single probe (one attempt, no retries) decides whether it closes again.
+# Agents with `hedge: true` send a second request once the first has been
+# outstanding longer than the agent's observed p95 latency; the first usable
+# answer wins. The hedge takes its own concurrency slot and is skipped when
+# the agent's limit has none free, so max_concurrency still caps requests;
+# whichever request is left over is cancelled, also when the caller is.
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET_S = 30.0
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', '20'))
+
+class CircuitBreaker:
+    """Per-agent breaker state; only touched from the engine loop."""
+
+    def __init__(self, threshold, reset_s):
+        self.threshold = threshold
+        self.reset_s = reset_s
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        if self.state == 'open':
+            if time.time() - self.opened_at < self.reset_s:
+                return False
+            self.state = 'half_open'
+        if self.state == 'half_open':
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, ok):
+        self.probing = False
+        if ok:
+            self.failures = 0
+            self.state = 'closed'
+            return
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.threshold:
+            self.state = 'open'
+            self.opened_at = time.time()
+
+    def abandon(self):
+        """A call ended without an outcome (cancelled); a half-open probe is handed to the next call."""
+        self.probing = False
+
+    def snapshot(self):
+        return {'state': self.state, 'failures': self.failures, 'threshold': self.threshold,
+                'reset_s': self.reset_s, 'opened_at': self.opened_at or None}
+
+_breakers = {}
+_latencies = {}
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        p = policy_for(name)
+        breaker = _breakers[name] = CircuitBreaker(
+            int(p.get('breaker_threshold', DEFAULT_BREAKER_THRESHOLD)),
+            float(p.get('breaker_reset_s', DEFAULT_BREAKER_RESET_S)))
+    return breaker
+
+def record_latency(name, duration):
+    _latencies.setdefault(name, deque(maxlen=200)).append(duration)
+
+def hedge_delay(name):
+    """Seconds to wait before hedging a call to `name`, or None when hedging is off."""
+    if not policy_for(name).get('hedge'):
+        return None
+    samples = _latencies.get(name)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+async def dispatch_call(name, url, job, payload, max_retries, base_timeout):
+    """One call_agent run on the configured engine."""
+    if USE_ASYNC_HTTP:
+        return await call_agent_async(name, url, job, payload, max_retries=max_retries, base_timeout=base_timeout)
+    loop = asyncio.get_running_loop()
+    # run_in_executor does not carry context variables over; copy them so the
+    # worker thread's log lines keep request_id/agent
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _agent_executor, functools.partial(ctx.run, _call_in_worker, time.time(), name, url, job, payload, max_retries, base_timeout))
+
+def _call_in_worker(submitted, name, *args):
+    record_span('executor_wait', submitted, agent=name)
+    return call_agent(name, *args)
+
+async def call_with_hedge(name, url, job, payload, max_retries, base_timeout, limiter):
+    """dispatch_call(), hedged per `name`'s policy; the caller holds one of `limiter`'s slots for the primary."""
+    delay = hedge_delay(name)
+    primary = asyncio.ensure_future(dispatch_call(name, url, job, payload, max_retries, base_timeout))
+    hedge = None
+    try:
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        if not limiter.try_acquire():
+            app.logger.info("Not hedging call to %s: no free concurrency slot", name)
+            return await primary
+
+        app.logger.info("Hedging call to %s after %.3fs", name, delay)
+        hedge = asyncio.ensure_future(dispatch_call(name, url, job, payload, 1, base_timeout))
+        hedge.add_done_callback(lambda _: limiter.release())
+        pending = {primary, hedge}
+        fallback = None
+        winner = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                status_code, resp = task.result()
+                if status_code:
+                    winner = (task, status_code, resp)
+                    break
+                if task is primary or fallback is None:
+                    fallback = (task, status_code, resp)
+    finally:
+        for task in (primary, hedge):
+            if task is not None and not task.done():
+                task.cancel()
+    task, status_code, resp = winner or fallback
+    resp.setdefault('_call_meta', {}).update({'hedged': True, 'hedge_won': task is hedge})
+    return status_code, resp
+
+def circuit_open_response(name, job, breaker):
     return 0, {
         'status': 'error',
         'meta': {'agent': name, 'job': job},
-        'issues': [{'type': 'connection_error', 'note': str(last_exc), 'severity': 'high'}]
+        'issues': [{'type': 'circuit_open', 'severity': 'high',
+                    'note': f'circuit open after {breaker.failures} consecutive failures; retry after {breaker.reset_s}s'}],
+        '_call_meta': {'http_status': 0, 'duration_s': 0.0, 'attempt': 0, 'circuit': 'open'}
     }
 
-# Health check
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'ok', 'service': 'eva-eco-orchestrator'}), 200
+# --- concurrency limits ---------------------------------------------------------
+# Each agent gets an AIMD concurrency limit on the engine loop. The limit grows
+# by ~1 per window of calls while latency stays within LIMIT_LATENCY_TOLERANCE
+# times the best latency seen recently, and shrinks by 10% on slow calls or
+# failures. `max_concurrency` / `min_concurrency` in agent_policy.yml bound it
+# (a static cap is simply max_concurrency with min_concurrency equal to it).
+# Calls beyond the limit queue for at most `queue_timeout_s` and never past
+# the run deadline; a call is shed up front when the expected queue wait plus
+# the agent's typical latency already exceeds the time the run has left.
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('AGENT_MAX_CONCURRENCY', '64'))
+DEFAULT_QUEUE_TIMEOUT_S = float(os.environ.get('AGENT_QUEUE_TIMEOUT_S', '10'))
+LIMIT_LATENCY_TOLERANCE = float(os.environ.get('LIMIT_LATENCY_TOLERANCE', '2.0'))
 
-# Main runner
-@app.route('/run', methods=['POST'])
-def run():
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a FIFO of waiters; only touched from the engine loop."""
+
+    def __init__(self, min_limit, max_limit, queue_timeout):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(min_limit, 8), max_limit))
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters = deque()
+        self.best_latency = None
+        self.avg_latency = None
+        self.shed = 0
+
+    def expected_wait(self):
+        if not self.waiters and self.in_flight < int(self.limit):
+            return 0.0
+        return (len(self.waiters) + 1) / max(int(self.limit), 1) * (self.avg_latency or 0.0)
+
+    async def acquire(self, deadline):
+        """Take a slot; returns False if none freed up before the queue timeout or `deadline`."""
+        if self.try_acquire():
+            return True
+        timeout = self.queue_timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+        if timeout <= 0:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as the caller was cancelled; pass it on
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def try_acquire(self):
+        """Take a slot only if one is free right now, without queueing."""
+        if self.waiters or self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self, latency=None, ok=True):
+        """Free a slot; `latency` (None when no call was made) and `ok` drive the AIMD update."""
+        self.in_flight -= 1
+        if latency is not None:
+            self.avg_latency = latency if self.avg_latency is None else 0.9 * self.avg_latency + 0.1 * latency
+            # let the baseline drift up slowly so one lucky sample does not pin it forever
+            self.best_latency = latency if self.best_latency is None else min(latency, self.best_latency * 1.01)
+            if ok and latency <= self.best_latency * LIMIT_LATENCY_TOLERANCE:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(True)
+
+    def snapshot(self):
+        return {'limit': round(self.limit, 2), 'min': self.min_limit, 'max': self.max_limit,
+                'in_flight': self.in_flight, 'queued': len(self.waiters), 'shed': self.shed,
+                'avg_latency_s': round(self.avg_latency, 4) if self.avg_latency is not None else None}
+
+_limiters = {}
+
+def get_limiter(name):
+    limiter = _limiters.get(name)
+    if limiter is None:
+        p = policy_for(name)
+        max_limit = int(p.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        limiter = _limiters[name] = AdaptiveLimiter(
+            min(int(p.get('min_concurrency', 1)), max_limit), max_limit,
+            float(p.get('queue_timeout_s', DEFAULT_QUEUE_TIMEOUT_S)))
+    return limiter
+
+def shed_response(name, job, reason):
+    return 0, {
+        'status': 'error',
+        'meta': {'agent': name, 'job': job},
+        'issues': [{'type': 'shed', 'severity': 'high', 'note': reason}],
+        '_call_meta': {'http_status': 0, 'duration_s': 0.0, 'attempt': 0, 'shed': True}
+    }
+
+async def invoke_agent(name, url, job, payload, max_retries=3, base_timeout=20):
+    """
+    Call one agent from the engine loop using whichever engine is configured,
+    serving it from the result cache when the agent has a cache_ttl_s and
+    failing fast while the agent's circuit breaker is open.
+    """
+    with span('agent', agent=name) as sp:
+        status_code, resp = await _invoke_agent(name, url, job, payload, max_retries, base_timeout)
+        meta = resp.get('_call_meta') or {}
+        annotate(sp, status=resp.get('status'), http_status=status_code,
+                 **{k: meta[k] for k in ('cache', 'circuit', 'shed', 'deadline_exceeded', 'hedged') if k in meta})
+        return status_code, resp
+
+async def _invoke_agent(name, url, job, payload, max_retries, base_timeout):
+    log_agent.set(name)
+    ttl = float(policy_for(name).get('cache_ttl_s', 0) or 0)
+    key = None
+    if ttl > 0:
+        # hashing the payload (a dependent's is its upstream's full output) and
+        # decoding or encoding entries are CPU and disk work: keep them off the loop
+        key = await asyncio.to_thread(cache_key, name, job, payload)
+        cached = await asyncio.to_thread(result_cache.get, key)
+        if cached is not None:
+            status_code, resp, age = cached
+            resp['_call_meta'] = {'http_status': status_code, 'duration_s': 0.0, 'attempt': 0,
+                                  'cache': 'hit', 'cache_age_s': round(age, 3)}
+            app.logger.info("Agent %s served from cache age_s=%.3f", name, age, extra={'age_s': round(age, 3)})
+            metrics.observe_call(name, resp)
+            return status_code, resp
+
+    deadline = run_deadline.get()
+    if deadline is not None and time.time() >= deadline:
+        status_code, resp = deadline_failure(name, job, 0)
+        metrics.observe_call(name, resp)
+        return status_code, resp
+    limiter = get_limiter(name)
+    if deadline is not None and limiter.expected_wait() + (limiter.avg_latency or 0.0) > deadline - time.time():
+        limiter.shed += 1
+        app.logger.warning("Shedding call to %s: run deadline cannot be met", name)
+        status_code, resp = shed_response(name, job, 'run deadline cannot be met at current agent latency')
+        metrics.observe_call(name, resp)
+        return status_code, resp
+    with span('queue', agent=name) as sp:
+        acquired = await limiter.acquire(deadline)
+        annotate(sp, acquired=acquired, limit=round(limiter.limit, 2))
+    if not acquired:
+        limiter.shed += 1
+        app.logger.warning("Shedding call to %s: no concurrency slot within queue timeout", name)
+        status_code, resp = shed_response(name, job, f'no concurrency slot for {name} within queue timeout')
+        metrics.observe_call(name, resp)
+        return status_code, resp
+
+    breaker = get_breaker(name)
+    if not breaker.allow():
+        limiter.release()
+        app.logger.warning("Circuit open for agent %s; failing fast", name)
+        status_code, resp = circuit_open_response(name, job, breaker)
+        metrics.observe_call(name, resp)
+        return status_code, resp
+    if breaker.state == 'half_open':
+        app.logger.info("Circuit half-open for agent %s; sending probe", name)
+        max_retries = 1
+
+    start = time.time()
+    token = call_deadline.set(agent_deadline(name, deadline))
+    try:
+        status_code, resp = await call_with_hedge(name, url, job, payload, max_retries, base_timeout, limiter)
+    except asyncio.CancelledError:
+        # cancelled by the caller (e.g. a sibling shard failed): says nothing about the agent's health
+        limiter.release()
+        breaker.abandon()
+        raise
+    except BaseException:
+        limiter.release()
+        breaker.record(False)
+        raise
+    finally:
+        call_deadline.reset(token)
+    ok = 0 < status_code < 500
+    limiter.release(time.time() - start, ok)
+    breaker.record(ok)
+    if status_code:
+        record_latency(name, resp.get('_call_meta', {}).get('duration_s', 0.0))
+    metrics.observe_call(name, resp)
+
+    if key is not None:
+        resp.setdefault('_call_meta', {})['cache'] = 'miss'
+        if resp.get('status') == 'ok':
+            await asyncio.to_thread(result_cache.put, key, status_code, resp, ttl)
+    return status_code, resp
+
+# --- checkpoints -----------------------------------------------------------------
+# Every run's payload and each agent's successful output are written to a local
+# SQLite database (CHECKPOINT_DB, WAL mode) under the run's request_id.
+# POST /run/<request_id>/resume reruns only the agents without a checkpoint,
+# feeding dependents from the stored outputs. Writes are queued to a single
+# writer thread, so encoding large outputs and disk I/O never run on the engine
+# loop. Only unfinished and failed runs keep their agent outputs (a finished
+# run cannot be resumed), and the writer prunes runs older than
+# CHECKPOINT_TTL_S every CHECKPOINT_PRUNE_INTERVAL_S. Set CHECKPOINT_DB to an
+# empty string to disable.
+DATA_DIR = os.environ.get('DATA_DIR', '/app/data')
+if not os.path.exists(DATA_DIR):
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+    except Exception:
+        DATA_DIR = '.'
+CHECKPOINT_DB = os.environ.get('CHECKPOINT_DB', os.path.join(DATA_DIR, 'checkpoints.sqlite')).strip()
+CHECKPOINT_TTL_S = float(os.environ.get('CHECKPOINT_TTL_S', str(7 * 24 * 3600)))
+CHECKPOINT_PRUNE_INTERVAL_S = float(os.environ.get('CHECKPOINT_PRUNE_INTERVAL_S', '3600'))
+
+class CheckpointStore:
+    """SQLite run store; writes are applied in order by a background thread, reads wait for them."""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS runs (request_id TEXT PRIMARY KEY, payload TEXT, status TEXT, '
+                        'created_at REAL, updated_at REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints (request_id TEXT, agent TEXT, response BLOB, '
+                        'created_at REAL, PRIMARY KEY (request_id, agent))')
+        self.writes = queue.Queue()
+        self.pruned_at = 0.0
+        threading.Thread(target=self._writer, name='checkpoint-writer', daemon=True).start()
+
+    def _writer(self):
+        while True:
+            try:
+                op = self.writes.get(timeout=CHECKPOINT_PRUNE_INTERVAL_S)
+            except queue.Empty:
+                op = None
+            try:
+                if op is not None:
+                    op()
+                if time.time() - self.pruned_at >= CHECKPOINT_PRUNE_INTERVAL_S:
+                    self.prune()
+            except Exception:
+                app.logger.exception("Checkpoint write failed")
+            finally:
+                if op is not None:
+                    self.writes.task_done()
+
+    def flush(self):
+        """Block until every queued write has been applied."""
+        self.writes.join()
+
+    def prune(self):
+        self.pruned_at = time.time()
+        cutoff = self.pruned_at - CHECKPOINT_TTL_S
+        with self.lock:
+            self.db.execute('DELETE FROM checkpoints WHERE request_id IN (SELECT request_id FROM runs WHERE updated_at < ?)', (cutoff,))
+            self.db.execute('DELETE FROM runs WHERE updated_at < ?', (cutoff,))
+
+    def save_run(self, request_id, payload, resume=False):
+        """
+        Mark a run as running. A new run replaces whatever an earlier run with
+        the same request_id stored, payload and checkpoints alike; a resume
+        keeps both.
+        """
+        self.writes.put(functools.partial(self._save_run, request_id, json.dumps(payload, default=str), resume, time.time()))
+
+    def _save_run(self, request_id, payload, resume, now):
+        with self.lock:
+            if resume:
+                self.db.execute('UPDATE runs SET status = ?, updated_at = ? WHERE request_id = ?', ('running', now, request_id))
+                return
+            self.db.execute('BEGIN')
+            try:
+                self.db.execute('DELETE FROM checkpoints WHERE request_id = ?', (request_id,))
+                self.db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)', (request_id, payload, 'running', now, now))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def finish_run(self, request_id, status):
+        """Record the final status; finished runs cannot be resumed, so their agent outputs are dropped."""
+        self.writes.put(functools.partial(self._finish_run, request_id, status, time.time()))
+
+    def _finish_run(self, request_id, status, now):
+        with self.lock:
+            self.db.execute('UPDATE runs SET status = ?, updated_at = ? WHERE request_id = ?', (status, now, request_id))
+            if status in ('ok', 'partial'):
+                self.db.execute('DELETE FROM checkpoints WHERE request_id = ?', (request_id,))
+
+    def save_agent(self, request_id, agent, resp):
+        # shallow snapshot: the pipeline may swap resp['data'] for decoded records while the write is queued
+        snapshot = {k: v for k, v in resp.items() if k != '_data_sample'}
+        self.writes.put(functools.partial(self._save_agent, request_id, agent, snapshot, time.time()))
+
+    def _save_agent(self, request_id, agent, resp, now):
+        body = dumps_with_raw(resp)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)', (request_id, agent, body, now))
+
+    def load(self, request_id):
+        """Return (payload, status, {agent: response}) or None if the run is unknown. Blocks on queued writes."""
+        self.flush()
+        with self.lock:
+            row = self.db.execute('SELECT payload, status FROM runs WHERE request_id = ?', (request_id,)).fetchone()
+            if row is None:
+                return None
+            rows = self.db.execute('SELECT agent, response FROM checkpoints WHERE request_id = ?', (request_id,)).fetchall()
+        return json.loads(row[0]), row[1], {agent: json.loads(body) for agent, body in rows}
+
+checkpoints = None
+if CHECKPOINT_DB:
+    try:
+        checkpoints = CheckpointStore(CHECKPOINT_DB)
+    except Exception:
+        app.logger.exception("Cannot open checkpoint db %s; checkpoints disabled", CHECKPOINT_DB)
+
+# --- aggregation ---------------------------------------------------------------
+# aggregated_outputs is computed from the agents' records. mdc rows
+# (campaign_id, date, channel, metrics.{impressions,clicks,conversions}) are read
+# in a single np.fromiter pass into a (campaign_id, date, channel) key column and
+# float columns, factorized once with np.unique over the key hashes and summed
+# per key with np.bincount. Every other rollup (by campaign, channel, date, the
+# mbo economics join, the daily partials) regroups those per-key sums, so only
+# that first pass touches every row; rates are computed array-wide.
+METRIC_FIELDS = ('impressions', 'clicks', 'conversions')
+METRIC_RATES = {'ctr': ('clicks', 'impressions'), 'cvr': ('conversions', 'clicks')}
+ECONOMICS_FIELDS = ('spend', 'revenue')
+GROUP_FIELDS = ('campaign_id', 'date', 'channel')
+MDC_COLUMNS = METRIC_FIELDS + ('confidence', 'rows')
+
+def to_number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def flatten(records, key):
+    """Rows nested under `key` (e.g. mbo's economics_summary), or the records themselves."""
+    rows = []
+    for r in records:
+        if not isinstance(r, dict):
+            continue
+        nested = r.get(key)
+        if isinstance(nested, list):
+            rows.extend(x for x in nested if isinstance(x, dict))
+        else:
+            rows.append(r)
+    return rows
+
+def factorize(values):
+    """
+    Integer code per value plus the distinct values in first-seen order.
+    Values are told apart like dict keys: np.unique groups them by hash and a
+    vectorized == check confirms every group; only keys whose hashes collide
+    (e.g. -1 and -2, or NaN) are numbered through a dict instead.
+    """
+    if not isinstance(values, np.ndarray):
+        values = np.fromiter(values, dtype=object, count=len(values))
+    hashes = np.fromiter(map(hash, values), dtype=np.int64, count=len(values))
+    distinct, codes = np.unique(hashes, return_inverse=True)
+    codes = codes.ravel()
+    first = np.full(len(distinct), len(values))
+    np.minimum.at(first, codes, np.arange(len(values)))
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    codes = rank[codes]
+    uniques = values[first[order]]
+    if not (uniques[codes] == values).all():
+        index = {}
+        codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int64, count=len(values))
+        return codes, list(index)
+    return codes, uniques.tolist()
+
+def column(values):
+    """Values as a float column; missing or non-numeric values count as 0."""
+    try:
+        # bulk C conversion; only fall back to per-value parsing on None or junk
+        col = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        col = None
+    if col is None or col.ndim != 1:
+        col = np.fromiter(map(to_number, values), dtype=np.float64, count=len(values))
+    return np.nan_to_num(col)
+
+def group_sums(codes, size, columns):
+    """{name: per-group sums} of `columns` grouped by `codes`."""
+    return {name: np.bincount(codes, weights=col, minlength=size) for name, col in columns.items()}
+
+def ratio(num, den):
+    """Elementwise num / den, 0 where den is 0."""
+    num = np.asarray(num, dtype=np.float64)
+    den = np.asarray(den, dtype=np.float64)
+    return np.divide(num, den, out=np.zeros_like(num), where=den != 0)
+
+def table(key_names, keys, sums, rates):
+    """One dict per group: its key fields, the summed columns and the derived rates."""
+    cols = {name: col.tolist() for name, col in sums.items()}
+    cols.update({name: ratio(sums[a], sums[b]).tolist() for name, (a, b) in rates.items()})
+    rows = []
+    for i, key in enumerate(keys):
+        row = dict(zip(key_names, key if len(key_names) > 1 else (key,)))
+        row.update({name: round(col[i], 6) for name, col in cols.items()})
+        rows.append(row)
+    return rows
+
+def totals(sums, rates):
+    out = {name: round(float(col.sum()), 6) for name, col in sums.items()}
+    out.update({name: round(out[a] / out[b], 6) if out[b] else 0.0 for name, (a, b) in rates.items()})
+    return out
+
+def mdc_groups(rows, partials=False):
+    """
+    mdc rows summed per (campaign_id, date, channel): the distinct keys in
+    first-seen order, {column: per-key sums} and the number of rows. The
+    columns are METRIC_FIELDS; `partials` adds confidence, rows and `weighted`
+    (confidence x impressions), which daily_partials() needs, and keys on the
+    ISO day of `date`, so '2025-11-28T00:00:00Z' counts for 2025-11-28.
+    """
+    fields = MDC_COLUMNS if partials else METRIC_FIELDS
+
+    def records():
+        if partials:
+            return (((r.get('campaign_id'), str(r.get('date'))[:10], r.get('channel')), m.get('impressions'),
+                     m.get('clicks'), m.get('conversions'), r.get('confidence'), r.get('rows', 1))
+                    for r in rows for m in (r.get('metrics') or {},))
+        return (((r.get('campaign_id'), r.get('date'), r.get('channel')), m.get('impressions'), m.get('clicks'),
+                 m.get('conversions'))
+                for r in rows for m in (r.get('metrics') or {},))
+
+    try:
+        data = np.fromiter(records(), dtype=[('key', object)] + [(f, np.float64) for f in fields], count=len(rows))
+    except (TypeError, ValueError):
+        # None or junk in a numeric field: read the values as they are and let column() parse them
+        data = np.fromiter(records(), dtype=[('key', object)] + [(f, object) for f in fields], count=len(rows))
+    cols = {f: column(data[f]) for f in fields}
+    if partials:
+        cols['weighted'] = cols['confidence'] * cols['impressions']
+    codes, keys = factorize(data['key'])
+    return keys, group_sums(codes, len(keys), cols), len(rows)
+
+def rollup(keys, sums, by, fields=METRIC_FIELDS):
+    """Per-key `fields` sums from mdc_groups() regrouped by the key fields `by`: (groups, sums)."""
+    at = [GROUP_FIELDS.index(f) for f in by]
+    codes, groups = factorize([k[at[0]] for k in keys] if len(at) == 1 else [tuple(k[i] for i in at) for k in keys])
+    return groups, group_sums(codes, len(groups), {f: sums[f] for f in fields})
+
+def grouped(keys, sums, by, rates):
+    return table(by, *rollup(keys, sums, by), rates)
+
+def metrics_summary(keys, sums, n):
+    return {
+        'rows': n,
+        'totals': totals({f: sums[f] for f in METRIC_FIELDS}, METRIC_RATES),
+        'by_campaign': grouped(keys, sums, ('campaign_id',), METRIC_RATES),
+        'by_channel': grouped(keys, sums, ('channel',), METRIC_RATES),
+        'by_date': grouped(keys, sums, ('date',), METRIC_RATES),
+    }
+
+def economics(econ_rows, keys, sums):
+    """Spend/revenue per campaign joined with mdc clicks and conversions: ROAS, CPC, CPA."""
+    n = len(econ_rows)
+    spend = column([r.get('spend') for r in econ_rows])
+    # agents that only report roas imply revenue = spend * roas
+    revenue = column([r['revenue'] if r.get('revenue') is not None else to_number(r.get('spend')) * to_number(r.get('roas'))
+                      for r in econ_rows])
+    codes, campaigns = factorize([r.get('campaign_id') for r in econ_rows])
+    econ = group_sums(codes, len(campaigns), {'spend': spend, 'revenue': revenue})
+
+    m_campaigns, m_sums = rollup(keys, sums, ('campaign_id',), ('clicks', 'conversions'))
+    # align mdc sums to the economics campaigns; campaigns mdc did not report count as 0
+    position = {c: i for i, c in enumerate(m_campaigns)}
+    take = np.array([position.get(c, -1) for c in campaigns], dtype=np.int64)
+    for f, col in m_sums.items():
+        econ[f] = np.append(col, 0.0)[take]
+    rates = {'roas': ('revenue', 'spend'), 'cpc': ('spend', 'clicks'), 'cpa': ('spend', 'conversions')}
+    return {
+        'rows': n,
+        'totals': totals(econ, rates),
+        'by_campaign': table(('campaign_id',), campaigns, econ, rates),
+    }
+
+def funnel_reports(step_rows, metric_totals):
+    """Media funnel from mdc totals plus step-to-step conversion of cfa's funnel steps."""
+    report = {'media': {
+        'impressions': metric_totals.get('impressions', 0.0),
+        'clicks': metric_totals.get('clicks', 0.0),
+        'conversions': metric_totals.get('conversions', 0.0),
+        'click_rate': metric_totals.get('ctr', 0.0),
+        'conversion_rate': metric_totals.get('cvr', 0.0),
+        'overall_rate': round(metric_totals['conversions'] / metric_totals['impressions'], 6)
+        if metric_totals.get('impressions') else 0.0,
+    }}
+    codes, steps = factorize([r.get('step') for r in step_rows])
+    users = group_sums(codes, len(steps), {'users': column([r.get('users') for r in step_rows])})['users']
+    if steps:
+        step_rates = [1.0] + ratio(users[1:], users[:-1]).tolist()
+        users = users.tolist()
+        report['steps'] = [{'step': step, 'users': round(u, 6), 'rate_from_previous': round(r, 6)}
+                           for step, u, r in zip(steps, users, step_rates)]
+        report['overall_rate'] = round(users[-1] / users[0], 6) if users[0] else 0.0
+    return report
+
+def creative_insights(score_rows, top=5):
+    scored = [(r.get('creative_id'), to_number(r.get('score'))) for r in score_rows]
+    scores = column([s for _, s in scored])
+    best = sorted(scored, key=lambda x: x[1], reverse=True)[:top]
+    return {
+        'creatives': len(scored),
+        'mean_score': round(float(scores.sum()) / len(scored), 6) if scored else 0.0,
+        'top': [{'creative_id': c, 'score': s} for c, s in best],
+    }
+
+def forecast_summary(rows):
+    codes, dates = factorize([r.get('date') for r in rows])
+    sums = group_sums(codes, len(dates), {'impressions': column([r.get('impressions') for r in rows])})
+    return {'by_date': table(('date',), dates, sums, {}), 'totals': totals(sums, {})}
+
+# the agents whose records the rollups read; other outputs (mar's) are never loaded here
+AGGREGATED_AGENTS = ('mdc', 'cfa', 'cps', 'mbo', 'ftm')
+
+def aggregate_outputs(responses):
+    """aggregated_outputs for a finished run, from the agents' records in `responses`."""
+    start = time.time()
+    records = {name: agent_data(responses[name]) if responses.get(name) else [] for name in AGGREGATED_AGENTS}
+    keys, sums, n = mdc_groups([r for r in records.get('mdc') or [] if isinstance(r, dict)])
+    summary = metrics_summary(keys, sums, n)
+    out = {
+        'metrics_summary': summary,
+        'funnel_reports': funnel_reports(flatten(records.get('cfa') or [], 'funnel_summary'), summary['totals']),
+        'creative_insights': creative_insights(flatten(records.get('cps') or [], 'creative_scores')),
+        'economics': economics(flatten(records.get('mbo') or [], 'economics_summary'), keys, sums),
+        'forecast': forecast_summary(flatten(records.get('ftm') or [], 'forecast')),
+    }
+    out['_aggregation'] = {'rows': n, 'groups': len(keys), 'duration_s': round(time.time() - start, 4)}
+    return out
+
+# --- quality gates ---------------------------------------------------------------
+# quality_gates are computed in a single pass over the mdc rows that keeps only
+# running sums and a bitmap of the expected campaign_id x date x channel cells
+# (dimensions the request leaves open are not part of the grid), so memory
+# follows the size of the request, not the number of rows. Every agent's issues
+# are scored by severity. Thresholds and severity weights come from the
+# top-level `quality_gates:` block of agent_policy.yml.
+QUALITY_DEFAULTS = {
+    'min_completeness': 0.9,
+    'min_confidence': 0.8,
+    'max_issue_score': 10.0,
+    'severity_weights': {'low': 1.0, 'medium': 3.0, 'high': 10.0},
+}
+
+def quality_policy():
+    block = agent_policy.get('quality_gates') if isinstance(agent_policy, dict) else None
+    policy = dict(QUALITY_DEFAULTS)
+    if isinstance(block, dict):
+        policy.update({k: v for k, v in block.items() if k in QUALITY_DEFAULTS})
+        policy['severity_weights'] = {**QUALITY_DEFAULTS['severity_weights'], **(block.get('severity_weights') or {})}
+    return policy
+
+def quality_gates(payload, rows, provenance):
+    """Completeness, weighted confidence and issue score for a run, checked against the policy thresholds."""
+    policy = quality_policy()
+    dims = []
+    campaigns = campaign_list(payload.get('campaign_ids'))
+    if campaigns:
+        dims.append((lambda r: campaign_key(r.get('campaign_id')), {campaign_key(c): i for i, c in enumerate(campaigns)}))
+    days = window_days(payload.get('date_from'), payload.get('date_to'), max_days=None) if payload.get('date_from') else None
+    if days:
+        dims.append((lambda r: str(r.get('date'))[:10], {d: i for i, d in enumerate(days)}))
+    channels = payload.get('channels') or []
+    if channels:
+        dims.append((lambda r: r.get('channel'), {c: i for i, c in enumerate(channels)}))
+    expected = 1
+    for _, index in dims:
+        expected *= len(index)
+    seen = bytearray(expected if dims else 0)
+
+    n_rows = 0
+    weighted = weight = plain = with_confidence = 0.0
+    for r in rows:
+        if not isinstance(r, dict):
+            continue
+        n_rows += 1
+        confidence = r.get('confidence')
+        if confidence is not None:
+            confidence = to_number(confidence)
+            impressions = to_number((r.get('metrics') or {}).get('impressions'))
+            weighted += confidence * impressions
+            weight += impressions
+            plain += confidence
+            with_confidence += 1
+        cell = 0
+        for key, index in dims:
+            i = index.get(key(r))
+            if i is None:
+                break
+            cell = cell * len(index) + i
+        else:
+            if dims:
+                seen[cell] = 1
+
+    if dims:
+        present = expected - seen.count(0)
+        completeness = present / expected if expected else 0.0
+    else:
+        present = expected = None
+        completeness = 1.0 if n_rows else 0.0
+    confidence = weighted / weight if weight else (plain / with_confidence if with_confidence else 0.0)
+
+    weights = policy['severity_weights']
+    by_severity = {}
+    score = 0.0
+    for entry in provenance:
+        for issue in entry.get('issues') or []:
+            severity = str(issue.get('severity', 'low')) if isinstance(issue, dict) else 'low'
+            by_severity[severity] = by_severity.get(severity, 0) + 1
+            score += to_number(weights.get(severity, 1.0))
+
+    failed = []
+    if completeness < float(policy['min_completeness']):
+        failed.append('completeness')
+    if confidence < float(policy['min_confidence']):
+        failed.append('confidence')
+    if score > float(policy['max_issue_score']):
+        failed.append('issues')
+    return {
+        'completeness': round(completeness, 4),
+        'expected_cells': expected,
+        'present_cells': present,
+        'confidence': round(confidence, 4),
+        'rows': n_rows,
+        'issue_score': round(score, 3),
+        'issues_by_severity': by_severity,
+        'thresholds': {k: policy[k] for k in ('min_completeness', 'min_confidence', 'max_issue_score')},
+        'failed': failed,
+        'passed': not failed,
+    }
+
+# --- sharding ------------------------------------------------------------------
+# Root agents can split a large request into shards: `shard_days` cuts the
+# date_from..date_to window into windows of that many days and
+# `shard_campaigns` cuts campaign_ids into chunks of that size (policy keys in
+# agent_policy.yml; either may be omitted). Shards run in parallel, at most
+# `shard_concurrency` (default SHARD_CONCURRENCY) at a time, and each shard's
+# records are merged as soon as it returns, so the merged response is ready
+# the moment the last shard lands. The first error cancels the shards still
+# pending. Per-shard timing is recorded in call_meta.shards.
+SHARD_CONCURRENCY = int(os.environ.get('SHARD_CONCURRENCY', '4'))
+
+def shard_payloads(name, payload):
+    """The payloads `payload` splits into under `name`'s shard policy (a single one when it does not split)."""
+    p = policy_for(name)
+    shard_days = int(p.get('shard_days', 0) or 0)
+    shard_campaigns = int(p.get('shard_campaigns', 0) or 0)
+    windows = [(payload.get('date_from'), payload.get('date_to'))]
+    if shard_days > 0:
+        try:
+            first = datetime.date.fromisoformat(str(payload.get('date_from')))
+            last = datetime.date.fromisoformat(str(payload.get('date_to') or payload.get('date_from')))
+        except ValueError:
+            first = last = None
+        if first is not None and last >= first:
+            step = datetime.timedelta(days=shard_days)
+            windows = []
+            while first <= last:
+                windows.append((first.isoformat(), min(first + step - datetime.timedelta(days=1), last).isoformat()))
+                first += step
+    campaigns = campaign_list(payload.get('campaign_ids'))
+    chunks = [campaigns]
+    if shard_campaigns > 0 and len(campaigns) > shard_campaigns:
+        chunks = [campaigns[i:i + shard_campaigns] for i in range(0, len(campaigns), shard_campaigns)]
+    if len(windows) == 1 and len(chunks) == 1:
+        return [payload]
+    return [{**payload, 'date_from': a, 'date_to': b, 'campaign_ids': chunk} for a, b in windows for chunk in chunks]
+
+async def invoke_sharded(name, url, job, payload, max_retries=3, base_timeout=20):
+    """invoke_agent() with the request fanned out over shards and the replies merged into one response."""
+    shards = shard_payloads(name, payload)
+    if len(shards) == 1:
+        return await invoke_agent(name, url, job, payload, max_retries=max_retries, base_timeout=base_timeout)
+
+    limit = asyncio.Semaphore(max(1, int(policy_for(name).get('shard_concurrency', SHARD_CONCURRENCY))))
+
+    async def run_shard(i, shard):
+        async with limit:
+            with span('shard', agent=name, index=i, date_from=shard.get('date_from'), date_to=shard.get('date_to'),
+                      campaigns=len(shard.get('campaign_ids') or [])):
+                start = time.time()
+                status_code, resp = await invoke_agent(name, url, job, shard, max_retries=max_retries, base_timeout=base_timeout)
+                return i, start, status_code, resp
+
+    start = time.time()
+    tasks = [asyncio.ensure_future(run_shard(i, shard)) for i, shard in enumerate(shards)]
+    parts = []
+    timings = [None] * len(shards)
+    issues = []
+    first = None
+    partial = False
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            i, shard_start, status_code, resp = await next_done
+            meta = resp.get('_call_meta') or {}
+            shard = shards[i]
+            timings[i] = {'date_from': shard.get('date_from'), 'date_to': shard.get('date_to'),
+                          'campaigns': len(shard.get('campaign_ids') or []), 'status': resp.get('status', 'error'),
+                          'http_status': meta.get('http_status', status_code), 'attempt': meta.get('attempt'),
+                          'started_s': round(shard_start - start, 3), 'duration_s': round(time.time() - shard_start, 3)}
+            if resp.get('status') == 'error':
+                app.logger.error("Shard %s/%s of agent %s failed; cancelling the rest", i + 1, len(shards), name)
+                resp.setdefault('_call_meta', {})['shards'] = [t for t in timings if t is not None]
+                return status_code, resp
+            partial = partial or resp.get('status') == 'partial'
+            issues.extend(resp.get('issues') or [])
+            # merge as shards land; pass-through bytes are kept for a splice instead of being decoded
+            # and artifacts are read and decoded in a worker thread, off the engine loop
+            data = resp.get('data')
+            if is_artifact(resp.get('artifact')):
+                parts.append(await asyncio.to_thread(agent_data, resp))
+            else:
+                parts.append(data if isinstance(data, RawJSON) else data or [])
+            if first is None:
+                first = (status_code, resp)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # let cancelled shards give back their concurrency slots before the response moves on
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    status_code, base = first
+    merged = {k: v for k, v in base.items() if k not in ('data', 'artifact', '_data_sample')}
+    merged.update({
+        'status': 'partial' if partial else 'ok',
+        'issues': issues,
+        'data': merge_data(parts),
+        '_call_meta': {'http_status': status_code, 'duration_s': round(time.time() - start, 3),
+                       'attempt': max(t['attempt'] or 0 for t in timings), 'shards': timings},
+    })
+    app.logger.info("Agent %s merged %s shards in %.3fs", name, len(shards), time.time() - start,
+                    extra={'duration_s': round(time.time() - start, 3)})
+    return status_code, merged
+
+# --- daily partials --------------------------------------------------------------
+# Root agents with `incremental: true` in agent_policy.yml (mdc) keep their
+# output as per-(campaign_id, date, channel) partial sums in a local SQLite
+# store (PARTIALS_DB). A run only calls such an agent for the days of its
+# date_from..date_to window that some requested campaign has no partials for,
+# one call per contiguous gap, so cost follows the number of new days rather
+# than the window size. The agent's `data` for the run, as dependents and
+# provenance see it, is the window's partial rows (campaign_id, date, channel,
+# metrics as floats, impressions-weighted confidence, source `rows` count) for
+# the requested campaigns only (ids match as text, so "101" covers 101; a lone
+# id counts as a one-item list; row dates match on their first ten characters),
+# sorted by date, campaign and channel; fetched
+# days go through the same shape as stored ones, so a repeat run returns the
+# same data. Partials are kept per channels filter; error and partial replies
+# are used for the run but never stored. Days older than `incremental_ttl_s` (default
+# PARTIALS_TTL_S) are fetched again. The last `incremental_open_days` (default
+# PARTIALS_OPEN_DAYS, i.e. today in UTC) and any later days are still
+# changing: they are fetched on every run and never stored. Windows longer
+# than PARTIALS_MAX_DAYS or without campaign_ids bypass the store. Store
+# reads and writes run in worker threads, off the engine loop.
+PARTIALS_DB = os.environ.get('PARTIALS_DB', os.path.join(DATA_DIR, 'partials.sqlite')).strip()
+PARTIALS_TTL_S = float(os.environ.get('PARTIALS_TTL_S', str(30 * 24 * 3600)))
+PARTIALS_MAX_DAYS = int(os.environ.get('PARTIALS_MAX_DAYS', '366'))
+PARTIALS_OPEN_DAYS = int(os.environ.get('PARTIALS_OPEN_DAYS', '1'))
+
+class PartialStore:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        # campaign_id columns hold the json-encoded id (so rows load back as sent);
+        # lookups match on campaign_key() of the decoded id
+        self.db.create_function('campaign_key', 1, lambda c: campaign_key(json.loads(c)), deterministic=True)
+        self.db.execute('CREATE TABLE IF NOT EXISTS partials (agent TEXT, scope TEXT, campaign_id TEXT, date TEXT, channel TEXT, '
+                        'impressions REAL, clicks REAL, conversions REAL, confidence REAL, rows INTEGER, '
+                        'PRIMARY KEY (agent, scope, campaign_id, date, channel))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS coverage (agent TEXT, scope TEXT, campaign_id TEXT, date TEXT, '
+                        'fetched_at REAL, PRIMARY KEY (agent, scope, campaign_id, date))')
+        self.prune()
+
+    def prune(self):
+        cutoff = time.time() - PARTIALS_TTL_S
+        with self.lock:
+            self.db.execute('DELETE FROM partials WHERE (agent, scope, campaign_id, date) IN '
+                            '(SELECT agent, scope, campaign_id, date FROM coverage WHERE fetched_at < ?)', (cutoff,))
+            self.db.execute('DELETE FROM coverage WHERE fetched_at < ?', (cutoff,))
+
+    def covered_days(self, agent, scope, campaigns, days, ttl):
+        """The subset of `days` for which every campaign has partials newer than `ttl` seconds."""
+        wanted = {campaign_key(c) for c in campaigns}
+        with self.lock:
+            rows = self.db.execute('SELECT campaign_key(campaign_id), date FROM coverage WHERE agent = ? AND scope = ? '
+                                   'AND date BETWEEN ? AND ? AND fetched_at >= ?',
+                                   (agent, scope, days[0], days[-1], time.time() - ttl)).fetchall()
+        seen = {}
+        for campaign, day in rows:
+            if campaign in wanted:
+                seen.setdefault(day, set()).add(campaign)
+        return {day for day in days if len(seen.get(day, ())) == len(wanted)}
+
+    def save(self, agent, scope, campaigns, days, rows):
+        """Replace the partials of `campaigns` x `days` with `rows` and mark those days covered."""
+        now = time.time()
+        keys = [(agent, scope, json.dumps(c), d) for c in campaigns for d in days]
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self.db.executemany('DELETE FROM partials WHERE agent = ? AND scope = ? AND campaign_key(campaign_id) = ? '
+                                    'AND date = ?', [(agent, scope, campaign_key(c), d) for c in campaigns for d in days])
+                self.db.executemany('INSERT OR REPLACE INTO partials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                    (agent, scope, json.dumps(r['campaign_id']), r['date'], json.dumps(r['channel']),
+                     r['metrics']['impressions'], r['metrics']['clicks'], r['metrics']['conversions'],
+                     r['confidence'], r['rows']) for r in rows])
+                self.db.executemany('INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?)', [k + (now,) for k in keys])
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def load(self, agent, scope, campaigns, days):
+        """Stored partials of `campaigns` on `days` as mdc-style rows."""
+        if not days:
+            return []
+        requested = campaign_filter(campaigns)
+        day_set = set(days)
+        with self.lock:
+            rows = self.db.execute('SELECT campaign_id, date, channel, impressions, clicks, conversions, confidence, rows '
+                                   'FROM partials WHERE agent = ? AND scope = ? AND date BETWEEN ? AND ?',
+                                   (agent, scope, min(days), max(days))).fetchall()
+        rows = [(json.loads(c), d, ch, i, cl, cv, conf, n) for c, d, ch, i, cl, cv, conf, n in rows if d in day_set]
+        return [{'campaign_id': c, 'date': d, 'channel': json.loads(ch),
+                 'metrics': {'impressions': i, 'clicks': cl, 'conversions': cv}, 'confidence': conf, 'rows': n}
+                for c, d, ch, i, cl, cv, conf, n in rows if requested(c)]
+
+partial_store = None
+if PARTIALS_DB:
+    try:
+        partial_store = PartialStore(PARTIALS_DB)
+    except Exception:
+        app.logger.exception("Cannot open partials db %s; incremental aggregation disabled", PARTIALS_DB)
+
+def window_days(date_from, date_to, max_days=PARTIALS_MAX_DAYS):
+    """ISO dates from date_from to date_to inclusive, or None when the window is invalid or longer than `max_days`."""
+    try:
+        first = datetime.date.fromisoformat(str(date_from))
+        last = datetime.date.fromisoformat(str(date_to or date_from))
+    except ValueError:
+        return None
+    span = (last - first).days + 1
+    if span < 1 or (max_days is not None and span > max_days):
+        return None
+    return [(first + datetime.timedelta(days=i)).isoformat() for i in range(span)]
+
+def first_open_day(open_days):
+    """ISO date from which days are still open: today (UTC) minus `open_days` - 1; 0 treats today as closed."""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    return (today - datetime.timedelta(days=max(open_days, 0) - 1)).isoformat()
+
+def day_ranges(days):
+    """Contiguous (first, last) runs of sorted ISO dates."""
+    ranges = []
+    for day in days:
+        if ranges and datetime.date.fromisoformat(day) - datetime.date.fromisoformat(ranges[-1][1]) == datetime.timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(r) for r in ranges]
+
+def campaign_list(campaign_ids):
+    """campaign_ids as a list: a lone id is wrapped, a missing one is empty."""
+    if campaign_ids is None or campaign_ids == '':
+        return []
+    return list(campaign_ids) if isinstance(campaign_ids, (list, tuple)) else [campaign_ids]
+
+def campaign_key(campaign):
+    """Identity a campaign id is matched on: its text, so a request for "101" covers mdc's 101 rows."""
+    return str(campaign)
+
+def campaign_filter(campaigns):
+    """Predicate for campaign_ids among `campaigns`, compared by campaign_key()."""
+    wanted = {campaign_key(c) for c in campaigns}
+    verdicts = {}
+
+    def requested(campaign):
+        try:
+            key = (type(campaign), campaign)
+            verdict = verdicts.get(key)
+            if verdict is None:
+                verdict = verdicts[key] = campaign_key(campaign) in wanted
+            return verdict
+        except TypeError:
+            return campaign_key(campaign) in wanted
+    return requested
+
+def daily_partials(rows, days, campaigns):
+    """Sum mdc rows of `campaigns` falling on `days` per (campaign_id, date, channel); confidence is impressions-weighted."""
+    requested = campaign_filter(campaigns)
+    keys, sums, _ = mdc_groups([r for r in rows if isinstance(r, dict)], partials=True)
+    weighted_conf = ratio(sums['weighted'], sums['impressions']).tolist()
+    mean_conf = ratio(sums['confidence'], sums['rows']).tolist()
+    out = {name: col.tolist() for name, col in sums.items()}
+    return [{'campaign_id': c, 'date': d, 'channel': ch,
+             'metrics': {f: out[f][i] for f in METRIC_FIELDS},
+             'confidence': round(weighted_conf[i] if out['impressions'][i] else mean_conf[i], 6),
+             'rows': int(out['rows'][i])}
+            for i, (c, d, ch) in enumerate(keys) if d in days and requested(c)]
+
+async def invoke_incremental(name, url, job, payload, max_retries=3, base_timeout=20):
+    """invoke_agent() for an incremental root agent: fetch only the days missing from the partial store."""
+    campaigns = campaign_list(payload.get('campaign_ids'))
+    if campaigns != payload.get('campaign_ids', []):
+        payload = {**payload, 'campaign_ids': campaigns}
+    days = window_days(payload.get('date_from'), payload.get('date_to'))
+    if partial_store is None or not campaigns or not days:
+        return await invoke_sharded(name, url, job, payload, max_retries=max_retries, base_timeout=base_timeout)
+    scope = ','.join(sorted(str(c) for c in payload.get('channels') or []))
+    ttl = float(policy_for(name).get('incremental_ttl_s', PARTIALS_TTL_S))
+    open_from = first_open_day(int(policy_for(name).get('incremental_open_days', PARTIALS_OPEN_DAYS)))
+    closed = [d for d in days if d < open_from]
+    covered = await asyncio.to_thread(partial_store.covered_days, name, scope, campaigns, closed, ttl) if closed else set()
+    missing = [d for d in days if d not in covered]
+    gaps = day_ranges(missing)
+
+    results = await asyncio.gather(*(
+        invoke_sharded(name, url, job, {**payload, 'date_from': first, 'date_to': last},
+                     max_retries=max_retries, base_timeout=base_timeout) for first, last in gaps))
+    for status_code, resp in results:
+        if resp.get('status') == 'error':
+            return status_code, resp
+
+    def fetched_partials():
+        return daily_partials([row for _, resp in results for row in agent_data(resp)], set(missing), campaigns)
+
+    fresh = await asyncio.to_thread(fetched_partials)
+    storable = [d for d in missing if d < open_from]
+    if storable and all(resp.get('status') == 'ok' for _, resp in results):
+        await asyncio.to_thread(partial_store.save, name, scope, campaigns, storable,
+                                [r for r in fresh if r['date'] < open_from])
+    rows = await asyncio.to_thread(partial_store.load, name, scope, campaigns, sorted(covered)) + fresh
+    rows.sort(key=lambda r: (r['date'], str(r['campaign_id']), str(r['channel'])))
+
+    if results:
+        status_code, base = results[0]
+        call_meta = dict(base.get('_call_meta') or {})
+        call_meta['duration_s'] = max(resp.get('_call_meta', {}).get('duration_s', 0.0) for _, resp in results)
+    else:
+        status_code, base = 200, {'status': 'ok', 'meta': {'agent': name, 'job': job}}
+        call_meta = {'http_status': 200, 'duration_s': 0.0, 'attempt': 0}
+    shards = [t for _, r in results for t in (r.get('_call_meta') or {}).get('shards', [])]
+    if shards:
+        call_meta['shards'] = shards
+    call_meta['incremental'] = {'days': len(days), 'stored_days': len(covered), 'fetched_days': len(missing),
+                                'open_days': len(days) - len(closed), 'calls': len(gaps)}
+    resp = {k: v for k, v in base.items() if k not in ('data', 'artifact', '_data_sample')}
+    resp.update({
+        'status': 'partial' if any(r.get('status') == 'partial' for _, r in results) else 'ok',
+        'issues': [issue for _, r in results for issue in r.get('issues') or []],
+        'data': rows,
+        '_call_meta': call_meta,
+    })
+    app.logger.info("Agent %s incremental window days=%s stored=%s fetched=%s calls=%s", name, len(days), len(covered), len(missing), len(gaps))
+    return status_code, resp
+
+# --- pipeline ----------------------------------------------------------------
+def pipeline_graph():
+    """
+    Agent dependency graph as {agent: [dependencies]}, in AGENTS order.
+    Dependencies come from `depends_on` in agent_policy.yml; an agent without
+    one depends on the agent listed before it, which gives the original chain.
+    An unknown dependency or a cycle falls back to the plain chain.
+    """
+    names = [name for name, _ in AGENTS]
+    chain = {name: names[i - 1:i] for i, name in enumerate(names)}
+    graph = {}
+    for name in names:
+        deps = policy_for(name).get('depends_on', chain[name])
+        if isinstance(deps, str):
+            deps = [deps]
+        unknown = [d for d in deps if d not in chain or d == name]
+        if unknown:
+            app.logger.error("Agent %s depends_on unknown agents %s; using sequential pipeline", name, unknown)
+            return chain
+        graph[name] = list(deps)
+    # cycle check: repeatedly peel off nodes whose dependencies are resolved
+    resolved = set()
+    while len(resolved) < len(graph):
+        ready = [n for n, deps in graph.items() if n not in resolved and all(d in resolved for d in deps)]
+        if not ready:
+            app.logger.error("Cycle in agent depends_on; using sequential pipeline")
+            return chain
+        resolved.update(ready)
+    return graph
+
+def stages_from(name, graph):
+    """Length of the longest chain of agents starting at `name` (itself included)."""
+    dependents = [n for n, deps in graph.items() if name in deps]
+    return 1 + max((stages_from(n, graph) for n in dependents), default=0)
+
+def agent_deadline(name, deadline):
+    """`name`'s share of the time left before `deadline`, as an absolute deadline."""
+    if deadline is None:
+        return None
+    now = time.time()
+    return now + max(deadline - now, 0.0) / stages_from(name, pipeline_graph())
+
+def root_invoke(name):
+    """How a root agent is called: through the partial store, sharded, or (sharding off) as one call."""
+    return invoke_incremental if policy_for(name).get('incremental') else invoke_sharded
+
+def provenance_entry(name, resp):
+    entry = {
+        'agent': name,
+        'status': resp.get('status', 'error'),
+        'meta': resp.get('meta'),
+        'issues': resp.get('issues', []),
+        'data_sample': resp['_data_sample'][:1] if '_data_sample' in resp else (resp.get('data') or [])[:1],
+        'call_meta': resp.get('_call_meta', {})
+    }
+    if is_artifact(resp.get('artifact')):
+        entry['artifact'] = resp['artifact']
+    return entry
+
+async def run_agent_graph(first_payload, shared=None, on_entry=None, completed=None, checkpoint_id=None):
+    """
+    Run every agent as soon as its dependencies have finished.
+    Root agents receive `first_payload`; the others receive the concatenated
+    `data` of their dependencies as `input_data`. After an agent error no new
+    agents are started, but calls already in flight are allowed to finish.
+    `shared` maps agent name -> (start, fan_in) for calls coalesced across
+    batch jobs; those agents take their slice of the shared response instead
+    of being called. `on_entry` is called with each provenance entry as soon
+    as its agent returns. `completed` holds responses restored from
+    checkpoints, which are not called again; with `checkpoint_id` every
+    non-error response is checkpointed under that id.
+    Returns (provenance, responses_by_agent, failed_agent_or_None) with
+    provenance in AGENTS order regardless of completion order.
+    """
+    graph = pipeline_graph()
+    urls = dict(AGENTS)
+    order = {name: i for i, (name, _) in enumerate(AGENTS)}
+    responses = {}
+    entries = {}
+    started = set()
+    pending = {}
+    failed = None
+
+    for name, resp in (completed or {}).items():
+        if name not in graph:
+            continue
+        resp.setdefault('_call_meta', {})['checkpoint'] = 'restored'
+        responses[name] = resp
+        entries[name] = provenance_entry(name, resp)
+        started.add(name)
+        if on_entry is not None:
+            on_entry(entries[name])
+
+    while True:
+        if failed is None:
+            for name, deps in graph.items():
+                if name in started or not all(d in responses for d in deps):
+                    continue
+                if deps:
+                    stored = [d for d in deps if is_artifact(responses[d].get('artifact'))]
+                    agent_payload = {'input_data': merge_data([responses[d].get('data') for d in deps if d not in stored])}
+                    if stored:
+                        agent_payload['input_artifacts'] = [responses[d]['artifact'] for d in stored]
+                else:
+                    agent_payload = first_payload
+                started.add(name)
+                if shared and name in shared:
+                    start, fan_in = shared[name]
+                    task = asyncio.ensure_future(
+                        split_coalesced(start(), fan_in, first_payload.get('campaign_ids') or []))
+                else:
+                    invoke = root_invoke(name) if not deps else invoke_agent
+                    task = asyncio.ensure_future(
+                        invoke(name, urls[name], 'job_from_eva', agent_payload, max_retries=3, base_timeout=20))
+                pending[task] = name
+        if not pending:
+            break
+        finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in sorted(finished, key=lambda t: order[pending[t]]):
+            name = pending.pop(task)
+            status_code, resp = task.result()
+            if resp is None:
+                resp = {'status': 'error', 'meta': {'agent': name, 'job': 'job_from_eva'}, 'issues': [{'note': 'no response'}]}
+            responses[name] = resp
+            entries[name] = provenance_entry(name, resp)
+            if on_entry is not None:
+                on_entry(entries[name])
+            if resp.get('status') == 'error':
+                failed = failed or name
+            elif checkpoint_id is not None:
+                checkpoints.save_agent(checkpoint_id, name, resp)
+
+    provenance = [entries[name] for name in sorted(entries, key=order.get)]
+    return provenance, responses, failed
+
+async def execute_pipeline(payload, shared=None, on_entry=None, completed=None):
+    """
+    Run the agent chain for one /run payload.
+    `shared` carries coalesced agent calls when running as part of a batch;
+    `on_entry` receives provenance entries as they arrive (streaming mode);
+    `completed` holds checkpointed responses when resuming a failed run.
+    Returns (final_report, http_status).
+    """
+    metrics.runs_in_flight += 1
+    try:
+        with trace_run() as trace:
+            final_report, http_status = await _execute_pipeline(payload, shared, on_entry, completed)
+    finally:
+        metrics.runs_in_flight -= 1
+    metrics.observe_run(final_report.get('pipeline_duration_s', 0.0), final_report.get('status', 'error'))
+    if trace is not None:
+        trace.request_id = final_report.get('request_id')
+        export_trace(trace)
+        if payload.get('trace'):
+            final_report['trace'] = trace_summary(trace)
+    return final_report, http_status
+
+async def _execute_pipeline(payload, shared, on_entry, completed):
     start_pipeline = time.time()
     try:
-        payload = request.json or {}
         job = payload.get('job', 'job_from_client')
         request_id = payload.get('request_id', 'local-' + str(uuid.uuid4()))
         initiator = payload.get('initiator', 'system')
@@ -152,7 +2564,11 @@ def run():
         campaign_ids = payload.get('campaign_ids', [])
         channels = payload.get('channels', [])
 
-        app.logger.info(f"RUN start request_id={request_id} job={job} initiator={initiator} date_from={date_from} date_to={date_to} campaigns={campaign_ids}")
+        log_request_id.set(request_id)
+        deadline = resolve_deadline(payload, start_pipeline)
+        run_deadline.set(deadline)
+        app.logger.info("RUN start request_id=%s job=%s initiator=%s date_from=%s date_to=%s campaigns=%s budget_s=%s", request_id, job, initiator, date_from, date_to, campaign_ids,
+                        None if deadline is None else round(deadline - start_pipeline, 3))
 
         next_payload = {
             'campaign_ids': campaign_ids,
@@ -161,65 +2577,58 @@ def run():
             'channels': channels
         }
 
-        final_provenance = []
+        checkpoint_id = None
+        if checkpoints is not None:
+            checkpoints.save_run(request_id, payload, resume=completed is not None)
+            checkpoint_id = request_id
+
         aggregated_outputs = {}
-        degraded = False
+        final_provenance, responses, failed = await run_agent_graph(
+            next_payload, shared=shared, on_entry=on_entry, completed=completed, checkpoint_id=checkpoint_id)
 
-        # Sequentially call agents
-        for name, url in AGENTS:
-            status_code, resp = call_agent(name, url, 'job_from_eva', next_payload, max_retries=3, base_timeout=20)
-            if resp is None:
-                resp = {'status': 'error', 'meta': {'agent': name, 'job': 'job_from_eva'}, 'issues': [{'note': 'no response'}]}
+        # Partial -> mark degraded and continue
+        for entry in final_provenance:
+            if entry['status'] == 'partial':
+                aggregated_outputs.setdefault('_degraded_provenance', []).append(entry['agent'])
+                app.logger.warning("Agent %s returned PARTIAL; continuing pipeline (request_id=%s). Issues: %s", entry['agent'], request_id, entry['issues'])
+        degraded = bool(aggregated_outputs.get('_degraded_provenance'))
 
-            prov_entry = {
-                'agent': name,
-                'status': resp.get('status', 'error'),
-                'meta': resp.get('meta'),
-                'issues': resp.get('issues', []),
-                'data_sample': (resp.get('data') or [])[:1],
-                'call_meta': resp.get('_call_meta', {})
+        # Error -> stop pipeline with incident
+        if failed is not None:
+            pipeline_duration = round(time.time() - start_pipeline, 3)
+            timed_out = any(i.get('type') == 'deadline_exceeded' for i in responses[failed].get('issues') or [])
+            final_report = {
+                'request_id': request_id,
+                'status': 'error',
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'provenance': final_provenance,
+                'aggregated_outputs': aggregated_outputs,
+                'notes': 'Stopped: run deadline exceeded' if timed_out else 'Stopped due to agent error',
+                'pipeline_duration_s': pipeline_duration
             }
-            final_provenance.append(prov_entry)
+            if checkpoint_id is not None:
+                checkpoints.finish_run(checkpoint_id, 'error')
+                final_report['resume_url'] = f'/run/{request_id}/resume'
+            app.logger.error("RUN stopped: request_id=%s agent=%s error_issues=%s", request_id, failed, responses[failed].get('issues'))
+            return final_report, 504 if timed_out else 500
 
-            # Error -> stop pipeline with incident
-            if resp.get('status') == 'error':
-                pipeline_duration = round(time.time() - start_pipeline, 3)
-                final_report = {
-                    'request_id': request_id,
-                    'status': 'error',
-                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
-                    'provenance': final_provenance,
-                    'aggregated_outputs': aggregated_outputs,
-                    'notes': 'Stopped due to agent error',
-                    'pipeline_duration_s': pipeline_duration
-                }
-                app.logger.error(f"RUN stopped: request_id={request_id} agent={name} error_issues={resp.get('issues')}")
-                return jsonify(final_report), 500
-
-            # Partial -> mark degraded and continue
-            if resp.get('status') == 'partial':
-                degraded = True
-                aggregated_outputs.setdefault('_degraded_provenance', []).append(name)
-                app.logger.warning(f"Agent {name} returned PARTIAL; continuing pipeline (request_id={request_id}). Issues: {resp.get('issues')}")
-
-            # Pass data forward (if any)
-            next_payload = {'input_data': resp.get('data', [])}
-
-        # Build aggregated outputs (in real system we'd merge and compute; here mock)
-        aggregated_outputs.setdefault('metrics_summary', {'note': 'sample aggregated outputs'})
-        aggregated_outputs.setdefault('funnel_reports', {'note': 'sample funnel outputs'})
-        aggregated_outputs.setdefault('creative_insights', {'note': 'sample creative outputs'})
-        aggregated_outputs.setdefault('economics', {'note': 'sample economics outputs'})
-        aggregated_outputs.setdefault('forecast', {'note': 'sample forecast outputs'})
+        # Aggregate the agents' records off the engine loop; a failure here degrades the report instead of failing the run
+        try:
+            with span('aggregate'):
+                aggregated_outputs.update(await asyncio.to_thread(aggregate_outputs, responses))
+        except Exception as e:
+            app.logger.exception("Aggregation failed request_id=%s", request_id)
+            aggregated_outputs['_aggregation'] = {'error': str(e)}
 
-        pipeline_duration = round(time.time() - start_pipeline, 3)
+        try:
+            with span('quality_gates'):
+                gates = await asyncio.to_thread(lambda: quality_gates(
+                    payload, iter(agent_data(responses['mdc']) if responses.get('mdc') else []), final_provenance))
+        except Exception as e:
+            app.logger.exception("Quality gates failed request_id=%s", request_id)
+            gates = {'error': str(e), 'failed': ['error'], 'passed': False}
 
-        # Simulated quality gates (in production compute from real data)
-        quality_gates = {
-            'completeness': 1.0 if aggregated_outputs.get('metrics_summary') else 0.0,
-            'confidence': 0.95,
-            'passed': (1.0 >= 0.9)
-        }
+        pipeline_duration = round(time.time() - start_pipeline, 3)
 
         final_report = {
             'request_id': request_id,
@@ -231,15 +2640,26 @@ def run():
             'human_actions': [],
             'notes': '',
             'pipeline_duration_s': pipeline_duration,
-            'quality_gates': quality_gates
+            'quality_gates': gates
         }
+        artifacts = {entry['agent']: entry['artifact'] for entry in final_provenance if 'artifact' in entry}
+        if artifacts:
+            final_report['artifacts'] = artifacts
 
         if degraded:
             final_report['notes'] = 'Degraded quality: one or more agents returned partial.'
             final_report['final_status_note'] = 'degraded_quality'
+        if not gates['passed']:
+            final_report['notes'] = (final_report['notes'] + ' ' if final_report['notes'] else '') + \
+                'Quality gates failed: ' + ', '.join(gates['failed']) + '.'
+            app.logger.warning("Quality gates failed request_id=%s failed=%s", request_id, gates['failed'])
 
-        app.logger.info(f"RUN finished request_id={request_id} status={final_report['status']} pipeline_duration_s={pipeline_duration}")
-        return jsonify(final_report), 200
+        if checkpoint_id is not None:
+            checkpoints.finish_run(checkpoint_id, final_report['status'])
+
+        app.logger.info("RUN finished request_id=%s status=%s pipeline_duration_s=%s", request_id, final_report['status'], pipeline_duration,
+                        extra={'status': final_report['status'], 'duration_s': pipeline_duration})
+        return final_report, 200
 
     except Exception as e:
         # Log exception with stacktrace (also captured by Sentry if enabled)
@@ -260,9 +2680,599 @@ def run():
                 sentry_sdk.capture_exception(e)
             except Exception:
                 pass
-        return jsonify(final_report), 500
+        return final_report, 500
+
+async def resume_pipeline(request_id, overrides):
+    """
+    Rerun a failed run from its checkpoints; `overrides` carries the resume's
+    own deadline fields. Returns (final_report_or_error, http_status).
+    """
+    if checkpoints is None:
+        return {'status': 'error', 'notes': 'checkpoints are disabled'}, 404
+    stored = await asyncio.to_thread(checkpoints.load, request_id)
+    if stored is None:
+        return {'status': 'error', 'notes': f'no checkpoint for request_id {request_id}'}, 404
+    payload, status, completed = stored
+    if status in ('ok', 'partial'):
+        return {'status': 'error', 'notes': f'run {request_id} already finished with status {status}'}, 409
+    # the original deadline has most likely passed; a resume brings its own budget
+    payload = {k: v for k, v in payload.items() if k not in ('deadline', 'budget_s')}
+    payload.update(overrides)
+    app.logger.info("RUN resume request_id=%s restored_agents=%s", request_id, sorted(completed))
+    final_report, http_status = await execute_pipeline(payload, completed=completed)
+    final_report['resumed'] = {'restored_agents': [name for name, _ in AGENTS if name in completed]}
+    return final_report, http_status
+
+# --- batch runs ----------------------------------------------------------------
+# /run/batch executes many run payloads with bounded concurrency. Jobs that
+# share job/date range/channels are coalesced: every root agent flagged
+# `multi_campaign: true` in agent_policy.yml is called once with the union of
+# their campaign_ids (sharded and served from the partial store like any root
+# call), and each job keeps only its own campaigns' records. A shared call
+# starts when the first of its jobs gets a concurrency slot, so coalescing never
+# puts more root calls in flight than max_concurrency allows.
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+BATCH_MAX_JOBS = int(os.environ.get('BATCH_MAX_JOBS', '500'))
+
+def coalesce_key(payload):
+    return json.dumps([
+        payload.get('job', 'job_from_client'),
+        payload.get('date_from'),
+        payload.get('date_to'),
+        sorted(str(c) for c in payload.get('channels') or [])
+    ])
+
+async def loaded(call):
+    """Await an agent call and load its records (artifact or pass-through bytes) once, in a worker thread."""
+    status_code, resp = await call
+    await asyncio.to_thread(agent_data, resp)
+    return status_code, resp
+
+async def split_coalesced(future, fan_in, campaign_ids):
+    """Narrow a coalesced agent response down to one job's campaign_ids."""
+    status_code, resp = await future
+    resp = dict(resp)
+    resp.pop('_data_sample', None)
+    wanted = set(campaign_ids)
+
+    def narrowed():
+        data = agent_data(resp)
+        if not isinstance(data, list):
+            return data
+        return [rec for rec in data if not isinstance(rec, dict) or 'campaign_id' not in rec or rec['campaign_id'] in wanted]
+
+    resp['data'] = await asyncio.to_thread(narrowed)
+    resp['_call_meta'] = {**resp.get('_call_meta', {}), 'coalesced_jobs': fan_in}
+    return status_code, resp
+
+def coalesce_jobs(jobs):
+    """
+    Plan one shared call per (coalesce group, multi-campaign root agent).
+    Returns a per-job list of `shared` mappings for execute_pipeline: agent ->
+    (start, fan_in), where start() returns the group's call, starting it the
+    first time a member job reaches the agent. Calls thus only run inside a
+    job's batch concurrency slot.
+    """
+    graph = pipeline_graph()
+    urls = dict(AGENTS)
+    roots = [name for name, deps in graph.items() if not deps and policy_for(name).get('multi_campaign')]
+    shared = [{} for _ in jobs]
+    if not roots:
+        return shared
+    groups = {}
+    calls = {}
+
+    def starter(key, name, payload):
+        def start():
+            if key not in calls:
+                calls[key] = asyncio.ensure_future(loaded(
+                    root_invoke(name)(name, urls[name], 'job_from_eva', payload, max_retries=3, base_timeout=20)))
+            return calls[key]
+        return start
+
+    for i, job in enumerate(jobs):
+        if job.get('campaign_ids'):
+            groups.setdefault(coalesce_key(job), []).append(i)
+    for group, members in groups.items():
+        if len(members) < 2:
+            continue
+        first = jobs[members[0]]
+        campaign_ids = []
+        for i in members:
+            campaign_ids.extend(c for c in jobs[i]['campaign_ids'] if c not in campaign_ids)
+        group_payload = {
+            'campaign_ids': campaign_ids,
+            'date_from': first.get('date_from'),
+            'date_to': first.get('date_to'),
+            'channels': first.get('channels', [])
+        }
+        for name in roots:
+            start = starter((group, name), name, group_payload)
+            for i in members:
+                shared[i][name] = (start, len(members))
+        app.logger.info("BATCH coalesced %s jobs into one call per %s campaigns=%s", len(members), roots, campaign_ids)
+    return shared
+
+def validate_batch(body):
+    """(jobs, concurrency, None) for a valid /run/batch body, else (None, None, note)."""
+    jobs = body.get('jobs')
+    if not isinstance(jobs, list) or not jobs or not all(isinstance(j, dict) for j in jobs):
+        return None, None, 'jobs must be a non-empty list of run payloads'
+    if len(jobs) > BATCH_MAX_JOBS:
+        return None, None, f'batch exceeds {BATCH_MAX_JOBS} jobs'
+    try:
+        concurrency = max(1, min(int(body.get('max_concurrency', BATCH_CONCURRENCY)), BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return None, None, 'max_concurrency must be an integer'
+    return jobs, concurrency, None
+
+def batch_line(index, final_report, http_status):
+    return json.dumps({'index': index, 'http_status': http_status, 'final_report': final_report}) + '\n'
+
+async def run_batch(jobs, emit, concurrency=BATCH_CONCURRENCY):
+    """Run `jobs` with at most `concurrency` pipelines in flight, calling emit(index, report, http_status) per job."""
+    shared = coalesce_jobs(jobs)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(i):
+        async with semaphore:
+            final_report, http_status = await execute_pipeline(jobs[i], shared=shared[i])
+        emit(i, final_report, http_status)
+
+    await asyncio.gather(*(run_one(i) for i in range(len(jobs))))
+
+# --- async jobs ----------------------------------------------------------------
+# POST /jobs queues a run and returns a job id at once; JOBS_WORKERS workers on
+# the engine loop drain a queue of at most JOBS_QUEUE_SIZE pending jobs. When
+# the queue is full the submission is refused with 429 + Retry-After rather
+# than piling up. GET /jobs/<id> reports status and the provenance gathered so
+# far; an optional `callback_url` receives the final_report when the run ends.
+# Finished jobs are forgotten after JOBS_TTL_S.
+# The orchestrator sits next to the agents, so callbacks only go to hosts listed
+# in JOBS_CALLBACK_HOSTS (comma-separated host or host:port); while it is empty,
+# a callback_url is refused with 400. Delivery is one POST that does not follow
+# redirects. A failed or non-2xx callback is recorded in the job's
+# `callback.status` and never retried: receivers that miss it poll GET /jobs/<id>.
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', '4'))
+JOBS_QUEUE_SIZE = int(os.environ.get('JOBS_QUEUE_SIZE', '100'))
+JOBS_TTL_S = float(os.environ.get('JOBS_TTL_S', '3600'))
+JOBS_CALLBACK_TIMEOUT = float(os.environ.get('JOBS_CALLBACK_TIMEOUT', '10'))
+JOBS_CALLBACK_HOSTS = {h.strip().lower() for h in os.environ.get('JOBS_CALLBACK_HOSTS', '').split(',') if h.strip()}
+_jobs = {}
+_job_queue = None
+
+def prune_jobs():
+    cutoff = time.time() - JOBS_TTL_S
+    for job_id in [j for j, rec in list(_jobs.items()) if rec['finished_at'] and rec['finished_at'] < cutoff]:
+        _jobs.pop(job_id, None)
+
+async def submit_job(payload):
+    """Queue a run on the engine loop. Returns the job record, or None if the queue is full."""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = asyncio.Queue(maxsize=JOBS_QUEUE_SIZE)
+        for _ in range(JOBS_WORKERS):
+            asyncio.ensure_future(job_worker())
+    prune_jobs()
+    if _job_queue.full():
+        return None
+    payload = {**payload, 'request_id': payload.get('request_id', 'local-' + str(uuid.uuid4()))}
+    record = {
+        'job_id': uuid.uuid4().hex,
+        'request_id': payload['request_id'],
+        'status': 'queued',
+        'submitted_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'provenance': [],
+        'final_report': None,
+        'http_status': None,
+        'callback': {'url': payload.get('callback_url'), 'status': None} if payload.get('callback_url') else None
+    }
+    _jobs[record['job_id']] = record
+    _job_queue.put_nowait((record, payload))
+    return record
+
+async def job_worker():
+    while True:
+        record, payload = await _job_queue.get()
+        record['status'] = 'running'
+        record['started_at'] = time.time()
+        try:
+            final_report, http_status = await execute_pipeline(payload, on_entry=record['provenance'].append)
+            record['final_report'] = final_report
+            record['http_status'] = http_status
+            record['status'] = final_report.get('status', 'error')
+        except Exception:
+            app.logger.exception("Job %s failed", record['job_id'])
+            record['status'] = 'error'
+        record['finished_at'] = time.time()
+        if record['callback'] is not None:
+            await deliver_callback(record)
+        _job_queue.task_done()
+
+def callback_refusal(url):
+    """Why `url` may not be used as a callback_url, or None if its host is in JOBS_CALLBACK_HOSTS."""
+    if not JOBS_CALLBACK_HOSTS:
+        return 'callbacks are disabled; set JOBS_CALLBACK_HOSTS to allow callback_url hosts'
+    try:
+        parts = urllib.parse.urlsplit(str(url))
+        host, port = (parts.hostname or '').lower(), parts.port
+    except ValueError:
+        return 'callback_url is not a valid URL'
+    if parts.scheme not in ('http', 'https') or not host or parts.username or parts.password:
+        return 'callback_url must be an http(s) URL without credentials'
+    if host not in JOBS_CALLBACK_HOSTS and f'{host}:{port}' not in JOBS_CALLBACK_HOSTS:
+        return f'callback_url host {host} is not in JOBS_CALLBACK_HOSTS'
+    return None
+
+async def deliver_callback(record):
+    """POST the job's final_report to its callback_url once: no retries, no redirects."""
+    url = record['callback']['url']
+    body = {'job_id': record['job_id'], 'status': record['status'], 'http_status': record['http_status'],
+            'final_report': record['final_report']}
+    loop = asyncio.get_running_loop()
+    try:
+        r = await loop.run_in_executor(
+            _agent_executor, functools.partial(requests.post, url, json=body, timeout=JOBS_CALLBACK_TIMEOUT, allow_redirects=False))
+        record['callback']['status'] = r.status_code
+    except RequestException as e:
+        app.logger.warning("Callback for job %s to %s failed: %r", record['job_id'], url, e)
+        record['callback']['status'] = 'failed'
+
+async def job_submission(payload):
+    """Validate and queue a POST /jobs payload. Returns (body, http_status, extra_headers)."""
+    callback_url = payload.get('callback_url')
+    refusal = callback_refusal(callback_url) if callback_url is not None else None
+    if refusal:
+        return {'status': 'error', 'notes': refusal}, 400, {}
+    record = await submit_job(payload)
+    if record is None:
+        return {'status': 'rejected', 'notes': 'job queue is full, retry later', **job_queue_stats()}, 429, {'Retry-After': '5'}
+    return {'job_id': record['job_id'], 'request_id': record['request_id'], 'status': record['status'],
+            'status_url': f"/jobs/{record['job_id']}"}, 202, {}
+
+def job_status(job_id):
+    """GET /jobs/<id> as (body, http_status)."""
+    record = _jobs.get(job_id)
+    if record is None:
+        return {'status': 'error', 'notes': f'unknown job {job_id}'}, 404
+    return job_view(record), 200
+
+def job_view(record):
+    view = {k: v for k, v in record.items() if k != 'provenance'}
+    view['provenance'] = list(record['provenance'])
+    return view
+
+def job_queue_stats():
+    return {'queued': _job_queue.qsize() if _job_queue is not None else 0,
+            'queue_max': JOBS_QUEUE_SIZE, 'workers': JOBS_WORKERS, 'tracked': len(_jobs)}
+
+# --- single-flight -------------------------------------------------------------
+# Identical /run payloads that arrive while one is already executing attach to
+# that execution instead of starting their own agent chain. Each caller still
+# gets its own request_id; followers also get `coalesced_with` pointing at the
+# run that actually executed, and no `resume_url`: a failed run can only be
+# resumed under the leader's request_id. campaign_ids and channels match in
+# any order. Runs only match when their time budget (deadline/budget_s) and
+# `trace` flag match too, so nobody inherits a shorter deadline or a report
+# without the trace they asked for. Disable with SINGLE_FLIGHT=0.
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', '1') == '1'
+_in_flight = {}
+
+def run_key(payload):
+    """Canonical form of what shapes a run's report: the fields fed to the agents, its time budget and tracing."""
+    return json.dumps({
+        'job': payload.get('job', 'job_from_client'),
+        'date_from': payload.get('date_from'),
+        'date_to': payload.get('date_to'),
+        'campaign_ids': sorted(campaign_list(payload.get('campaign_ids')), key=str),
+        'channels': sorted(campaign_list(payload.get('channels')), key=str),
+        'trace': bool(payload.get('trace')),
+        **deadline_fields(payload),
+    }, sort_keys=True, separators=(',', ':'), default=str)
+
+async def run_single_flight(payload):
+    """execute_pipeline() with concurrent identical runs deduplicated. Returns (final_report, http_status)."""
+    if not SINGLE_FLIGHT:
+        return await execute_pipeline(payload)
+    request_id = payload.get('request_id', 'local-' + str(uuid.uuid4()))
+    key = run_key(payload)
+    flight = _in_flight.get(key)
+    if flight is None:
+        task = asyncio.ensure_future(execute_pipeline({**payload, 'request_id': request_id}))
+        _in_flight[key] = (task, request_id)
+
+        def land(done):
+            if _in_flight.get(key, (None,))[0] is done:
+                del _in_flight[key]
+
+        task.add_done_callback(land)
+        return await asyncio.shield(task)
+
+    task, leader_id = flight
+    app.logger.info("RUN coalesced request_id=%s with in-flight request_id=%s", request_id, leader_id)
+    final_report, http_status = await asyncio.shield(task)
+    final_report = {**{k: v for k, v in final_report.items() if k != 'resume_url'},
+                    'request_id': request_id, 'coalesced_with': leader_id}
+    return final_report, http_status
+
+# --- streaming -----------------------------------------------------------------
+# /run streams when the client sends `Accept: application/x-ndjson` or
+# `Accept: text/event-stream`, or passes ?stream=ndjson / ?stream=sse. Each
+# provenance entry is written as its agent returns (completion order) and the
+# final_report, without the provenance already sent, comes last together with
+# the http_status the non-streaming call would have returned.
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+
+def stream_format(accept, stream_arg):
+    if stream_arg in STREAM_MIMETYPES:
+        return stream_arg
+    accept = accept or ''
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    if 'text/event-stream' in accept:
+        return 'sse'
+    return None
+
+def encode_event(fmt, event, data):
+    if fmt == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({'event': event, 'data': data}) + '\n'
+
+def final_event(final_report, http_status):
+    summary = {k: v for k, v in final_report.items() if k != 'provenance'}
+    summary['http_status'] = http_status
+    return summary
+
+def read_run_payload():
+    """Parse the JSON body of a Flask request, falling back to an empty dict."""
+    try:
+        payload = request.json or {}
+    except Exception:
+        payload = {}
+    if not isinstance(payload, dict):
+        return {}
+    payload.update(deadline_fields(payload, request.headers.get))
+    return payload
+
+# Health check
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'service': 'eva-eco-orchestrator'}), 200
+
+# Diagnostics: connection pool usage per agent
+@app.route('/diagnostics/pools', methods=['GET'])
+def diagnostics_pools():
+    return jsonify({'engine': ENGINE, 'pools': {**pool_stats(), **async_pool_stats()}}), 200
+
+# Prometheus metrics
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Diagnostics: adaptive concurrency limits per agent
+@app.route('/diagnostics/limits', methods=['GET'])
+def diagnostics_limits():
+    return jsonify({'limits': {name: l.snapshot() for name, l in list(_limiters.items())}}), 200
+
+# Diagnostics: circuit breaker state per agent
+@app.route('/diagnostics/breakers', methods=['GET'])
+def diagnostics_breakers():
+    return jsonify({'breakers': {name: b.snapshot() for name, b in list(_breakers.items())}}), 200
+
+# Diagnostics: logging pipeline (queue depth and dropped records)
+@app.route('/diagnostics/logging', methods=['GET'])
+def diagnostics_logging():
+    return jsonify({'logging': logging_stats()}), 200
+
+# Diagnostics: agent result cache
+@app.route('/diagnostics/cache', methods=['GET'])
+def diagnostics_cache():
+    return jsonify({'cache': result_cache.stats()}), 200
+
+# Main runner
+@app.route('/run', methods=['POST'])
+def run():
+    fmt = stream_format(request.headers.get('Accept'), request.args.get('stream'))
+    if fmt is not None:
+        return stream_run(read_run_payload(), fmt)
+    final_report, http_status = run_in_engine(run_single_flight(read_run_payload()))
+    return jsonify(final_report), http_status
+
+def stream_run(payload, fmt):
+    """Flask side of streaming mode: bridge engine-loop events to a chunked response."""
+    events = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        execute_pipeline(payload, on_entry=lambda entry: events.put(('provenance', entry))), engine_loop())
+    future.add_done_callback(lambda f: events.put(None))
+
+    def generate():
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            yield encode_event(fmt, *item)
+        final_report, http_status = future.result()
+        yield encode_event(fmt, 'final_report', final_event(final_report, http_status))
+
+    return Response(generate(), mimetype=STREAM_MIMETYPES[fmt])
+
+# Resume a failed run from its checkpoints
+@app.route('/run/<request_id>/resume', methods=['POST'])
+def resume_run(request_id):
+    body, http_status = run_in_engine(resume_pipeline(request_id, deadline_fields(read_run_payload())))
+    return jsonify(body), http_status
+
+# Batch runner: one NDJSON line per job, in completion order
+@app.route('/run/batch', methods=['POST'])
+def run_batch_route():
+    jobs, concurrency, error = validate_batch(read_run_payload())
+    if error is not None:
+        return jsonify({'status': 'error', 'notes': error}), 400
+
+    results = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        run_batch(jobs, lambda i, report, code: results.put(batch_line(i, report, code)), concurrency), engine_loop())
+    future.add_done_callback(lambda f: results.put(None))
+
+    def stream():
+        while True:
+            line = results.get()
+            if line is None:
+                break
+            yield line
+        if future.exception() is not None:
+            app.logger.error("BATCH failed: %r", future.exception())
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+# Async jobs: submit now, poll or receive a callback later
+@app.route('/jobs', methods=['POST'])
+def submit_job_route():
+    body, http_status, headers = run_in_engine(job_submission(read_run_payload()))
+    return jsonify(body), http_status, headers
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_route(job_id):
+    body, http_status = job_status(job_id)
+    return jsonify(body), http_status
+
+# --- ASGI entrypoint -----------------------------------------------------------
+# `uvicorn app:asgi_app` serves /run, /run/batch, /run/<id>/resume and /jobs
+# natively on the event loop so hundreds of concurrent runs share one process
+# without a thread each. The remaining routes (health, metrics, diagnostics)
+# only read in-memory state and are delegated to the Flask app through
+# asgiref's WSGI adapter, which runs them all on one shared thread, so nothing
+# that waits on a pipeline may go through it.
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    _wsgi_fallback = WsgiToAsgi(app)
+except Exception:
+    _wsgi_fallback = None
+
+async def _asgi_body(receive):
+    body = b''
+    more = True
+    while more:
+        message = await receive()
+        body += message.get('body', b'')
+        more = message.get('more_body', False)
+    return body
+
+async def _asgi_payload(scope, receive):
+    """ASGI counterpart of read_run_payload(); returns (payload, headers)."""
+    try:
+        payload = json.loads(await _asgi_body(receive) or b'{}') or {}
+    except ValueError:
+        payload = {}
+    if not isinstance(payload, dict):
+        payload = {}
+    headers = dict(scope.get('headers') or [])
+    payload.update(deadline_fields(payload, lambda h: headers.get(h.lower().encode(), b'').decode('latin-1')))
+    return payload, headers
+
+async def _asgi_json(send, http_status, obj, headers=None):
+    body = json.dumps(obj).encode('utf-8')
+    extra = [(k.lower().encode(), str(v).encode()) for k, v in (headers or {}).items()]
+    await send({
+        'type': 'http.response.start',
+        'status': http_status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + extra
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _asgi_stream(send, payload, fmt):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', STREAM_MIMETYPES[fmt].encode()), (b'cache-control', b'no-cache')]
+    })
+    events = asyncio.Queue()
+    task = asyncio.ensure_future(execute_pipeline(payload, on_entry=events.put_nowait))
+    task.add_done_callback(lambda t: events.put_nowait(None))
+    while True:
+        entry = await events.get()
+        if entry is None:
+            break
+        await send({'type': 'http.response.body', 'body': encode_event(fmt, 'provenance', entry).encode(), 'more_body': True})
+    final_report, http_status = task.result()
+    body = encode_event(fmt, 'final_report', final_event(final_report, http_status)).encode()
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _asgi_batch(send, jobs, concurrency):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'application/x-ndjson'), (b'cache-control', b'no-cache')]
+    })
+    lines = asyncio.Queue()
+    task = asyncio.ensure_future(run_batch(jobs, lambda i, report, code: lines.put_nowait(batch_line(i, report, code)), concurrency))
+    task.add_done_callback(lambda t: lines.put_nowait(None))
+    while True:
+        line = await lines.get()
+        if line is None:
+            break
+        await send({'type': 'http.response.body', 'body': line.encode(), 'more_body': True})
+    if not task.cancelled() and task.exception() is not None:
+        app.logger.error("BATCH failed: %r", task.exception())
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                bind_engine_loop(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_async_sessions()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    bind_engine_loop(asyncio.get_running_loop())
+    method = scope['method']
+    parts = scope['path'].strip('/').split('/')
+    if parts == ['run'] and method == 'POST':
+        payload, headers = await _asgi_payload(scope, receive)
+        query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+        fmt = stream_format(headers.get(b'accept', b'').decode('latin-1'), (query.get('stream') or [None])[0])
+        if fmt is not None:
+            await _asgi_stream(send, payload, fmt)
+            return
+        final_report, http_status = await run_single_flight(payload)
+        await _asgi_json(send, http_status, final_report)
+    elif parts == ['run', 'batch'] and method == 'POST':
+        jobs, concurrency, error = validate_batch((await _asgi_payload(scope, receive))[0])
+        if error is not None:
+            await _asgi_json(send, 400, {'status': 'error', 'notes': error})
+            return
+        await _asgi_batch(send, jobs, concurrency)
+    elif len(parts) == 3 and parts[0] == 'run' and parts[2] == 'resume' and method == 'POST':
+        payload, _ = await _asgi_payload(scope, receive)
+        body, http_status = await resume_pipeline(parts[1], deadline_fields(payload))
+        await _asgi_json(send, http_status, body)
+    elif parts == ['jobs'] and method == 'POST':
+        body, http_status, headers = await job_submission((await _asgi_payload(scope, receive))[0])
+        await _asgi_json(send, http_status, body, headers)
+    elif len(parts) == 2 and parts[0] == 'jobs' and method == 'GET':
+        body, http_status = job_status(parts[1])
+        await _asgi_json(send, http_status, body)
+    elif _wsgi_fallback is not None:
+        await _wsgi_fallback(scope, receive, send)
+    else:
+        await _asgi_json(send, 404, {'error': 'not found'})
 
 
 if __name__ == '__main__':
     debug_flag = os.environ.get('DEBUG', '0') == '1'
-    app.run(host='0.0.0.0', port=8080, debug=debug_flag)
+    PORT = int(os.environ.get('PORT', '8080'))
+    if ENGINE == 'async':
+        try:
+            import uvicorn
+            uvicorn.run(asgi_app, host='0.0.0.0', port=PORT, log_level='warning')
+            raise SystemExit(0)
+        except ImportError:
+            app.logger.warning("uvicorn is not installed; serving the async engine through Flask")
+    app.run(host='0.0.0.0', port=PORT, debug=debug_flag, threaded=True)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Local load benchmark for the orchestrator.
+
+Starts the six mock agents (mocks/app.py) and the orchestrator on localhost
+ports, drives POST /run at a fixed request rate (or closed-loop with --rps 0)
+with at most --concurrency requests in flight, and writes a JSON report with
+throughput, end-to-end latency percentiles and per-agent breakdowns taken from
+each run's provenance. Reports carry the git commit so they can be compared
+across commits; --baseline prints the deltas against an earlier report.
+
+    python scripts/bench.py --rps 50 --concurrency 32 --duration 30 --out bench.json
+    python scripts/bench.py --url http://localhost:8080   # against a running stack
+
+Mock behaviour is set with --latency-ms, --jitter-ms, --partial-rate,
+--error-rate and --rows for every agent, and per agent with --faults, a JSON
+object keyed by agent name (see the fault settings in mocks/app.py):
+
+    python scripts/bench.py --faults '{"MBO": {"latency_dist": "lognormal", "latency_ms": 80, "error_rate": 0.05}}'
+
+Other MOCK_* variables in the environment are passed through unchanged.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENTS = ['mdc', 'mar', 'cfa', 'cps', 'mbo', 'ftm']
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pct(q):
+        return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)], 4)
+
+    return {'count': len(ordered), 'mean': round(sum(ordered) / len(ordered), 4), 'min': round(ordered[0], 4),
+            'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99), 'max': round(ordered[-1], 4)}
+
+
+def wait_healthy(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} did not become healthy within {timeout}s')
+
+
+def start_stack(args, workdir):
+    """Start mocks and orchestrator as subprocesses; returns (orchestrator_url, processes)."""
+    procs = []
+    urls = []
+    mock_env = {'MOCK_LATENCY_MS': str(args.latency_ms), 'MOCK_JITTER_MS': str(args.jitter_ms),
+                'MOCK_PARTIAL_RATE': str(args.partial_rate), 'MOCK_ERROR_RATE': str(args.error_rate),
+                'MOCK_ROWS': str(args.rows)}
+    if args.faults:
+        mock_env['MOCK_FAULTS'] = args.faults
+    for i, name in enumerate(AGENTS):
+        port = args.mock_port + i
+        env = {**os.environ, **mock_env, 'AGENT_NAME': name.upper(), 'MOCK_PORT': str(port)}
+        procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'mocks', 'app.py')], env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        urls.append(f'{name}=http://127.0.0.1:{port}/run')
+        wait_healthy(f'http://127.0.0.1:{port}/health')
+    env = {**os.environ, 'AGENT_URLS': ','.join(urls), 'PORT': str(args.port),
+           'AGENT_POLICY_FILE': os.environ.get('AGENT_POLICY_FILE', os.path.join(ROOT, 'agent_policy.yml')),
+           'LOG_DIR': workdir, 'DATA_DIR': workdir}
+    procs.append(subprocess.Popen([sys.executable, os.path.join(ROOT, 'orchestrator', 'app.py')], env=env,
+                                  cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    url = f'http://127.0.0.1:{args.port}'
+    wait_healthy(url + '/health')
+    return url, procs
+
+
+def run_body(i, args):
+    body = {'job': 'bench', 'request_id': f'bench-{os.getpid()}-{i}', 'initiator': 'bench',
+            'date_from': '2025-11-28', 'date_to': '2025-11-28', 'channels': ['email']}
+    # distinct campaigns per request keep the result cache and single-flight out of the measurement
+    body['campaign_ids'] = [101] if args.repeat else [100000 + i]
+    if args.budget_s:
+        body['budget_s'] = args.budget_s
+    return body
+
+
+def drive(url, args):
+    local = threading.local()
+    results = []
+    lock = threading.Lock()
+
+    def one(i, scheduled):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.time()
+        record = {'lag_s': start - scheduled}
+        try:
+            r = session.post(url + '/run', json=run_body(i, args), timeout=args.timeout)
+            record['http_status'] = r.status_code
+            report = r.json()
+            record['status'] = report.get('status', 'error')
+            record['provenance'] = [{'agent': e.get('agent'), 'status': e.get('status'),
+                                     'call_meta': e.get('call_meta') or {}} for e in report.get('provenance') or []]
+        except (requests.RequestException, ValueError) as e:
+            record['http_status'] = 0
+            record['status'] = 'transport_error'
+            record['error'] = repr(e)
+        record['latency_s'] = time.time() - start
+        with lock:
+            results.append(record)
+
+    slots = threading.BoundedSemaphore(args.concurrency)
+
+    def release(_):
+        slots.release()
+
+    started = time.time()
+    stop_at = started + args.duration
+    interval = 1.0 / args.rps if args.rps > 0 else 0.0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        i = 0
+        while time.time() < stop_at and (not args.requests or i < args.requests):
+            scheduled = started + i * interval if interval else time.time()
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            # open loop: a request waiting for a free slot shows up as scheduling lag
+            slots.acquire()
+            pool.submit(one, i, scheduled).add_done_callback(release)
+            i += 1
+    return results, time.time() - started
+
+
+def summarize(results, elapsed, args, url):
+    statuses = Counter(r['status'] for r in results)
+    http = Counter(str(r['http_status']) for r in results)
+    agents = defaultdict(lambda: {'latency': [], 'status': Counter(), 'attempts': Counter(), 'sources': Counter()})
+    for r in results:
+        for entry in r.get('provenance', []):
+            a = agents[entry['agent']]
+            meta = entry['call_meta']
+            a['latency'].append(meta.get('duration_s', 0.0))
+            a['status'][entry['status']] += 1
+            a['attempts'][str(meta.get('attempt', 0))] += 1
+            for flag in ('cache', 'hedged', 'shed', 'deadline_exceeded', 'circuit', 'checkpoint'):
+                if meta.get(flag):
+                    a['sources'][f'{flag}={meta[flag]}' if isinstance(meta[flag], str) else flag] += 1
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'target': url,
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+        'elapsed_s': round(elapsed, 3),
+        'requests': len(results),
+        'throughput_rps': round(len(results) / elapsed, 3) if elapsed else 0.0,
+        'ok_rps': round(statuses.get('ok', 0) / elapsed, 3) if elapsed else 0.0,
+        'status': dict(statuses),
+        'http_status': dict(http),
+        'latency_s': percentiles([r['latency_s'] for r in results]),
+        'schedule_lag_s': percentiles([r['lag_s'] for r in results]),
+        'agents': {name: {'latency_s': percentiles(a['latency']), 'status': dict(a['status']),
+                          'attempts': dict(a['attempts']), 'flags': dict(a['sources'])}
+                   for name, a in sorted(agents.items())},
+    }
+
+
+def compare(report, baseline):
+    """Relative change of the headline numbers against an earlier report."""
+    def delta(new, old):
+        return None if not old or new is None else round((new - old) / old, 4)
+
+    out = {'baseline_commit': baseline.get('commit'),
+           'throughput_rps': delta(report['throughput_rps'], baseline.get('throughput_rps'))}
+    for q in ('p50', 'p95', 'p99'):
+        out[f'latency_{q}'] = delta(report['latency_s'].get(q), baseline.get('latency_s', {}).get(q))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='benchmark a running orchestrator instead of starting one')
+    parser.add_argument('--rps', type=float, default=20.0, help='target request rate; 0 = closed loop')
+    parser.add_argument('--concurrency', type=int, default=16, help='max requests in flight')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to generate load')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests (0 = no limit)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='client timeout per /run')
+    parser.add_argument('--budget-s', type=float, default=0.0, help='budget_s sent with every run (0 = none)')
+    parser.add_argument('--repeat', action='store_true', help='send the same campaign every time (cache/single-flight on)')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='mock latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform jitter added to mock latency')
+    parser.add_argument('--partial-rate', type=float, default=0.0, help='share of partial mock replies')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of error mock replies')
+    parser.add_argument('--rows', type=int, default=0, help='generated mdc-style rows per reply (0 = canned data)')
+    parser.add_argument('--faults', help='per-agent mock fault settings as JSON, e.g. {"MBO": {"error_rate": 0.1}}')
+    parser.add_argument('--port', type=int, default=18080, help='orchestrator port')
+    parser.add_argument('--mock-port', type=int, default=18101, help='first of six mock agent ports')
+    parser.add_argument('--out', help='write the JSON report here (default: stdout)')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    args = parser.parse_args()
+
+    procs = []
+    with tempfile.TemporaryDirectory(prefix='eva-bench-') as workdir:
+        try:
+            if args.url:
+                url = args.url.rstrip('/')
+            else:
+                url, procs = start_stack(args, workdir)
+            results, elapsed = drive(url, args)
+        finally:
+            for p in procs:
+                p.terminate()
+            for p in procs:
+                try:
+                    p.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    p.kill()
+
+    report = summarize(results, elapsed, args, url)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['vs_baseline'] = compare(report, json.load(f))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"{report['requests']} requests, {report['throughput_rps']} rps, "
+              f"p50={report['latency_s'].get('p50')}s p95={report['latency_s'].get('p95')}s "
+              f"p99={report['latency_s'].get('p99')}s -> {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 ﻿#!/usr/bin/env bash
 set -euo pipefail
+echo "Running unit and in-process integration tests..."
+python3 -m pytest -q tests
 echo "Running integration smoke tests (local docker-compose)..."
-docker-compose -f docker-compose.yml up -d --build
+docker-compose -f docker-compose.yml -f docker-compose.override.yml up -d --build
 # wait for health
 for i in $(seq 1 30); do
   if curl -sS http://localhost:8080/health >/dev/null 2>&1; then
@@ -24,4 +26,4 @@ if not j.get("provenance") or len(j.get("provenance"))<6:
   print("Bad provenance", j); sys.exit(3)
 print("Smoke OK")
 PY
-docker-compose -f docker-compose.yml down --volumes --remove-orphans
+docker-compose -f docker-compose.yml -f docker-compose.override.yml down --volumes --remove-orphans
@@ -0,0 +1,134 @@
+"""
+In-process test harness.
+
+The six mock agents (mocks/app.py) are served from background threads on
+ephemeral localhost ports, and the orchestrator (orchestrator/app.py) is
+imported with AGENT_URLS pointing at them, the repo's agent_policy.yml and
+its logs, SQLite stores and artifacts in a temporary directory. Each mock
+records the decoded request bodies it receives in `received[agent]`.
+State that outlives a request (policy, caches, breakers, limiters, stores,
+mock faults) is reset after every test.
+"""
+import copy
+import importlib.util
+import os
+import tempfile
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENTS = ['mdc', 'mar', 'cfa', 'cps', 'mbo', 'ftm']
+WORKDIR = tempfile.mkdtemp(prefix='eva-tests-')
+ARTIFACT_DIR = os.path.join(WORKDIR, 'artifacts')
+
+
+def load_module(name, path, env):
+    """Import `path` as module `name` with `env` set (both apps read their settings at import)."""
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+    return module
+
+
+def start_mocks():
+    for key in [k for k in os.environ if k.startswith('MOCK_')]:
+        del os.environ[key]
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    mocks, received, urls = {}, {}, []
+    for name in AGENTS:
+        module = load_module(f'mock_{name}', os.path.join(ROOT, 'mocks', 'app.py'),
+                             {'AGENT_NAME': name.upper(), 'ARTIFACT_DIR': ARTIFACT_DIR})
+        received[name] = []
+
+        def record(module=module, bodies=received[name]):
+            if module.request.path == '/run':
+                bodies.append(module.read_request())
+
+        module.app.before_request(record)
+        server = make_server('127.0.0.1', 0, module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        mocks[name] = module
+        urls.append(f'{name}=http://127.0.0.1:{server.server_port}/run')
+    return mocks, received, ','.join(urls)
+
+
+MOCKS, RECEIVED, AGENT_URLS = start_mocks()
+ORCH = load_module('orchestrator_app', os.path.join(ROOT, 'orchestrator', 'app.py'), {
+    'AGENT_URLS': AGENT_URLS,
+    'AGENT_POLICY_FILE': os.path.join(ROOT, 'agent_policy.yml'),
+    'LOG_DIR': WORKDIR,
+    'DATA_DIR': WORKDIR,
+    'ARTIFACT_DIR': ARTIFACT_DIR,
+})
+POLICY = copy.deepcopy(ORCH.agent_policy)
+# the console handler holds the stderr pytest captured at import; records still reach the log file and caplog
+ORCH.app.logger.removeHandler(ORCH.ch)
+
+
+def clear_store(store, *tables):
+    if store is None:
+        return
+    if hasattr(store, 'flush'):
+        store.flush()
+    with store.lock:
+        for table in tables:
+            store.db.execute(f'DELETE FROM {table}')
+
+
+@pytest.fixture
+def orch():
+    return ORCH
+
+
+@pytest.fixture
+def mocks():
+    return MOCKS
+
+
+@pytest.fixture
+def received():
+    return RECEIVED
+
+
+@pytest.fixture
+def client():
+    return ORCH.app.test_client()
+
+
+@pytest.fixture
+def run(client):
+    """POST /run with the smoke-test body, overridden by keyword arguments; returns the response."""
+    def post(**fields):
+        body = {'job': 'daily_summary', 'request_id': 'test-run', 'initiator': 'test',
+                'date_from': '2025-11-28', 'date_to': '2025-11-28', 'campaign_ids': [101], 'channels': ['email']}
+        body.update(fields)
+        return client.post('/run', json=body)
+    return post
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    yield
+    ORCH.agent_policy.clear()
+    ORCH.agent_policy.update(copy.deepcopy(POLICY))
+    for registry in (ORCH._breakers, ORCH._limiters, ORCH._latencies, ORCH._wire_caps, ORCH._in_flight):
+        registry.clear()
+    with ORCH.result_cache.lock:
+        ORCH.result_cache.entries.clear()
+        ORCH.result_cache.size = 0
+    clear_store(ORCH.partial_store, 'partials', 'coverage')
+    clear_store(ORCH.checkpoints, 'checkpoints', 'runs')
+    for name, module in MOCKS.items():
+        module.faults = module.env_faults()
+        RECEIVED[name].clear()
@@ -0,0 +1,31 @@
+def mdc_row(campaign, day, channel, impressions, clicks=0, conversions=0):
+    return {'campaign_id': campaign, 'date': day, 'channel': channel,
+            'metrics': {'impressions': impressions, 'clicks': clicks, 'conversions': conversions}}
+
+
+def test_groups_keep_first_seen_order_and_colliding_keys_apart(orch):
+    # hash(-1) == hash(-2) in CPython, so these two only stay apart through the == check
+    rows = [mdc_row(-1, '2025-11-02', 'sms', 10, 1), mdc_row(-2, '2025-11-01', 'email', 20, 4),
+            mdc_row(-1, '2025-11-01', 'sms', 30, 3)]
+    summary = orch.aggregate_outputs({'mdc': {'status': 'ok', 'data': rows}})['metrics_summary']
+    assert [(g['campaign_id'], g['impressions'], g['ctr']) for g in summary['by_campaign']] == [(-1, 40.0, 0.1), (-2, 20.0, 0.2)]
+    assert [g['date'] for g in summary['by_date']] == ['2025-11-02', '2025-11-01']
+    assert summary['rows'] == 3 and summary['totals']['clicks'] == 8.0
+
+
+def test_missing_and_junk_metrics_count_as_zero(orch):
+    rows = [mdc_row(101, '2025-11-01', 'email', None, '2'), mdc_row(101, '2025-11-01', 'email', 'n/a', 1),
+            {'campaign_id': 101, 'date': '2025-11-01', 'channel': 'email'}]
+    totals = orch.aggregate_outputs({'mdc': {'status': 'ok', 'data': rows}})['metrics_summary']['totals']
+    assert (totals['impressions'], totals['clicks']) == (0.0, 3.0)
+
+
+def test_daily_partials_sum_per_key(orch):
+    rows = [dict(mdc_row(101, '2025-11-01', 'email', 100, 5), confidence=0.5),
+            dict(mdc_row(101, '2025-11-01', 'email', 300, 15), confidence=0.9),
+            dict(mdc_row(102, '2025-11-01', 'email', 50), confidence=0.7),
+            dict(mdc_row(101, '2025-11-02', 'email', 50), confidence=0.7)]
+    partials = orch.daily_partials(rows, {'2025-11-01'}, [101])
+    assert partials == [{'campaign_id': 101, 'date': '2025-11-01', 'channel': 'email',
+                         'metrics': {'impressions': 400.0, 'clicks': 20.0, 'conversions': 0.0},
+                         'confidence': 0.8, 'rows': 2}]
@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+
+def test_artifact_backends_must_implement_the_interface(orch):
+    with pytest.raises(TypeError):
+        orch.ArtifactStore()
+
+    class WriteOnly(orch.ArtifactStore):
+        def put(self, body, content_type='application/json', records=None):
+            return {}
+
+    with pytest.raises(TypeError):
+        WriteOnly()
+    assert isinstance(orch.artifact_store, orch.ArtifactStore)
+
+
+def test_artifacts_are_loaded_off_the_engine_loop(orch, mocks, run, client, monkeypatch):
+    monkeypatch.setattr(mocks['mdc'], 'ARTIFACT_MIN_BYTES', 0)
+    threads = []
+    read = orch.artifact_store.read
+
+    def spy(handle):
+        threads.append(orch.threading.current_thread().name)
+        return read(handle)
+
+    monkeypatch.setattr(orch.artifact_store, 'read', spy)
+    # incremental: a single gap call, then a sharded gap
+    assert run(date_from='2025-10-01', date_to='2025-10-01').status_code == 200
+    orch.agent_policy['mdc']['shard_days'] = 1
+    assert run(date_from='2025-10-02', date_to='2025-10-03').status_code == 200
+    # a coalesced batch call shared by two jobs
+    orch.agent_policy['mdc'].update({'incremental': False, 'shard_days': 0})
+    jobs = [{'job': 'daily_summary', 'request_id': f'artifact-{c}', 'date_from': '2025-10-04', 'date_to': '2025-10-04',
+             'campaign_ids': [c], 'channels': ['email']} for c in (101, 102)]
+    assert client.post('/run/batch', json={'jobs': jobs}).status_code == 200
+    assert len(threads) >= 4 and 'orchestrator-engine' not in threads
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_prune_removes_old_artifacts_and_temp_files(orch, tmp_path):
+    store = orch.FileArtifactStore(str(tmp_path))
+    old, fresh = store.put(b'[1]'), store.put(b'[2]')
+    tmp = tmp_path / 'abandoned.json.0123.tmp'
+    tmp.write_bytes(b'[')
+    age(store.path(old), 3600)
+    age(tmp, 3600)
+    assert store.prune(ttl_s=60) == 2
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(store.path(fresh))]
+
+    # storing the same content again refreshes its age
+    age(store.path(fresh), 3600)
+    store.put(b'[2]')
+    assert store.prune(ttl_s=60) == 0
+    assert bytes(store.read(fresh)) == b'[2]'
+
+
+def test_pruner_thread_runs_periodically(orch, tmp_path, monkeypatch):
+    monkeypatch.setattr(orch, 'ARTIFACT_TTL_S', 60.0)
+    monkeypatch.setattr(orch, 'ARTIFACT_PRUNE_INTERVAL_S', 0.05)
+    store = orch.FileArtifactStore(str(tmp_path))
+    handle = store.put(b'[3]')
+    age(store.path(handle), 3600)
+    for _ in range(100):
+        if not os.path.exists(store.path(handle)):
+            break
+        time.sleep(0.02)
+    assert not os.path.exists(store.path(handle))
+
+
+def test_mock_agents_write_the_store_layout(orch, mocks, tmp_path, monkeypatch):
+    monkeypatch.setattr(mocks['mdc'], 'ARTIFACT_DIR', str(tmp_path))
+    monkeypatch.setattr(mocks['mdc'], 'ARTIFACT_MIN_BYTES', 0)
+    data = [{'campaign_id': 101, 'n': i} for i in range(3)]
+    base = {'data': list(data)}
+    mocks['mdc'].offload(base)
+    store = orch.FileArtifactStore(str(tmp_path))
+    body = orch.json.dumps(data).encode('utf-8')
+    assert base['artifact'] == store.put(body, records=len(data))
+    assert os.listdir(tmp_path) == [os.path.basename(store.path(base['artifact']))]
+    assert orch.json.loads(bytes(store.read(base['artifact']))) == data
+
+
+def test_aggregation_loads_only_the_agents_it_rolls_up(orch):
+    missing = {'uri': 'artifact://' + '0' * 64, 'size': 2, 'content_type': 'application/json'}
+    responses = {'mdc': {'status': 'ok', 'data': []}, 'mar': {'status': 'ok', 'artifact': missing}}
+    out = orch.aggregate_outputs(responses)
+    assert out['_aggregation']['rows'] == 0
+    assert responses['mar']['artifact'] is missing
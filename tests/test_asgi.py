@@ -0,0 +1,86 @@
+import asyncio
+import json
+import time
+
+
+async def asgi_request(app, method, path, body=None):
+    """Drive one request through an ASGI app; returns (status, headers, body bytes)."""
+    data = json.dumps(body).encode() if body is not None else b''
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'', 'server': ('test', 80),
+             'client': ('127.0.0.1', 1),
+             'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]}
+    chunks = [{'type': 'http.request', 'body': data, 'more_body': False}]
+    messages = []
+
+    async def receive():
+        return chunks.pop(0) if chunks else {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = messages[0]
+    return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+
+def on_engine(orch, coro):
+    return asyncio.run_coroutine_threadsafe(coro, orch.engine_loop()).result(timeout=60)
+
+
+def run_body(request_id, day='2025-11-28'):
+    return {'job': 'daily_summary', 'request_id': request_id, 'date_from': day, 'date_to': day,
+            'campaign_ids': [101], 'channels': ['email']}
+
+
+def test_long_routes_are_served_natively(orch, mocks, monkeypatch):
+    async def no_wsgi(scope, receive, send):
+        raise AssertionError(f"{scope['method']} {scope['path']} went through the WSGI adapter")
+
+    monkeypatch.setattr(orch, '_wsgi_fallback', no_wsgi)
+
+    async def scenario():
+        status, headers, body = await asgi_request(orch.asgi_app, 'POST', '/run/batch',
+                                                   {'jobs': [run_body('b-1'), run_body('b-2')]})
+        assert status == 200 and headers[b'content-type'] == b'application/x-ndjson'
+        assert sorted(json.loads(line)['http_status'] for line in body.splitlines()) == [200, 200]
+
+        status, _, body = await asgi_request(orch.asgi_app, 'POST', '/run/batch', {'jobs': []})
+        assert status == 400
+
+        status, headers, body = await asgi_request(orch.asgi_app, 'POST', '/jobs', run_body('job-1'))
+        assert status == 202
+        status_url = json.loads(body)['status_url']
+        for _ in range(100):
+            status, _, body = await asgi_request(orch.asgi_app, 'GET', status_url)
+            if json.loads(body)['finished_at']:
+                break
+            await asyncio.sleep(0.05)
+        assert status == 200 and json.loads(body)['status'] == 'ok'
+
+        mocks['mbo'].faults['error_rate'] = 1.0
+        status, _, _ = await asgi_request(orch.asgi_app, 'POST', '/run', run_body('asgi-resume'))
+        assert status == 500
+        mocks['mbo'].faults['error_rate'] = 0.0
+        status, _, body = await asgi_request(orch.asgi_app, 'POST', '/run/asgi-resume/resume', {})
+        assert status == 200 and json.loads(body)['resumed']['restored_agents'][0] == 'mdc'
+
+    on_engine(orch, scenario())
+
+
+def test_health_answers_while_a_batch_is_running(orch, mocks):
+    mocks['mdc'].faults['latency_ms'] = 600.0
+
+    async def scenario():
+        batch = asyncio.ensure_future(asgi_request(orch.asgi_app, 'POST', '/run/batch', {'jobs': [run_body('slow', '2025-10-01')]}))
+        await asyncio.sleep(0.1)
+        start = time.time()
+        status, _, _ = await asgi_request(orch.asgi_app, 'GET', '/health')
+        elapsed = time.time() - start
+        assert status == 200
+        assert not batch.done()
+        assert elapsed < 0.3
+        status, _, body = await batch
+        assert json.loads(body)['http_status'] == 200
+
+    on_engine(orch, scenario())
@@ -0,0 +1,61 @@
+import json
+
+
+def batch(client, jobs, **fields):
+    r = client.post('/run/batch', json={'jobs': jobs, **fields})
+    assert r.status_code == 200
+    return sorted((json.loads(line) for line in r.data.decode().splitlines()), key=lambda x: x['index'])
+
+
+def job(campaign, **fields):
+    return {'job': 'daily_summary', 'request_id': f'batch-{campaign}', 'date_from': '2025-11-01',
+            'date_to': '2025-11-03', 'campaign_ids': [campaign], 'channels': ['email'], **fields}
+
+
+def test_coalesced_jobs_share_one_root_call(client, received):
+    results = batch(client, [job(101), job(102)])
+    assert [r['http_status'] for r in results] == [200, 200]
+    assert len(received['mdc']) == 1
+    assert received['mdc'][0]['payload']['campaign_ids'] == [101, 102]
+    for r in results:
+        assert r['final_report']['provenance'][0]['call_meta']['coalesced_jobs'] == 2
+
+
+def test_coalesced_root_call_is_sharded_and_incremental(orch, client, received):
+    orch.agent_policy['mdc'].update({'shard_days': 1, 'shard_campaigns': 1})
+    results = batch(client, [job(101), job(102)])
+    bodies = [b['payload'] for b in received['mdc']]
+    assert len(bodies) == 6
+    assert {(tuple(b['campaign_ids']), b['date_from'], b['date_to']) for b in bodies} == {
+        ((c,), d, d) for c in (101, 102) for d in ('2025-11-01', '2025-11-02', '2025-11-03')}
+    meta = results[0]['final_report']['provenance'][0]['call_meta']
+    assert len(meta['shards']) == 6
+    assert meta['incremental']['fetched_days'] == 3
+
+    received['mdc'].clear()
+    results = batch(client, [job(101, request_id='again-101'), job(102, request_id='again-102')])
+    assert received['mdc'] == []
+    assert results[0]['final_report']['provenance'][0]['call_meta']['incremental']['stored_days'] == 3
+
+
+def test_coalesced_calls_respect_max_concurrency(orch, mocks, client, received, monkeypatch):
+    mocks['mdc'].faults['latency_ms'] = 100.0
+    active, peak = [0], [0]
+    loaded = orch.loaded
+
+    async def counted(call):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        try:
+            return await loaded(call)
+        finally:
+            active[0] -= 1
+
+    monkeypatch.setattr(orch, 'loaded', counted)
+    # four groups of two jobs, interleaved so both slots hold jobs of different groups
+    jobs = [job(101 + i, request_id=f'mc-{i}', date_from=f'2025-09-0{1 + i % 4}', date_to=f'2025-09-0{1 + i % 4}')
+            for i in range(8)]
+    results = batch(client, jobs, max_concurrency=2)
+    assert [r['http_status'] for r in results] == [200] * 8
+    assert len(received['mdc']) == 4
+    assert peak[0] <= 2
@@ -0,0 +1,61 @@
+import threading
+
+
+def test_cache_work_runs_off_the_engine_loop(orch, run, received, monkeypatch):
+    threads = []
+
+    def spy(fn):
+        def wrapped(*args, **kwargs):
+            threads.append((fn.__name__, threading.current_thread().name))
+            return fn(*args, **kwargs)
+        return wrapped
+
+    monkeypatch.setattr(orch, 'cache_key', spy(orch.cache_key))
+    monkeypatch.setattr(orch.result_cache, 'get', spy(orch.result_cache.get))
+    monkeypatch.setattr(orch.result_cache, 'put', spy(orch.result_cache.put))
+    assert run(request_id='cache-1').status_code == 200
+    assert run(request_id='cache-2').status_code == 200
+    assert len(received['mar']) == 1
+    assert {name for name, _ in threads} == {'cache_key', 'get', 'put'}
+    assert all(thread != 'orchestrator-engine' for _, thread in threads)
+
+
+def ok(n):
+    return {'status': 'ok', 'data': ['x' * n], '_call_meta': {'attempt': 1}}
+
+
+def test_lru_evicts_least_recently_used_within_max_bytes(orch):
+    cache = orch.ResultCache(max_bytes=120)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, 200, ok(10), ttl=60)
+    assert cache.get('a') is not None  # 'b' is now the least recently used
+    cache.put('d', 200, ok(10), ttl=60)
+    assert cache.get('b') is None
+    assert [k for k in ('a', 'c', 'd') if cache.get(k) is not None] == ['a', 'c', 'd']
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['entries'] == 3 and stats['bytes'] <= 120
+    status_code, resp, age = cache.get('a')
+    assert status_code == 200 and resp == {'status': 'ok', 'data': ['x' * 10]} and age >= 0
+
+
+def test_entries_expire_and_oversized_responses_are_not_stored(orch):
+    cache = orch.ResultCache(max_bytes=100)
+    cache.put('big', 200, ok(200), ttl=60)
+    cache.put('gone', 200, ok(1), ttl=-1)
+    assert cache.get('big') is None and cache.get('gone') is None
+    assert cache.stats()['entries'] == 0 and cache.stats()['misses'] == 2
+
+
+def test_disk_tier_survives_a_restart_until_expiry(orch, tmp_path):
+    cache = orch.ResultCache(max_bytes=1 << 20, directory=str(tmp_path))
+    cache.put('kept', 200, ok(5), ttl=60)
+    cache.put('stale', 200, ok(5), ttl=60)
+    path = tmp_path / 'stale.json'
+    stored = orch.json.loads(path.read_text())
+    path.write_text(orch.json.dumps({**stored, 'expires_at': 0}))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['kept.json', 'stale.json']
+
+    restarted = orch.ResultCache(max_bytes=1 << 20, directory=str(tmp_path))
+    assert restarted.get('kept')[1] == {'status': 'ok', 'data': ['x' * 5]}
+    assert restarted.stats()['entries'] == 1  # promoted back into memory
+    assert restarted.get('stale') is None and not path.exists()
@@ -0,0 +1,58 @@
+def test_reused_request_id_replaces_payload_and_checkpoints(mocks, run, client, received):
+    mocks['mar'].faults['error_rate'] = 1.0
+    assert run(request_id='reused', date_from='2025-01-01', date_to='2025-01-01').status_code == 500
+    assert run(request_id='reused', date_from='2025-06-01', date_to='2025-06-01').status_code == 500
+    mocks['mar'].faults['error_rate'] = 0.0
+
+    received['mar'].clear()
+    r = client.post('/run/reused/resume')
+    assert r.status_code == 200
+    report = r.get_json()
+    assert report['resumed']['restored_agents'] == ['mdc']
+    # payload and mdc output both come from the second run
+    assert [row['date'] for row in received['mar'][0]['payload']['input_data']] == ['2025-06-01']
+    assert [row['date'] for row in report['aggregated_outputs']['metrics_summary']['by_date']] == ['2025-06-01']
+    assert report['quality_gates']['completeness'] == 1.0
+
+
+def checkpoint_rows(orch, request_id):
+    orch.checkpoints.flush()
+    with orch.checkpoints.lock:
+        return sorted(a for (a,) in orch.checkpoints.db.execute(
+            'SELECT agent FROM checkpoints WHERE request_id = ?', (request_id,)).fetchall())
+
+
+def test_only_unfinished_runs_keep_agent_outputs(orch, mocks, run):
+    assert run(request_id='finished').status_code == 200
+    assert checkpoint_rows(orch, 'finished') == []
+
+    mocks['mbo'].faults['error_rate'] = 1.0
+    assert run(request_id='failed').status_code == 500
+    assert checkpoint_rows(orch, 'failed') == ['cfa', 'cps', 'ftm', 'mar', 'mdc']
+
+
+def test_checkpoint_writes_run_off_the_engine_loop(orch, mocks, run, monkeypatch):
+    threads = []
+    save = orch.checkpoints._save_agent
+
+    def spy(*args):
+        threads.append(orch.threading.current_thread().name)
+        return save(*args)
+
+    monkeypatch.setattr(orch.checkpoints, '_save_agent', spy)
+    mocks['mbo'].faults['error_rate'] = 1.0
+    assert run(request_id='off-loop').status_code == 500
+    orch.checkpoints.flush()
+    assert threads and set(threads) == {'checkpoint-writer'}
+
+
+def test_writer_prunes_expired_runs(orch, mocks, run, monkeypatch):
+    mocks['mbo'].faults['error_rate'] = 1.0
+    assert run(request_id='expired').status_code == 500
+    assert checkpoint_rows(orch, 'expired')
+
+    monkeypatch.setattr(orch, 'CHECKPOINT_TTL_S', 0.0)
+    monkeypatch.setattr(orch, 'CHECKPOINT_PRUNE_INTERVAL_S', 0.0)
+    orch.checkpoints.save_run('later', {})
+    assert checkpoint_rows(orch, 'expired') == []
+    assert orch.checkpoints.load('expired') is None
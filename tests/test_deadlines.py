@@ -0,0 +1,57 @@
+import time
+
+
+def deadline_issue(report):
+    failed = report['provenance'][-1]
+    return failed['agent'], [i['type'] for i in failed['issues']]
+
+
+def test_exhausted_budget_fails_with_504_before_calling_agents(orch, run, received):
+    r = run(request_id='late', deadline=time.time() - 1)
+    assert r.status_code == 504
+    report = r.get_json()
+    assert report['notes'] == 'Stopped: run deadline exceeded'
+    assert deadline_issue(report) == ('mdc', ['deadline_exceeded'])
+    assert received['mdc'] == []
+
+
+def test_budget_header_caps_a_slow_agent(mocks, client):
+    mocks['mdc'].faults['latency_ms'] = 2000.0
+    start = time.time()
+    r = client.post('/run', json={'job': 'daily_summary', 'request_id': 'slow', 'date_from': '2025-11-28',
+                                  'date_to': '2025-11-28', 'campaign_ids': [101], 'channels': ['email']},
+                    headers={'X-Request-Budget': '0.6'})
+    assert r.status_code == 504
+    assert time.time() - start < 1.5
+    assert deadline_issue(r.get_json()) == ('mdc', ['deadline_exceeded'])
+
+
+def test_retry_is_skipped_when_its_backoff_would_outlast_the_share(mocks, run, received):
+    mocks['mar'].faults['latency_ms'] = 2000.0
+    start = time.time()
+    r = run(request_id='no-retry', budget_s=3)
+    assert r.status_code == 504
+    # the attempt times out at mar's share of the 3s, which leaves no room for the 1s backoff
+    assert len(received['mar']) == 1 and time.time() - start < 1.5
+    assert deadline_issue(r.get_json()) == ('mar', ['deadline_exceeded'])
+
+
+def test_attempts_are_capped_at_the_call_budget_and_forwarded(orch):
+    token = orch.call_deadline.set(time.time() + 2.0)
+    try:
+        assert 1.5 < orch.attempt_timeout(20, 1) <= 2.0
+        assert orch.backoff_delay(1) == 1 and orch.backoff_delay(2) is None
+        headers = orch.deadline_headers({'A': 'b'}, 1.0)
+        assert headers['A'] == 'b' and headers['X-Request-Budget'] == '1.000'
+        assert float(headers['X-Request-Deadline']) <= time.time() + 1.001
+    finally:
+        orch.call_deadline.reset(token)
+    assert orch.attempt_timeout(20, 2) == 40 and orch.deadline_headers({}, 1.0) == {}
+
+
+def test_budget_is_split_over_the_longest_remaining_chain(orch):
+    graph = orch.pipeline_graph()
+    now = time.time()
+    share = orch.agent_deadline('mdc', now + 10.0) - now
+    assert abs(share - 10.0 / orch.stages_from('mdc', graph)) < 0.05
+    assert orch.agent_deadline('ftm', now + 10.0) - now > share
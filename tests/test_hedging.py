@@ -0,0 +1,73 @@
+import asyncio
+from collections import deque
+
+import pytest
+
+
+@pytest.fixture
+def calls(orch, monkeypatch):
+    """Fake dispatch_call: the primary (3 attempts) hangs, the hedge (1 attempt) answers after `hedge_s`."""
+    orch._latencies['mbo'] = deque([0.01] * orch.HEDGE_MIN_SAMPLES)
+    log = {'started': [], 'cancelled': [], 'hedge_s': 0.01}
+
+    async def dispatch(name, url, job, payload, max_retries, base_timeout):
+        log['started'].append(max_retries)
+        try:
+            await asyncio.sleep(5 if max_retries > 1 else log['hedge_s'])
+        except asyncio.CancelledError:
+            log['cancelled'].append(max_retries)
+            raise
+        return 200, {'status': 'ok', 'meta': {'agent': name}}
+
+    monkeypatch.setattr(orch, 'dispatch_call', dispatch)
+    return log
+
+
+def hedged(orch, limiter):
+    return asyncio.ensure_future(orch.call_with_hedge('mbo', 'http://mbo', 'job', {}, 3, 1, limiter))
+
+
+def test_hedge_wins_in_its_own_slot_and_the_primary_is_cancelled(orch, calls):
+    limiter = orch.AdaptiveLimiter(2, 2, 1.0)
+
+    async def main():
+        assert limiter.try_acquire()
+        result = await hedged(orch, limiter)
+        await asyncio.sleep(0)
+        return result
+
+    status_code, resp = asyncio.run(main())
+    assert status_code == 200 and resp['_call_meta'] == {'hedged': True, 'hedge_won': True}
+    assert calls['started'] == [3, 1] and calls['cancelled'] == [3]
+    assert limiter.in_flight == 1
+
+
+def cancel_after(orch, limiter, calls, started):
+    async def main():
+        assert limiter.try_acquire()
+        task = hedged(orch, limiter)
+        while len(calls['started']) < started:
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.05)
+        in_flight = limiter.in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        return in_flight
+
+    return asyncio.run(main())
+
+
+def test_no_hedge_without_a_free_slot(orch, calls):
+    limiter = orch.AdaptiveLimiter(1, 1, 1.0)
+    assert cancel_after(orch, limiter, calls, started=1) == 1
+    assert calls['started'] == [3] and calls['cancelled'] == [3]
+
+
+def test_cancelled_caller_cancels_primary_and_hedge(orch, calls):
+    calls['hedge_s'] = 5
+    limiter = orch.AdaptiveLimiter(2, 2, 1.0)
+    assert cancel_after(orch, limiter, calls, started=2) == 2
+    assert sorted(calls['cancelled']) == [1, 3]
+    assert limiter.in_flight == 1
@@ -0,0 +1,83 @@
+def mdc_input(received, i):
+    return received['mar'][i]['payload']['input_data']
+
+
+def test_fresh_and_stored_rows_are_identical(orch, mocks, run, received):
+    orch.agent_policy['mar']['cache_ttl_s'] = 0
+    mocks['mdc'].faults['rows'] = 12
+    fields = {'date_from': '2025-11-01', 'date_to': '2025-11-03', 'campaign_ids': [101, 102]}
+    first = run(**fields).get_json()
+    second = run(**fields).get_json()
+    assert second['provenance'][0]['call_meta']['incremental']['stored_days'] == 3
+    assert mdc_input(received, 0) == mdc_input(received, 1)
+    assert first['provenance'][0]['data_sample'] == second['provenance'][0]['data_sample']
+    assert first['aggregated_outputs']['metrics_summary'] == second['aggregated_outputs']['metrics_summary']
+
+
+def test_rows_of_unrequested_campaigns_are_dropped(orch, run, received):
+    orch.agent_policy['mar']['cache_ttl_s'] = 0
+    # the canned mdc reply always reports campaign 101
+    for _ in range(2):
+        assert run(campaign_ids=[102]).status_code == 200
+    assert mdc_input(received, 0) == mdc_input(received, 1) == []
+
+
+def recent_window(orch):
+    today = orch.datetime.datetime.now(orch.datetime.timezone.utc).date()
+    return {'date_from': (today - orch.datetime.timedelta(days=1)).isoformat(), 'date_to': today.isoformat()}
+
+
+def test_open_days_are_fetched_every_run(orch, run, received):
+    window = recent_window(orch)
+    assert run(**window).status_code == 200
+    report = run(**window).get_json()
+    assert report['provenance'][0]['call_meta']['incremental'] == {'days': 2, 'stored_days': 1, 'fetched_days': 1,
+                                                                  'open_days': 1, 'calls': 1}
+    assert received['mdc'][1]['payload']['date_from'] == window['date_to']
+
+
+def test_open_days_policy_zero_stores_today(orch, run):
+    orch.agent_policy['mdc']['incremental_open_days'] = 0
+    window = recent_window(orch)
+    assert run(**window).status_code == 200
+    assert run(**window).get_json()['provenance'][0]['call_meta']['incremental']['stored_days'] == 2
+
+
+def test_partial_store_io_runs_off_the_engine_loop(orch, run, monkeypatch):
+    threads = []
+    for method in ('covered_days', 'save', 'load'):
+        original = getattr(orch.partial_store, method)
+
+        def spy(*args, original=original):
+            threads.append(orch.threading.current_thread().name)
+            return original(*args)
+
+        monkeypatch.setattr(orch.partial_store, method, spy)
+    for _ in range(2):
+        assert run(date_from='2025-11-01', date_to='2025-11-02').status_code == 200
+    assert len(threads) == 5 and 'orchestrator-engine' not in threads
+
+
+def test_partials_match_timestamp_dates_and_campaign_ids_as_text(orch):
+    metrics = {'impressions': 100, 'clicks': 5, 'conversions': 1}
+    rows = [{'campaign_id': 101, 'date': '2025-11-28T00:00:00Z', 'channel': 'email', 'metrics': metrics, 'confidence': 0.9},
+            {'campaign_id': 101, 'date': '2025-11-28', 'channel': 'email', 'metrics': metrics, 'confidence': 0.7}]
+    [partial] = orch.daily_partials(rows, {'2025-11-28'}, ['101'])
+    assert (partial['campaign_id'], partial['date'], partial['rows']) == (101, '2025-11-28', 2)
+    assert partial['metrics']['impressions'] == 200.0 and partial['confidence'] == 0.8
+
+
+def test_string_campaign_ids_keep_numeric_rows(orch, run, received):
+    orch.agent_policy['mar']['cache_ttl_s'] = 0
+    for _ in range(2):
+        assert run(campaign_ids=['101']).status_code == 200
+    assert len(received['mdc']) == 1
+    assert mdc_input(received, 0) == mdc_input(received, 1) != []
+    assert mdc_input(received, 0)[0]['campaign_id'] == 101
+
+
+def test_lone_campaign_id_is_a_one_item_list(run, received):
+    report = run(campaign_ids=101).get_json()
+    assert report['status'] == 'ok'
+    assert received['mdc'][0]['payload']['campaign_ids'] == [101]
+    assert mdc_input(received, 0) != []
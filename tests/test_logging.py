@@ -0,0 +1,71 @@
+import logging
+import queue
+import threading
+
+
+def record(level=logging.INFO):
+    return logging.LogRecord('orchestrator', level, __file__, 1, 'call %s', ('mdc',), None)
+
+
+def test_full_queue_drops_and_counts_records_unformatted(orch):
+    handler = orch.BoundedQueueHandler(queue.Queue(maxsize=2), 'drop')
+    for level in (logging.INFO, logging.INFO, logging.INFO, logging.WARNING):
+        handler.handle(record(level))
+    stats = handler.stats()
+    assert stats == {'mode': 'queue', 'overflow': 'drop', 'queue_size': 2, 'queue_max': 2,
+                     'dropped': {'INFO': 1, 'WARNING': 1}}
+    queued = handler.queue.get_nowait()
+    assert (queued.msg, queued.args) == ('call %s', ('mdc',))
+
+
+def test_block_overflow_waits_for_room(orch):
+    handler = orch.BoundedQueueHandler(queue.Queue(maxsize=1), 'block')
+    handler.handle(record())
+    writer = threading.Thread(target=handler.handle, args=(record(),))
+    writer.start()
+    writer.join(0.1)
+    assert writer.is_alive()
+    handler.queue.get_nowait()
+    writer.join(1)
+    assert not writer.is_alive() and handler.stats()['dropped'] == {}
+
+
+def test_drop_counters_are_exposed(orch, client, monkeypatch):
+    assert client.get('/diagnostics/logging').get_json() == {'logging': {'mode': 'sync'}}
+    handler = orch.BoundedQueueHandler(queue.Queue(maxsize=1), 'drop')
+    for _ in range(3):
+        handler.handle(record(logging.ERROR))
+    monkeypatch.setattr(orch, 'log_queue_handler', handler)
+    assert client.get('/diagnostics/logging').get_json()['logging']['dropped'] == {'ERROR': 2}
+    text = client.get('/metrics').data.decode()
+    assert 'eva_log_dropped_total{level="ERROR"} 2' in text
+    assert 'eva_log_queue_size 1' in text
+
+
+class Lines(logging.Handler):
+    def __init__(self, orch):
+        super().__init__()
+        self.setFormatter(orch.JsonFormatter())
+        self.addFilter(orch.LogContextFilter())
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def test_json_lines_carry_the_run_context(orch, run):
+    handler = Lines(orch)
+    orch.app.logger.addHandler(handler)
+    try:
+        assert run(request_id='json-log').status_code == 200
+    finally:
+        orch.app.logger.removeHandler(handler)
+    events = [orch.json.loads(line) for line in handler.lines]
+    assert all(e['request_id'] == 'json-log' and e['level'] and e['ts'] for e in events)
+    responded = [e for e in events if e['msg'].startswith('Agent cfa responded')]
+    assert len(responded) == 1
+    assert responded[0]['agent'] == 'cfa'
+    assert {'http_status': 200, 'attempt': 1}.items() <= responded[0].items()
+    assert isinstance(responded[0]['duration_s'], float)
+    finished = [e for e in events if e['msg'].startswith('RUN finished')]
+    assert finished[0]['status'] == 'ok' and 'agent' not in finished[0]
@@ -0,0 +1,42 @@
+def scrape(client):
+    r = client.get('/metrics')
+    assert r.status_code == 200 and r.mimetype == 'text/plain'
+    samples = {}
+    for line in r.data.decode().splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return r.data.decode(), samples
+
+
+def delta(before, after, name):
+    return after.get(name, 0.0) - before.get(name, 0.0)
+
+
+def test_metrics_count_calls_runs_and_cache_hits(client, run):
+    _, before = scrape(client)
+    assert run(request_id='metrics-1').status_code == 200
+    assert run(request_id='metrics-2').status_code == 200
+    text, after = scrape(client)
+    assert '# TYPE eva_agent_calls_total counter' in text
+    assert '# TYPE eva_agent_call_duration_seconds histogram' in text
+    assert delta(before, after, 'eva_agent_calls_total{agent="mdc",status="ok",source="agent"}') == 1
+    assert delta(before, after, 'eva_agent_calls_total{agent="mar",status="ok",source="cache"}') == 1
+    assert delta(before, after, 'eva_agent_calls_total{agent="cfa",status="ok",source="agent"}') == 2
+    assert delta(before, after, 'eva_agent_call_duration_seconds_count{agent="cfa"}') == 2
+    assert delta(before, after, 'eva_agent_call_duration_seconds_bucket{agent="cfa",le="+Inf"}') == 2
+    assert delta(before, after, 'eva_runs_total{status="ok"}') == 2
+    assert delta(before, after, 'eva_pipeline_duration_seconds_count') == 2
+    assert delta(before, after, 'eva_cache_hits_total') >= 1
+    assert after['eva_runs_in_flight'] == 0
+
+
+def test_metrics_report_failed_runs_and_circuit_state(orch, client, run, mocks):
+    orch.agent_policy['mar']['breaker_threshold'] = 1
+    mocks['mar'].faults['http_error_rate'] = 1.0
+    _, before = scrape(client)
+    assert run(request_id='metrics-err').status_code == 500
+    _, after = scrape(client)
+    assert delta(before, after, 'eva_runs_total{status="error"}') == 1
+    assert delta(before, after, 'eva_agent_calls_total{agent="mar",status="error",source="agent"}') == 1
+    assert after['eva_circuit_open{agent="mar"}'] == 2
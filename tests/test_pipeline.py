@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+AGENT_ORDER = ['mdc', 'mar', 'cfa', 'cps', 'mbo', 'ftm']
+
+
+@pytest.mark.parametrize('async_http', [False, True], ids=['sync', 'async'])
+def test_run_returns_full_provenance(orch, run, monkeypatch, async_http):
+    monkeypatch.setattr(orch, 'USE_ASYNC_HTTP', async_http)
+    r = run()
+    assert r.status_code == 200
+    report = r.get_json()
+    assert report['status'] == 'ok'
+    assert [e['agent'] for e in report['provenance']] == AGENT_ORDER
+    assert report['aggregated_outputs']['metrics_summary']['totals']['impressions'] == 1000.0
+    assert report['quality_gates']['passed']
+
+
+def test_dependents_receive_upstream_data(run, received):
+    assert run().status_code == 200
+    mdc_rows = received['mar'][0]['payload']['input_data']
+    assert [(row['campaign_id'], row['date']) for row in mdc_rows] == [(101, '2025-11-28')]
+    # cfa, cps and ftm all depend on mar in agent_policy.yml
+    for name in ('cfa', 'cps', 'ftm'):
+        assert received[name][0]['payload']['input_data'][0]['metrics_summary']['ctr'] == 0.05
+
+
+def test_repeat_run_served_from_cache_and_store(run, received):
+    assert run().status_code == 200
+    report = run().get_json()
+    calls = {e['agent']: e['call_meta'] for e in report['provenance']}
+    assert calls['mdc']['incremental']['fetched_days'] == 0
+    assert calls['mar']['cache'] == 'hit'
+    assert len(received['mdc']) == 1
+
+
+def test_sharding_splits_the_window(orch, run, received):
+    orch.agent_policy['mdc']['shard_days'] = 1
+    report = run(date_from='2025-11-01', date_to='2025-11-03').get_json()
+    shards = report['provenance'][0]['call_meta']['shards']
+    assert [(s['date_from'], s['date_to']) for s in shards] == [('2025-11-01', '2025-11-01'), ('2025-11-02', '2025-11-02'),
+                                                                 ('2025-11-03', '2025-11-03')]
+    assert sorted(b['payload']['date_from'] for b in received['mdc']) == ['2025-11-01', '2025-11-02', '2025-11-03']
+
+
+def test_incremental_fetches_only_new_days(run):
+    assert run(date_from='2025-11-01', date_to='2025-11-03').status_code == 200
+    report = run(date_from='2025-11-02', date_to='2025-11-04').get_json()
+    assert report['provenance'][0]['call_meta']['incremental'] == {'days': 3, 'stored_days': 2, 'fetched_days': 1, 'open_days': 0,
+                                                                  'calls': 1}
+
+
+def test_breaker_opens_after_consecutive_failures(orch, mocks, run):
+    orch.agent_policy['mar']['breaker_threshold'] = 2
+    mocks['mar'].faults['http_error_rate'] = 1.0
+    for _ in range(2):
+        assert run().status_code == 500
+    report = run().get_json()
+    mar = report['provenance'][1]
+    assert mar['call_meta'].get('circuit') == 'open'
+    assert mar['issues'][0]['type'] == 'circuit_open'
+
+
+def test_resume_reruns_only_missing_agents(mocks, run, client, received):
+    mocks['cfa'].faults['error_rate'] = 1.0
+    r = run(request_id='resume-1')
+    assert r.status_code == 500
+    assert r.get_json()['resume_url'] == '/run/resume-1/resume'
+    mocks['cfa'].faults['error_rate'] = 0.0
+
+    r = client.post('/run/resume-1/resume')
+    assert r.status_code == 200
+    report = r.get_json()
+    assert report['status'] == 'ok'
+    assert {'mdc', 'mar'} <= set(report['resumed']['restored_agents'])
+    assert 'cfa' not in report['resumed']['restored_agents']
+    assert len(received['mdc']) == 1
+    assert client.post('/run/resume-1/resume').status_code == 409
+
+
+def test_single_flight_only_joins_runs_with_the_same_budget_and_trace(orch, mocks):
+    mocks['mdc'].faults['latency_ms'] = 300.0
+    variants = [{}, {'trace': True}, {'budget_s': 30}, {}]
+    reports = [None] * len(variants)
+
+    def post(i):
+        body = {'job': 'daily_summary', 'request_id': f'sf-{i}', 'date_from': '2025-11-28', 'date_to': '2025-11-28',
+                'campaign_ids': [101], 'channels': ['email'], **variants[i]}
+        reports[i] = orch.app.test_client().post('/run', json=body).get_json()
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(variants))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert 'coalesced_with' not in reports[1] and 'coalesced_with' not in reports[2]
+    assert 'trace' in reports[1]
+    assert {reports[0].get('coalesced_with'), reports[3].get('coalesced_with')} in ({None, 'sf-0'}, {None, 'sf-3'})
+
+
+def test_single_flight_ignores_id_order_and_followers_get_no_resume_url(orch, mocks):
+    mocks['mdc'].faults['latency_ms'] = 300.0
+    mocks['cfa'].faults['error_rate'] = 1.0
+    campaigns = [[101, 102], [102, 101]]
+    responses = [None] * len(campaigns)
+
+    def post(i):
+        body = {'job': 'daily_summary', 'request_id': f'order-{i}', 'date_from': '2025-11-28', 'date_to': '2025-11-28',
+                'campaign_ids': campaigns[i], 'channels': ['sms', 'email'][::1 - 2 * i]}
+        responses[i] = orch.app.test_client().post('/run', json=body)
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(campaigns))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [r.status_code for r in responses] == [500, 500]
+    reports = [r.get_json() for r in responses]
+    follower, leader = sorted(reports, key=lambda r: 'coalesced_with' not in r)
+    assert follower['coalesced_with'] == leader['request_id']
+    assert 'resume_url' not in follower
+    assert leader['resume_url'] == f"/run/{leader['request_id']}/resume"
@@ -0,0 +1,49 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class KeepAlive(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pools(orch, monkeypatch):
+    """Fresh session registries, so the test sees only its own connections."""
+    for registry in ('_sessions', '_async_sessions', '_pool_sizes', '_pool_active'):
+        monkeypatch.setattr(orch, registry, {})
+    return orch
+
+
+def test_keep_alive_connections_are_reused_and_reported(pools, client):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAlive)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        pools.agent_policy['probe'] = {'pool_size': 3}
+        for _ in range(3):
+            assert pools.pooled_post('probe', f'http://127.0.0.1:{server.server_port}/run', data=b'{}').status_code == 200
+    finally:
+        server.shutdown()
+    body = client.get('/diagnostics/pools').get_json()
+    assert body['engine'] == pools.ENGINE
+    assert body['pools']['probe'] == {'pool_size': 3, 'active': 0, 'idle': 1, 'opened': 1, 'requests': 3, 'reused': 2}
+
+
+def test_each_agent_gets_its_own_pool(pools, run):
+    assert run().status_code == 200
+    stats = pools.pool_stats()
+    assert sorted(stats) == sorted(name for name, _ in pools.AGENTS)
+    assert all(s['requests'] >= 1 and s['active'] == 0 and s['pool_size'] == pools.DEFAULT_POOL_SIZE
+               for s in stats.values())
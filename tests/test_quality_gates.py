@@ -0,0 +1,41 @@
+PAYLOAD = {'campaign_ids': [101, 102], 'date_from': '2025-11-01', 'date_to': '2025-11-02', 'channels': ['email']}
+
+
+def row(campaign, date, impressions=100, confidence=0.9):
+    return {'campaign_id': campaign, 'date': date, 'channel': 'email',
+            'metrics': {'impressions': impressions}, 'confidence': confidence}
+
+
+def test_completeness_counts_distinct_expected_cells(orch):
+    rows = [row(101, '2025-11-01'), row(101, '2025-11-01T00:00:00Z'), row(102, '2025-11-02'),
+            row(103, '2025-11-01'), 'junk']
+    gates = orch.quality_gates(PAYLOAD, iter(rows), [])
+    assert (gates['expected_cells'], gates['present_cells'], gates['completeness']) == (4, 2, 0.5)
+    assert gates['rows'] == 4
+    assert gates['failed'] == ['completeness'] and gates['passed'] is False
+
+
+def test_confidence_is_impressions_weighted(orch):
+    rows = [row(101, '2025-11-01', 900, 0.9), row(102, '2025-11-01', 100, 0.5),
+            row(101, '2025-11-02', 0, 0.0), row(102, '2025-11-02', 0, 0.0)]
+    gates = orch.quality_gates(PAYLOAD, iter(rows), [])
+    assert gates['confidence'] == 0.86 and gates['completeness'] == 1.0 and gates['passed'] is True
+
+
+def test_issue_score_uses_policy_weights_and_thresholds(orch):
+    orch.agent_policy['quality_gates'] = {'max_issue_score': 5, 'min_confidence': 0.95,
+                                          'severity_weights': {'medium': 2}}
+    rows = [row(c, d) for c in (101, 102) for d in ('2025-11-01', '2025-11-02')]
+    provenance = [{'issues': [{'severity': 'high'}, {'severity': 'medium'}]}, {'issues': [{'note': 'no severity'}]}]
+    gates = orch.quality_gates(PAYLOAD, iter(rows), provenance)
+    assert gates['issue_score'] == 13.0
+    assert gates['issues_by_severity'] == {'high': 1, 'medium': 1, 'low': 1}
+    assert gates['thresholds'] == {'min_completeness': 0.9, 'min_confidence': 0.95, 'max_issue_score': 5}
+    assert gates['failed'] == ['confidence', 'issues']
+
+
+def test_failed_gates_are_noted_in_the_report(orch, run):
+    orch.agent_policy['quality_gates'] = {'min_confidence': 0.99}
+    report = run().get_json()
+    assert report['quality_gates']['failed'] == ['confidence']
+    assert 'Quality gates failed: confidence.' in report['notes']
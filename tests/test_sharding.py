@@ -0,0 +1,16 @@
+def test_cancelled_shards_do_not_trip_the_breaker(orch, mocks, run):
+    orch.agent_policy['mdc'].update({'shard_campaigns': 1, 'shard_concurrency': 8, 'breaker_threshold': 2})
+    campaigns = list(range(1, 9))
+    # every shard fails with a normal error reply, at different times; the first one cancels the rest
+    mocks['mdc'].faults.update({'error_rate': 1.0, 'latency_ms': 0.0, 'jitter_ms': 300.0})
+    assert run(campaign_ids=campaigns).status_code == 500
+
+    breaker = orch.get_breaker('mdc')
+    assert breaker.state == 'closed' and breaker.failures == 0
+    limiter = orch.get_limiter('mdc')
+    assert limiter.in_flight == 0 and not limiter.waiters
+
+    mocks['mdc'].faults['error_rate'] = 0.0
+    report = run(campaign_ids=campaigns, request_id='after').get_json()
+    assert report['provenance'][0]['status'] == 'ok'
+    assert 'circuit' not in report['provenance'][0]['call_meta']
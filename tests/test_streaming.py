@@ -0,0 +1,46 @@
+import json
+
+AGENTS = ['mdc', 'mar', 'cfa', 'cps', 'mbo', 'ftm']
+BODY = {'job': 'daily_summary', 'request_id': 'stream-1', 'date_from': '2025-11-28', 'date_to': '2025-11-28',
+        'campaign_ids': [101], 'channels': ['email']}
+
+
+def ndjson(r):
+    return [json.loads(line) for line in r.data.decode().splitlines()]
+
+
+def sse(r):
+    events = []
+    for block in r.data.decode().split('\n\n'):
+        if block:
+            event, data = block.split('\n')
+            events.append({'event': event[len('event: '):], 'data': json.loads(data[len('data: '):])})
+    return events
+
+
+def test_ndjson_streams_each_agent_then_the_final_report(client):
+    r = client.post('/run', json=BODY, headers={'Accept': 'application/x-ndjson'})
+    assert r.status_code == 200 and r.mimetype == 'application/x-ndjson'
+    events = ndjson(r)
+    assert [e['event'] for e in events] == ['provenance'] * len(AGENTS) + ['final_report']
+    assert sorted(e['data']['agent'] for e in events[:-1]) == sorted(AGENTS)
+    final = events[-1]['data']
+    assert final['http_status'] == 200 and final['status'] == 'ok' and final['request_id'] == 'stream-1'
+    assert 'provenance' not in final and 'metrics_summary' in final['aggregated_outputs']
+
+
+def test_sse_by_query_carries_the_failing_status(client, mocks):
+    mocks['cfa'].faults['error_rate'] = 1.0
+    r = client.post('/run?stream=sse', json=BODY)
+    assert r.mimetype == 'text/event-stream'
+    events = sse(r)
+    entries = {e['data']['agent']: e['data'] for e in events[:-1]}
+    assert [e['data']['agent'] for e in events[:2]] == ['mdc', 'mar']
+    assert entries['cfa']['status'] == 'error'
+    assert events[-1]['event'] == 'final_report'
+    assert events[-1]['data']['http_status'] == 500 and events[-1]['data']['status'] == 'error'
+
+
+def test_event_stream_accept_header_selects_sse(client):
+    r = client.post('/run', json=BODY, headers={'Accept': 'text/event-stream'})
+    assert sse(r)[-1]['data']['http_status'] == 200
@@ -0,0 +1,23 @@
+import builtins
+import json
+import threading
+
+
+def test_traces_are_written_off_the_engine_loop(orch, run, tmp_path, monkeypatch):
+    path = tmp_path / 'traces.jsonl'
+    writers = []
+
+    def spy_open(file, *args, **kwargs):
+        if str(file) == str(path):
+            writers.append(threading.current_thread().name)
+        return builtins.open(file, *args, **kwargs)
+
+    monkeypatch.setattr(orch, 'TRACE_FILE', str(path))
+    monkeypatch.setattr(orch, 'open', spy_open, raising=False)
+    for i in range(2):
+        assert run(request_id=f'traced-{i}').status_code == 200
+    orch.flush_traces()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [t['request_id'] for t in lines] == ['traced-0', 'traced-1']
+    assert lines[0]['spans'][0]['name'] == 'run'
+    assert writers and 'orchestrator-engine' not in writers
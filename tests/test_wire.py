@@ -0,0 +1,21 @@
+def test_passthrough_data_reaches_a_msgpack_agent_as_records(orch, run, received):
+    orch.agent_policy['mdc'].update({'passthrough': True, 'incremental': False})
+    orch._wire_caps['mar'] = {'formats': {'msgpack', 'json'}, 'encodings': {'gzip'}}
+    assert run().status_code == 200
+    rows = received['mar'][0]['payload']['input_data']
+    assert isinstance(rows, list) and rows[0]['metrics']['impressions'] == 1000
+
+
+def test_agent_requests_use_msgpack_once_negotiated(orch):
+    # pinned: DATA_PASSTHROUGH=1 in the environment would force json
+    orch.agent_policy['mar']['passthrough'] = False
+    orch._wire_caps['mar'] = {'formats': {'msgpack', 'json'}, 'encodings': set()}
+    req = orch.agent_request('job', {'input_data': [{'a': 1}]})
+    body, headers = orch.encode_agent_request('mar', req)
+    assert headers['Content-Type'] == 'application/msgpack'
+    assert orch.msgpack.unpackb(body, raw=False)['payload'] == {'input_data': [{'a': 1}]}
+
+    req = orch.agent_request('job', {'input_data': orch.RawJSON(b'[{"a":1}]')})
+    body, headers = orch.encode_agent_request('mar', req)
+    assert headers['Content-Type'] == 'application/json'
+    assert orch.json.loads(body)['payload'] == {'input_data': [{'a': 1}]}